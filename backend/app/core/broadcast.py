@@ -0,0 +1,129 @@
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# memory: 单进程 (开发 / 测试)；redis: 多 worker / 多副本之间互相转发
+BROADCAST_BACKEND = os.getenv("BROADCAST_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+
+MessageHandler = Callable[[str, str], Awaitable[None]]
+
+
+class BroadcastBackend:
+    """
+    发布 / 订阅的抽象：publish() 把消息发到频道，
+    每个订阅了这个频道的进程都会用 (channel, data) 调用自己的 handler。
+    """
+
+    def __init__(self) -> None:
+        self._handler: Optional[MessageHandler] = None
+        self.channels: Set[str] = set()
+
+    def set_handler(self, handler: MessageHandler) -> None:
+        self._handler = handler
+
+    async def _dispatch(self, channel: str, data: str) -> None:
+        if self._handler is None:
+            return
+        try:
+            await self._handler(channel, data)
+        except Exception:
+            logger.exception(f"Broadcast handler failed for {channel}")
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    async def publish(self, channel: str, data: str) -> None:
+        raise NotImplementedError
+
+    async def subscribe(self, channel: str) -> None:
+        self.channels.add(channel)
+
+    async def unsubscribe(self, channel: str) -> None:
+        self.channels.discard(channel)
+
+
+class MemoryBroadcast(BroadcastBackend):
+    """进程内实现：publish 直接回调本进程的 handler，给测试和单 worker 部署用"""
+
+    async def publish(self, channel: str, data: str) -> None:
+        if channel in self.channels:
+            await self._dispatch(channel, data)
+
+
+class RedisBroadcast(BroadcastBackend):
+    """Redis pub/sub 实现：每个进程只订阅本地有连接的频道，收到后只转发给本地 socket"""
+
+    def __init__(self, url: str) -> None:
+        super().__init__()
+        self.url = url
+        self._redis = None
+        self._pubsub = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        import redis.asyncio as aioredis
+
+        self._redis = aioredis.from_url(self.url, decode_responses=True)
+        self._pubsub = self._redis.pubsub()
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def stop(self) -> None:
+        if self._reader:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+        if self._pubsub:
+            await self._pubsub.aclose()
+        if self._redis:
+            await self._redis.aclose()
+
+    async def publish(self, channel: str, data: str) -> None:
+        await self._redis.publish(channel, data)
+
+    async def subscribe(self, channel: str) -> None:
+        if channel not in self.channels:
+            self.channels.add(channel)
+            await self._pubsub.subscribe(channel)
+
+    async def unsubscribe(self, channel: str) -> None:
+        if channel in self.channels:
+            self.channels.discard(channel)
+            await self._pubsub.unsubscribe(channel)
+
+    async def _read_loop(self) -> None:
+        while True:
+            try:
+                if not self.channels:
+                    await asyncio.sleep(0.2)
+                    continue
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message and message.get("type") == "message":
+                    await self._dispatch(message["channel"], message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 连接断开：等一下再重新订阅当前的所有频道
+                logger.error(f"Redis pub/sub error: {e}")
+                await asyncio.sleep(1.0)
+                try:
+                    if self.channels:
+                        await self._pubsub.subscribe(*self.channels)
+                except Exception:
+                    pass
+
+
+def create_backend(kind: str = BROADCAST_BACKEND) -> BroadcastBackend:
+    if kind == "redis":
+        return RedisBroadcast(REDIS_URL)
+    if kind == "memory":
+        return MemoryBroadcast()
+    raise ValueError(f"Unknown BROADCAST_BACKEND: {kind}")
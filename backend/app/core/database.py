@@ -1,10 +1,23 @@
+import io
 import os
+import re
+import time
+import asyncio
+import threading
+from collections import deque
+from functools import lru_cache
+from uuid import UUID
+import asyncpg
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import psycopg2.extensions
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor, execute_values as _execute_values
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
-from contextlib import contextmanager
-from typing import Any, Dict, Iterable, Optional
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from app.core.query_stats import record_query
 
 # ==========================================
 # 1. 配置与连接信息
@@ -33,52 +46,561 @@ def get_db():
         db.close()
 
 # ==========================================
-# 3. Raw SQL Helpers (用于高性能查询)
-#    (迁移自原来的 pg_db.py)
+# 3. 连接池 (Raw SQL 共享)
+#    所有 raw SQL helper 都从这里借连接，避免每次查询都重新握手
 # ==========================================
+POSTGRES_POOL_MIN = int(os.getenv("POSTGRES_POOL_MIN", "1"))
+POSTGRES_POOL_MAX = int(os.getenv("POSTGRES_POOL_MAX", "10"))
+POSTGRES_POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", "5"))
+# 连接空闲超过这个秒数后，借出前先 SELECT 1 做健康检查
+POSTGRES_POOL_CHECK_IDLE = float(os.getenv("POSTGRES_POOL_CHECK_IDLE", "30"))
+
+
+class PoolTimeout(RuntimeError):
+    """在 wait timeout 内没有借到连接"""
+
+
+class _TimedCursor(RealDictCursor):
+    """每条语句的耗时 / 行数按 SQL 指纹记到 query_stats 里"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        failed = False
+        try:
+            return super().execute(query, vars)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            record_query(query, time.perf_counter() - started, rows=self.rowcount, error=failed)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        failed = False
+        try:
+            return super().copy_expert(sql, file, size)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            record_query(sql, time.perf_counter() - started, rows=self.rowcount, error=failed)
+
 
 def _get_raw_conn():
     return psycopg2.connect(
         host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
         dbname=POSTGRES_DB,
         user=POSTGRES_USER,
         password=POSTGRES_PASSWORD,
-        cursor_factory=RealDictCursor,
+        cursor_factory=_TimedCursor,
     )
 
+
+class ConnectionPool:
+    """
+    有上限、线程安全的 psycopg2 连接池。
+
+    - min_size 个连接在第一次使用时预热，最多同时存在 max_size 个
+    - 借出时如果连接已断开或空闲太久没通过 SELECT 1，就丢弃并重建
+    - 池满时最多等待 timeout 秒，超时抛 PoolTimeout
+    """
+
+    def __init__(self, min_size: int, max_size: int, timeout: float, check_idle: float) -> None:
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min={min_size}, max={max_size}")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_idle = check_idle
+
+        self._cond = threading.Condition()
+        self._idle: Deque[Tuple[Any, float]] = deque()  # (conn, returned_at)
+        self._size = 0  # 已创建且未关闭的连接数 (idle + in use)
+        self._warmed = False
+        self._closed = False
+
+        # stats
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._discarded = 0
+
+    def _warm_up(self) -> None:
+        # 在锁外建连接，握手期间不阻塞其它线程
+        with self._cond:
+            if self._warmed:
+                return
+            self._warmed = True
+            missing = max(0, self.min_size - self._size)
+            self._size += missing
+        for _ in range(missing):
+            try:
+                conn = _get_raw_conn()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def _is_healthy(self, conn, idle_for: float) -> bool:
+        if conn.closed:
+            return False
+        if idle_for < self.check_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._discarded += 1
+            self._cond.notify()
+
+    def getconn(self):
+        if not self._warmed:
+            self._warm_up()
+
+        deadline = time.monotonic() + self.timeout
+        waited = 0.0
+        while True:
+            conn = None
+            create = False
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                if not self._idle and self._size >= self.max_size:
+                    started = time.monotonic()
+                    self._waits += 1
+                    while not self._idle and self._size >= self.max_size:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._timeouts += 1
+                            raise PoolTimeout(
+                                f"No database connection available within {self.timeout}s "
+                                f"(max_size={self.max_size})"
+                            )
+                        self._cond.wait(remaining)
+                    waited += time.monotonic() - started
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                else:
+                    self._size += 1
+                    create = True
+
+            if create:
+                try:
+                    conn = _get_raw_conn()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_healthy(conn, time.monotonic() - returned_at):
+                self._discard(conn)
+                continue
+
+            with self._cond:
+                self._checkouts += 1
+                self._wait_time_total += waited
+                self._wait_time_max = max(self._wait_time_max, waited)
+            return conn
+
+    def putconn(self, conn, discard: bool = False) -> None:
+        if discard or conn.closed or self._closed:
+            self._discard(conn)
+            return
+        try:
+            # 保证还回去的连接不带着未结束的事务
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": self._size - idle,
+                "idle": idle,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "wait_time_total_ms": round(self._wait_time_total * 1000, 3),
+                "wait_time_max_ms": round(self._wait_time_max * 1000, 3),
+                "wait_time_avg_ms": round(self._wait_time_total * 1000 / self._checkouts, 3) if self._checkouts else 0.0,
+            }
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    min_size=POSTGRES_POOL_MIN,
+                    max_size=POSTGRES_POOL_MAX,
+                    timeout=POSTGRES_POOL_TIMEOUT,
+                    check_idle=POSTGRES_POOL_CHECK_IDLE,
+                )
+    return _pool
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    return get_pool().stats()
+
+# ==========================================
+# 4. Raw SQL Helpers (用于高性能查询)
+#    (迁移自原来的 pg_db.py)
+# ==========================================
+
 @contextmanager
 def get_cursor():
-    conn = _get_raw_conn()
+    pool = get_pool()
+    conn = pool.getconn()
+    broken = False
     try:
         cur = conn.cursor()
         yield cur
         conn.commit()
     except Exception:
-        conn.rollback()
+        try:
+            conn.rollback()
+        except Exception:
+            broken = True
         raise
+    finally:
+        pool.putconn(conn, discard=broken or conn.closed)
+
+@contextmanager
+def get_autocommit_cursor():
+    """
+    单独建一个 autocommit 连接 (不进连接池)，给不能放在事务块里的语句用，
+    例如 DETACH PARTITION ... CONCURRENTLY、CREATE INDEX CONCURRENTLY。
+    """
+    conn = _get_raw_conn()
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            yield cur
     finally:
         conn.close()
 
-def fetch_one(query: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
-    with get_cursor() as cur:
-        cur.execute(query, params or {})
-        row = cur.fetchone()
+def _copy_field(value: Any) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    text = value if isinstance(value, str) else str(value)
+    return (
+        text.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class _CopyRowsReader(io.TextIOBase):
+    """把行迭代器包装成 copy_expert 能读的文件对象 (COPY text 格式)"""
+
+    def __init__(self, rows: Iterable[Sequence[Any]]) -> None:
+        self._lines: Iterator[str] = (
+            "\t".join(_copy_field(v) for v in row) + "\n" for row in rows
+        )
+        self._buffer = ""
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._lines)
+            except StopIteration:
+                break
+        if size < 0:
+            chunk, self._buffer = self._buffer, ""
+        else:
+            chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+class UnitOfWork:
+    """
+    在同一个连接、同一个事务里执行多条语句。
+    由 unit_of_work() 创建，退出 with 时统一 commit，任何一步出错都整体回滚。
+    """
+
+    def __init__(self, cur) -> None:
+        self.cur = cur
+
+    def fetch_one(self, query: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        self.cur.execute(query, params or {})
+        row = self.cur.fetchone()
         return dict(row) if row else None
 
-def fetch_all(query: str, params: Optional[Dict[str, Any]] = None) -> Iterable[Dict[str, Any]]:
-    with get_cursor() as cur:
-        cur.execute(query, params or {})
-        rows = cur.fetchall()
-        return [dict(r) for r in rows]
+    def fetch_all(self, query: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        self.cur.execute(query, params or {})
+        return [dict(r) for r in self.cur.fetchall()]
 
-def execute(query: str, params: Optional[Dict[str, Any]] = None) -> None:
-    with get_cursor() as cur:
-        cur.execute(query, params or {})
+    def execute(self, query: str, params: Optional[Dict[str, Any]] = None) -> int:
+        self.cur.execute(query, params or {})
+        return self.cur.rowcount
 
-def fetch_one_returning(query: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-    with get_cursor() as cur:
-        cur.execute(query, params or {})
-        row = cur.fetchone()
+    def fetch_one_returning(self, query: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        row = self.fetch_one(query, params)
         if not row:
             raise RuntimeError("No row returned from query")
-        return dict(row)
\ No newline at end of file
+        return row
+
+    def execute_values(
+        self,
+        query: str,
+        rows: Iterable[Sequence[Any]],
+        template: Optional[str] = None,
+        page_size: int = 1000,
+        fetch: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """
+        多行 VALUES 批量写入：query 里用一个 %s 代表整个 VALUES 列表，
+        每 page_size 行一次往返。fetch=True 时返回 RETURNING 的所有行。
+        """
+        rows = list(rows)
+        if not rows:
+            return []
+        result = _execute_values(self.cur, query, rows, template=template, page_size=page_size, fetch=fetch)
+        return [dict(r) for r in result] if fetch else []
+
+    def copy_rows(self, table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> int:
+        """
+        COPY ... FROM STDIN，边迭代边发送，适合大批量导入 (不需要先把所有行放进内存)。
+        """
+        stmt = sql.SQL("COPY {} ({}) FROM STDIN").format(
+            sql.Identifier(*table.split(".")),
+            sql.SQL(", ").join(sql.Identifier(c) for c in columns),
+        )
+        self.cur.copy_expert(stmt.as_string(self.cur), _CopyRowsReader(rows))
+        return self.cur.rowcount
+
+
+@contextmanager
+def unit_of_work():
+    with get_cursor() as cur:
+        yield UnitOfWork(cur)
+
+def fetch_one(query: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    with unit_of_work() as uow:
+        return uow.fetch_one(query, params)
+
+def fetch_all(query: str, params: Optional[Dict[str, Any]] = None) -> Iterable[Dict[str, Any]]:
+    with unit_of_work() as uow:
+        return uow.fetch_all(query, params)
+
+def execute(query: str, params: Optional[Dict[str, Any]] = None) -> int:
+    with unit_of_work() as uow:
+        return uow.execute(query, params)
+
+def fetch_one_returning(query: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    with unit_of_work() as uow:
+        return uow.fetch_one_returning(query, params)
+
+def execute_values(
+    query: str,
+    rows: Iterable[Sequence[Any]],
+    template: Optional[str] = None,
+    page_size: int = 1000,
+    fetch: bool = False,
+) -> List[Dict[str, Any]]:
+    with unit_of_work() as uow:
+        return uow.execute_values(query, rows, template=template, page_size=page_size, fetch=fetch)
+
+def copy_rows(table: str, columns: Sequence[str], rows: Iterable[Sequence[Any]]) -> int:
+    with unit_of_work() as uow:
+        return uow.copy_rows(table, columns, rows)
+
+# ==========================================
+# 5. Async Raw SQL Helpers (asyncpg)
+#    给 WebSocket 和 async 路由用，不占用事件循环也不占用线程池
+# ==========================================
+POSTGRES_ASYNC_POOL_MIN = int(os.getenv("POSTGRES_ASYNC_POOL_MIN", "1"))
+POSTGRES_ASYNC_POOL_MAX = int(os.getenv("POSTGRES_ASYNC_POOL_MAX", "10"))
+
+_PYFORMAT_RE = re.compile(r"%\((\w+)\)s|%%")
+
+_async_pool: Optional[asyncpg.Pool] = None
+_async_pool_lock: Optional[asyncio.Lock] = None
+
+
+@lru_cache(maxsize=512)
+def _to_asyncpg_query(query: str) -> Tuple[str, Tuple[str, ...]]:
+    """
+    把 psycopg2 风格的 %(name)s 参数改写成 asyncpg 的 $1, $2 ...
+    这样同一条 SQL 字符串在同步 / 异步 helper 里都能直接用。
+    """
+    names: List[str] = []
+
+    def _sub(m: "re.Match[str]") -> str:
+        name = m.group(1)
+        if name is None:
+            return "%"
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    return _PYFORMAT_RE.sub(_sub, query), tuple(names)
+
+
+def _bind(query: str, params: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+    sql, names = _to_asyncpg_query(query)
+    params = params or {}
+    return sql, [params[n] for n in names]
+
+
+def _record_to_dict(record: asyncpg.Record) -> Dict[str, Any]:
+    # psycopg2 把 UUID 当字符串返回，这里保持一致，Pydantic 模型不用改
+    return {k: (str(v) if isinstance(v, UUID) else v) for k, v in record.items()}
+
+
+async def init_async_pool() -> asyncpg.Pool:
+    global _async_pool, _async_pool_lock
+    if _async_pool is not None:
+        return _async_pool
+    if _async_pool_lock is None:
+        _async_pool_lock = asyncio.Lock()
+    async with _async_pool_lock:
+        if _async_pool is None:
+            _async_pool = await asyncpg.create_pool(
+                host=POSTGRES_HOST,
+                port=int(POSTGRES_PORT),
+                database=POSTGRES_DB,
+                user=POSTGRES_USER,
+                password=POSTGRES_PASSWORD,
+                min_size=POSTGRES_ASYNC_POOL_MIN,
+                max_size=POSTGRES_ASYNC_POOL_MAX,
+            )
+    return _async_pool
+
+
+async def connect_async_listener() -> asyncpg.Connection:
+    """给 LISTEN 用的独立连接 (不占连接池，断线由调用方重连)"""
+    return await asyncpg.connect(
+        host=POSTGRES_HOST,
+        port=int(POSTGRES_PORT),
+        database=POSTGRES_DB,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+    )
+
+
+async def close_async_pool() -> None:
+    global _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+
+
+@asynccontextmanager
+async def get_async_conn():
+    pool = await init_async_pool()
+    async with pool.acquire(timeout=POSTGRES_POOL_TIMEOUT) as conn:
+        yield conn
+
+
+@asynccontextmanager
+async def _timed(sql: str, result: Dict[str, Any]):
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        record_query(sql, time.perf_counter() - started, rows=result.get("rows"), error=failed, source="async")
+
+
+def _status_rowcount(status: str) -> Optional[int]:
+    # asyncpg execute() 返回 "INSERT 0 3" / "UPDATE 2" 这样的命令标签
+    last = status.rsplit(" ", 1)[-1] if status else ""
+    return int(last) if last.isdigit() else None
+
+
+async def afetch_one(query: str, params: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    sql, args = _bind(query, params)
+    result: Dict[str, Any] = {}
+    async with get_async_conn() as conn:
+        async with _timed(sql, result):
+            row = await conn.fetchrow(sql, *args)
+            result["rows"] = 1 if row else 0
+    return _record_to_dict(row) if row else None
+
+async def afetch_all(query: str, params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    sql, args = _bind(query, params)
+    result: Dict[str, Any] = {}
+    async with get_async_conn() as conn:
+        async with _timed(sql, result):
+            rows = await conn.fetch(sql, *args)
+            result["rows"] = len(rows)
+    return [_record_to_dict(r) for r in rows]
+
+async def aexecute(query: str, params: Optional[Dict[str, Any]] = None) -> Optional[int]:
+    sql, args = _bind(query, params)
+    result: Dict[str, Any] = {}
+    async with get_async_conn() as conn:
+        async with _timed(sql, result):
+            status = await conn.execute(sql, *args)
+            result["rows"] = _status_rowcount(status)
+    return result["rows"]
+
+async def afetch_one_returning(query: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    row = await afetch_one(query, params)
+    if not row:
+        raise RuntimeError("No row returned from query")
+    return row
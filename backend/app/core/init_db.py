@@ -1,90 +1,101 @@
+import os
+import re
+import hashlib
 import logging
+from pathlib import Path
+from typing import List, Tuple
+
 # ✅ 从你现有的 database.py 导入 get_cursor 工具
-from app.core.database import get_cursor 
+from app.core.database import get_cursor
 
 logger = logging.getLogger("uvicorn")
 
-def init_tables():
+# backend/migrations/NNN_name.sql，按编号顺序执行，每个文件只执行一次
+MIGRATIONS_DIR = Path(os.getenv("MIGRATIONS_DIR", Path(__file__).resolve().parents[2] / "migrations"))
+_MIGRATION_FILE_RE = re.compile(r"^(\d+)_([\w\-]+)\.sql$")
+
+# 多个 uvicorn worker 同时启动时，用 advisory lock 保证同一时间只有一个在跑迁移
+_MIGRATION_LOCK_KEY = 560_001
+
+
+def _discover_migrations() -> List[Tuple[int, str, Path]]:
+    found = []
+    for path in MIGRATIONS_DIR.glob("*.sql"):
+        m = _MIGRATION_FILE_RE.match(path.name)
+        if not m:
+            logger.warning(f"Skipping migration with unexpected name: {path.name}")
+            continue
+        found.append((int(m.group(1)), m.group(2), path))
+    found.sort()
+
+    versions = [v for v, _, _ in found]
+    dupes = {v for v in versions if versions.count(v) > 1}
+    if dupes:
+        raise RuntimeError(f"Duplicate migration versions: {sorted(dupes)}")
+    return found
+
+
+def run_migrations() -> List[int]:
     """
-    初始化数据库表。
-    使用 CREATE TABLE IF NOT EXISTS 确保即使容器重启，数据也会保留在 Volume 中而不会报错。
+    执行 MIGRATIONS_DIR 里还没有记录在 schema_version 的 SQL 文件。
+    每个文件在自己的事务里执行，成功后写入 schema_version，失败整体回滚。
+    返回本次新执行的版本号。
     """
-    logger.info("Checking database tables...")
-    
-    # 按照依赖顺序排列建表语句
-    queries = [
-        # 1. Users (基础表)
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            username VARCHAR(50) UNIQUE NOT NULL,
-            user_code VARCHAR(20) UNIQUE NOT NULL,
-            password_hash VARCHAR(128) NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """,
-        # 2. Friend Requests (依赖 users)
-        """
-        CREATE TABLE IF NOT EXISTS friend_requests (
-            id SERIAL PRIMARY KEY,
-            from_user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            to_user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            status VARCHAR(20) DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(from_user_id, to_user_id)
-        );
-        """,
-        # 3. Friendships (依赖 users)
-        """
-        CREATE TABLE IF NOT EXISTS friendships (
-            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            friend_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (user_id, friend_id)
-        );
-        """,
-        # 4. Groups (依赖 users)
-        """
-        CREATE TABLE IF NOT EXISTS groups (
-            id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-            name VARCHAR(100) NOT NULL,
-            description TEXT,
-            created_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """,
-        # 5. Group Members (依赖 groups 和 users)
-        """
-        CREATE TABLE IF NOT EXISTS group_members (
-            group_id UUID REFERENCES groups(id) ON DELETE CASCADE,
-            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-            role VARCHAR(20) DEFAULT 'member', 
-            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (group_id, user_id)
-        );
-        """,
-        # 6. Group Messages (依赖 groups 和 users)
-        """
-        CREATE TABLE IF NOT EXISTS group_messages (
-            id SERIAL PRIMARY KEY,
-            group_id UUID REFERENCES groups(id) ON DELETE CASCADE,
-            user_id INTEGER REFERENCES users(id) ON DELETE SET NULL,
-            sender_display VARCHAR(50),
-            role VARCHAR(20) DEFAULT 'user',
-            content TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """
-    ]
+    # 先拿锁再建表：两个 worker 同时启动时并发的 CREATE TABLE IF NOT EXISTS 也会撞上 pg_type 的唯一约束
+    with get_cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%(k)s)", {"k": _MIGRATION_LOCK_KEY})
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                name TEXT NOT NULL,
+                checksum TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+            """
+        )
+
+    applied_now: List[int] = []
+    for version, name, path in _discover_migrations():
+        sql = path.read_text(encoding="utf-8")
+        checksum = hashlib.sha256(sql.encode("utf-8")).hexdigest()
 
-    try:
         with get_cursor() as cur:
-            # ✅ 如果你的 Postgres 镜像版本较低，可能需要手动开启 UUID 扩展
-            cur.execute('CREATE EXTENSION IF NOT EXISTS "pgcrypto";')
-            
-            for q in queries:
-                cur.execute(q)
-        logger.info("Database tables verified/initialized successfully.")
+            cur.execute("SELECT pg_advisory_xact_lock(%(k)s)", {"k": _MIGRATION_LOCK_KEY})
+            cur.execute("SELECT checksum FROM schema_version WHERE version = %(v)s", {"v": version})
+            row = cur.fetchone()
+            if row:
+                if row["checksum"] != checksum:
+                    logger.warning(f"Migration {path.name} changed after it was applied; not re-running it.")
+                continue
+
+            logger.info(f"Applying migration {path.name}...")
+            # 不带参数执行，SQL 文件里的 % 不会被当成占位符
+            del cur.connection.notices[:]
+            cur.execute(sql)
+            # 迁移里 RAISE WARNING / NOTICE 报告的问题 (比如需要人工处理的重复数据) 写进日志
+            for notice in cur.connection.notices:
+                logger.warning(f"{path.name}: {notice.strip()}")
+            cur.execute(
+                "INSERT INTO schema_version (version, name, checksum) VALUES (%(v)s, %(n)s, %(c)s)",
+                {"v": version, "n": name, "c": checksum},
+            )
+            applied_now.append(version)
+
+    return applied_now
+
+
+def init_tables():
+    """
+    启动时调用：把数据库迁移到最新的 schema。
+    表结构只在 backend/migrations/*.sql 里定义，已经执行过的版本会直接跳过。
+    """
+    logger.info("Checking database schema...")
+    try:
+        applied = run_migrations()
+        if applied:
+            logger.info(f"Applied migrations: {applied}")
+        logger.info("Database schema is up to date.")
     except Exception as e:
-        logger.error(f"Failed to initialize database tables: {e}")
-        raise e
\ No newline at end of file
+        logger.error(f"Failed to migrate database: {e}")
+        raise e
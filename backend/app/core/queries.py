@@ -0,0 +1,250 @@
+"""
+Hot-path SQL shared by the routers / services and the EXPLAIN regression check.
+
+路由里直接 import 这里的常量执行；tests/test_query_plans.py 和 app/script/check_query_plans.py
+对 HOT_QUERIES 里的每一条做 EXPLAIN，改了查询就会被同一份检查覆盖，不会和手抄的版本脱节。
+"""
+
+# ==========================================
+# 1. 消息历史
+# ==========================================
+
+GROUP_HEAD_SQL = "SELECT MAX(id) AS latest_id FROM group_messages WHERE group_id = %(gid)s"
+
+# 两条独立的语句，让 prepared statement 的通用计划都是纯索引倒序扫描
+GROUP_HISTORY_LATEST_SQL = (
+    "SELECT id, group_id, sender_display as sender, role, content, created_at FROM group_messages "
+    "WHERE group_id = %(gid)s ORDER BY id DESC LIMIT %(lim)s"
+)
+GROUP_HISTORY_BEFORE_SQL = (
+    "SELECT id, group_id, sender_display as sender, role, content, created_at FROM group_messages "
+    "WHERE group_id = %(gid)s AND id < %(before)s ORDER BY id DESC LIMIT %(lim)s"
+)
+GROUP_HISTORY_AFTER_SQL = (
+    "SELECT id, group_id, sender_display as sender, role, content, created_at FROM group_messages "
+    "WHERE group_id = %(gid)s AND id > %(after)s ORDER BY id ASC LIMIT %(lim)s"
+)
+
+RECENT_CONTEXT_SQL = (
+    "SELECT content FROM group_messages WHERE group_id = %(gid)s ORDER BY created_at DESC LIMIT %(lim)s"
+)
+
+# ==========================================
+# 2. 群 / 成员
+# ==========================================
+
+MY_GROUPS_SQL = (
+    "SELECT g.id, g.name, g.description, g.kind, g.created_at, gm.last_read_message_id, gm.unread_count "
+    "FROM groups g JOIN group_members gm ON g.id=gm.group_id WHERE gm.user_id=%(u)s ORDER BY g.created_at DESC"
+)
+
+MEMBER_ROLE_SQL = "SELECT role FROM group_members WHERE group_id = %(gid)s AND user_id = %(uid)s"
+
+GROUP_MEMBERS_SQL = (
+    "SELECT u.id as user_id, u.username, u.user_code, gm.role FROM group_members gm JOIN users u ON gm.user_id=u.id "
+    "WHERE gm.group_id=%(gid)s"
+)
+
+# outbox relay：本进程在线的用户里，哪些是这些群的成员 (主键 (group_id, user_id) 上的查找)
+GROUP_ACTIVITY_MEMBERS_SQL = (
+    "SELECT group_id, user_id FROM group_members "
+    "WHERE group_id = ANY(%(gids)s::uuid[]) AND user_id = ANY(%(uids)s::int[])"
+)
+
+# 未读数减去这段区间里别人发的消息条数，区间之后并发插入的新消息计数不受影响。
+# 目标 id 截到这个群当前最新的一条：客户端传来更大 (或别的群) 的 id 不能把游标推到还没写入的消息之后
+MARK_READ_SQL = """
+WITH latest AS (
+    SELECT COALESCE(MAX(id), 0) AS id FROM group_messages WHERE group_id = %(gid)s
+), target AS (
+    SELECT LEAST(COALESCE(%(mid)s::bigint, l.id), l.id) AS id FROM latest l
+)
+UPDATE group_members gm
+SET last_read_message_id = t.id,
+    unread_count = GREATEST(0, gm.unread_count - (
+        SELECT COUNT(*) FROM group_messages m
+        WHERE m.group_id = gm.group_id AND m.id > gm.last_read_message_id AND m.id <= t.id
+          AND m.user_id IS DISTINCT FROM gm.user_id
+    ))
+FROM target t
+WHERE gm.group_id = %(gid)s AND gm.user_id = %(me)s AND t.id > gm.last_read_message_id
+RETURNING gm.last_read_message_id, gm.unread_count
+"""
+
+READ_CURSOR_SQL = (
+    "SELECT last_read_message_id, unread_count FROM group_members WHERE group_id = %(gid)s AND user_id = %(me)s"
+)
+
+# 每个群的最后一条消息和成员数都走索引 (LATERAL + LIMIT 1 / 主键)
+BOOTSTRAP_SQL = """
+SELECT
+    (SELECT json_build_object('id', id, 'username', username, 'user_code', user_code)
+     FROM users WHERE id = %(me)s) AS profile,
+    (SELECT COALESCE(json_agg(json_build_object(
+                'id', g.id, 'name', g.name, 'description', g.description, 'kind', g.kind, 'created_at', g.created_at,
+                'last_read_message_id', gm.last_read_message_id, 'unread_count', gm.unread_count,
+                'member_count', mc.n,
+                'last_message', CASE WHEN lm.id IS NULL THEN NULL ELSE json_build_object(
+                    'id', lm.id, 'sender', lm.sender_display, 'role', lm.role,
+                    'content', LEFT(lm.content, %(preview)s), 'created_at', lm.created_at) END
+            ) ORDER BY g.created_at DESC), '[]'::json)
+     FROM group_members gm
+     JOIN groups g ON g.id = gm.group_id
+     CROSS JOIN LATERAL (SELECT COUNT(*) AS n FROM group_members x WHERE x.group_id = gm.group_id) mc
+     LEFT JOIN LATERAL (
+         SELECT id, sender_display, role, content, created_at FROM group_messages m
+         WHERE m.group_id = gm.group_id ORDER BY m.id DESC LIMIT 1
+     ) lm ON TRUE
+     WHERE gm.user_id = %(me)s) AS groups,
+    (SELECT COALESCE(json_agg(json_build_object('id', u.id, 'username', u.username, 'user_code', u.user_code)
+            ORDER BY u.username), '[]'::json)
+     FROM friendships f JOIN users u ON f.friend_id = u.id WHERE f.user_id = %(me)s) AS friends,
+    (SELECT COALESCE(json_agg(json_build_object(
+                'id', r.id, 'from_user_id', r.from_user_id, 'from_username', u.username,
+                'from_user_code', u.user_code, 'created_at', r.created_at) ORDER BY r.created_at), '[]'::json)
+     FROM friend_requests r JOIN users u ON r.from_user_id = u.id
+     WHERE r.to_user_id = %(me)s AND r.status = 'pending') AS requests
+"""
+
+# ==========================================
+# 3. 好友 / 私聊 / 用户
+# ==========================================
+
+FRIENDS_SQL = (
+    "SELECT u.id, u.username, u.user_code FROM friendships f JOIN users u ON f.friend_id = u.id WHERE f.user_id = %(me)s"
+)
+
+PENDING_REQUESTS_SQL = (
+    "SELECT r.id, r.from_user_id, u.username as from_username, u.user_code as from_user_code, r.created_at "
+    "FROM friend_requests r JOIN users u ON r.from_user_id = u.id WHERE r.to_user_id = %(me)s AND r.status = 'pending'"
+)
+
+# 查找目标 (走 LOWER(...) 唯一索引)、检查已有请求、插入请求合并成一条语句
+ADD_FRIEND_SQL = """
+WITH target AS (
+    SELECT id, username
+    FROM users
+    WHERE LOWER(user_code) = LOWER(%(term)s) OR LOWER(username) = LOWER(%(term)s)
+    LIMIT 1
+),
+existing AS (
+    SELECT r.id FROM friend_requests r, target t
+    WHERE (r.from_user_id = %(me)s AND r.to_user_id = t.id) OR (r.from_user_id = t.id AND r.to_user_id = %(me)s)
+),
+ins AS (
+    INSERT INTO friend_requests (from_user_id, to_user_id, status)
+    SELECT %(me)s, t.id, 'pending' FROM target t
+    WHERE t.id <> %(me)s AND NOT EXISTS (SELECT 1 FROM existing)
+    ON CONFLICT DO NOTHING
+    RETURNING id
+)
+SELECT t.id, t.username, (SELECT id FROM ins) AS request_id
+FROM target t
+"""
+
+# 前缀区间 [lo, hi) 用 ~>=~ / ~<~ 比较，预编译的通用计划也能走 text_pattern_ops 索引
+USER_PREFIX_SEARCH_SQL = """
+SELECT id, username, user_code FROM (
+    (SELECT id, username, user_code FROM users
+     WHERE LOWER(username) ~>=~ %(lo)s AND LOWER(username) ~<~ %(hi)s AND id <> %(me)s
+     ORDER BY LOWER(username) USING ~<~ LIMIT %(lim)s)
+    UNION
+    (SELECT id, username, user_code FROM users
+     WHERE LOWER(user_code) ~>=~ %(lo)s AND LOWER(user_code) ~<~ %(hi)s AND id <> %(me)s
+     ORDER BY LOWER(user_code) USING ~<~ LIMIT %(lim)s)
+) matches
+ORDER BY LOWER(username)
+LIMIT %(lim)s
+"""
+
+# 前缀全是 U+10FFFF 时没有上界，只保留下界 (同一条查询去掉 ~<~ 条件)
+USER_PREFIX_SEARCH_OPEN_SQL = (
+    USER_PREFIX_SEARCH_SQL
+    .replace(" AND LOWER(username) ~<~ %(hi)s", "")
+    .replace(" AND LOWER(user_code) ~<~ %(hi)s", "")
+)
+
+AUTH_LOOKUP_SQL = "SELECT id, username, user_code FROM users WHERE username = %(u)s AND user_code = %(c)s"
+
+DM_PAIR_SQL = "SELECT group_id FROM dm_pairs WHERE low_user_id=%(lo)s AND high_user_id=%(hi)s"
+
+# dm_pairs 主键就是这一对用户：先用预先生成的 uuid 抢占这一行 (FK 可延迟)，抢到了才建群并加入双方。
+# 两个请求同时到达时只有一个 INSERT 成功，另一个 ON CONFLICT 什么都不做。
+GET_OR_CREATE_DM_SQL = """
+WITH existing AS (
+    SELECT group_id FROM dm_pairs WHERE low_user_id=%(lo)s AND high_user_id=%(hi)s
+),
+friend AS (
+    SELECT username, gen_random_uuid() AS new_id FROM users
+    WHERE id=%(f)s AND NOT EXISTS (SELECT 1 FROM existing)
+),
+claimed AS (
+    INSERT INTO dm_pairs (low_user_id, high_user_id, group_id)
+    SELECT %(lo)s, %(hi)s, new_id FROM friend
+    ON CONFLICT DO NOTHING
+    RETURNING group_id
+),
+new_group AS (
+    INSERT INTO groups (id, name, description, created_by, kind)
+    SELECT claimed.group_id, 'DM: ' || %(me_name)s || ' & ' || friend.username, 'DM', %(me)s, 'dm'
+    FROM claimed CROSS JOIN friend
+    RETURNING id
+),
+members AS (
+    INSERT INTO group_members (group_id, user_id, role)
+    SELECT new_group.id, m.uid, 'admin' FROM new_group CROSS JOIN (VALUES (%(me)s), (%(f)s)) AS m(uid)
+)
+SELECT (SELECT group_id FROM existing) AS existing_id, (SELECT id FROM new_group) AS new_id,
+       EXISTS (SELECT 1 FROM friend) AS friend_found
+"""
+
+# ==========================================
+# 4. AI 任务队列
+# ==========================================
+
+# 跳过已经有任务在跑的群，保证每个群同时只有一个任务
+AI_JOB_DEQUEUE_SQL = """
+UPDATE ai_jobs SET status = 'running', attempts = attempts + 1, started_at = NOW(), locked_by = %(worker)s
+WHERE id = (
+    SELECT j.id FROM ai_jobs j
+    WHERE j.status = 'queued' AND j.run_after <= NOW()
+      AND NOT EXISTS (SELECT 1 FROM ai_jobs r WHERE r.group_id = j.group_id AND r.status = 'running')
+    ORDER BY j.priority, j.run_after, j.id
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id, kind, group_id, payload, priority, attempts, max_attempts,
+          EXTRACT(EPOCH FROM (deadline - NOW()))::float8 AS remaining_s,
+          EXTRACT(EPOCH FROM (started_at - created_at))::float8 AS waited_s
+"""
+
+# ==========================================
+# 5. EXPLAIN 检查用的样例参数
+# ==========================================
+
+SAMPLE_GROUP = "00000000-0000-0000-0000-000000000000"
+
+# 名字 -> (SQL, 样例参数)。EXPLAIN 不执行语句，写语句也可以放进来。
+HOT_QUERIES = {
+    "group history etag": (GROUP_HEAD_SQL, {"gid": SAMPLE_GROUP}),
+    "group history latest": (GROUP_HISTORY_LATEST_SQL, {"gid": SAMPLE_GROUP, "lim": 51}),
+    "group history before": (GROUP_HISTORY_BEFORE_SQL, {"gid": SAMPLE_GROUP, "before": 1000, "lim": 51}),
+    "group history delta": (GROUP_HISTORY_AFTER_SQL, {"gid": SAMPLE_GROUP, "after": 1000, "lim": 51}),
+    "recent context": (RECENT_CONTEXT_SQL, {"gid": SAMPLE_GROUP, "lim": 20}),
+    "my groups": (MY_GROUPS_SQL, {"u": 1}),
+    "member role": (MEMBER_ROLE_SQL, {"gid": SAMPLE_GROUP, "uid": 1}),
+    "group members": (GROUP_MEMBERS_SQL, {"gid": SAMPLE_GROUP}),
+    "group activity members": (GROUP_ACTIVITY_MEMBERS_SQL, {"gids": [SAMPLE_GROUP], "uids": [1, 2]}),
+    "mark read": (MARK_READ_SQL, {"gid": SAMPLE_GROUP, "me": 1, "mid": 1100}),
+    "read cursor": (READ_CURSOR_SQL, {"gid": SAMPLE_GROUP, "me": 1}),
+    "bootstrap": (BOOTSTRAP_SQL, {"me": 1, "preview": 120}),
+    "friends": (FRIENDS_SQL, {"me": 1}),
+    "pending requests": (PENDING_REQUESTS_SQL, {"me": 1}),
+    "add friend": (ADD_FRIEND_SQL, {"term": "alice", "me": 1}),
+    "user prefix search": (USER_PREFIX_SEARCH_SQL, {"lo": "al", "hi": "am", "me": 1, "lim": 10}),
+    "user prefix search (open)": (USER_PREFIX_SEARCH_OPEN_SQL, {"lo": "\U0010ffff", "me": 1, "lim": 10}),
+    "auth lookup": (AUTH_LOOKUP_SQL, {"u": "alice", "c": "1001"}),
+    "dm pair lookup": (DM_PAIR_SQL, {"lo": 1, "hi": 2}),
+    "get or create dm": (GET_OR_CREATE_DM_SQL, {"lo": 1, "hi": 2, "f": 2, "me": 1, "me_name": "alice"}),
+    "ai job dequeue": (AI_JOB_DEQUEUE_SQL, {"worker": "check"}),
+}
@@ -0,0 +1,118 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import Any, Deque, Dict, List, Optional
+
+from app.utils.metrics import LatencyWindow
+
+# 超过这个耗时 (毫秒) 的语句写入 slow query log
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# 内存里最多保留多少条慢查询记录 (给 /admin/slow-queries 用)
+SLOW_QUERY_KEEP = int(os.getenv("SLOW_QUERY_KEEP", "200"))
+
+slow_logger = logging.getLogger("hikebot.slow_query")
+
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_PARAM_RE = re.compile(r"%\(\w+\)s|%s|\$\d+")
+_NUMBER_RE = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_VALUES_RE = re.compile(r"(VALUES\s*\(\?\))(?:\s*,\s*\(\?\))+", re.I)
+_SPACE_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(query: str) -> str:
+    """
+    归一化 SQL：去掉注释和多余空白，字面量 / 参数换成 ?，
+    IN (?, ?, ?) 与多行 VALUES 折叠成一个，这样同一条语句的不同参数落在同一个 key 上。
+    """
+    q = _COMMENT_RE.sub(" ", query)
+    q = _STRING_RE.sub("?", q)
+    q = _PARAM_RE.sub("?", q)
+    q = _NUMBER_RE.sub("?", q)
+    q = _SPACE_RE.sub(" ", q).strip()
+    q = _IN_LIST_RE.sub("(?)", q)
+    q = _VALUES_RE.sub(r"\1", q)
+    return q
+
+
+class _QueryStat:
+    __slots__ = ("calls", "errors", "rows", "latency")
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.latency = LatencyWindow(window=1024)
+
+
+_stats: Dict[str, _QueryStat] = {}
+_slow: Deque[Dict[str, Any]] = deque(maxlen=SLOW_QUERY_KEEP)
+_lock = threading.Lock()
+
+
+def _as_text(query: Any) -> str:
+    if isinstance(query, bytes):
+        return query.decode("utf-8", "replace")
+    return query if isinstance(query, str) else str(query)
+
+
+def record_query(query: Any, duration: float, rows: Optional[int] = None, error: bool = False, source: str = "sync") -> None:
+    """记录一次语句执行；duration 单位为秒"""
+    fp = fingerprint(_as_text(query))
+    with _lock:
+        stat = _stats.get(fp)
+        if stat is None:
+            stat = _stats[fp] = _QueryStat()
+        stat.calls += 1
+        if error:
+            stat.errors += 1
+        if rows is not None and rows > 0:
+            stat.rows += rows
+    stat.latency.observe(duration)
+
+    duration_ms = duration * 1000
+    if duration_ms >= SLOW_QUERY_MS:
+        entry = {
+            "event": "slow_query",
+            "ts": time.time(),
+            "duration_ms": round(duration_ms, 3),
+            "rows": rows,
+            "error": error,
+            "source": source,
+            "fingerprint": fp,
+        }
+        with _lock:
+            _slow.append(entry)
+        slow_logger.warning(json.dumps(entry, ensure_ascii=False))
+
+
+def query_stats_snapshot(sort_by: str = "total_ms", limit: int = 50) -> List[Dict[str, Any]]:
+    with _lock:
+        items = list(_stats.items())
+    result = []
+    for fp, stat in items:
+        entry = {"fingerprint": fp, "calls": stat.calls, "errors": stat.errors, "rows": stat.rows}
+        entry.update(stat.latency.snapshot())
+        entry.pop("count", None)
+        entry["rows_per_call"] = round(stat.rows / stat.calls, 2) if stat.calls else 0.0
+        result.append(entry)
+    result.sort(key=lambda e: e.get(sort_by, 0), reverse=True)
+    return result[:limit]
+
+
+def slow_queries(limit: int = 50) -> List[Dict[str, Any]]:
+    with _lock:
+        return list(_slow)[-limit:][::-1]
+
+
+def reset_query_stats() -> None:
+    with _lock:
+        _stats.clear()
+        _slow.clear()
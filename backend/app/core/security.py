@@ -0,0 +1,138 @@
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import logging
+import secrets
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from app.models.sql_models import AuthUser
+from app.utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# ==========================================
+# 1. 签名的 session token (无需查库即可校验)
+# ==========================================
+AUTH_SECRET = os.getenv("AUTH_SECRET", "")
+# 示例配置里常见的占位值；用它们签名等于公开了密钥，任何人都能伪造 token
+_PLACEHOLDER_SECRETS = {"changeme", "change-me", "secret", "default", "password", "test", "dev"}
+_MIN_SECRET_LENGTH = 32
+if AUTH_SECRET and (AUTH_SECRET.strip().lower() in _PLACEHOLDER_SECRETS or len(AUTH_SECRET) < _MIN_SECRET_LENGTH):
+    raise RuntimeError(
+        f"AUTH_SECRET is a placeholder or shorter than {_MIN_SECRET_LENGTH} characters; "
+        "set a random value (e.g. `python -c 'import secrets; print(secrets.token_hex(32))'`)"
+    )
+# 没配置 AUTH_SECRET 时 (仅限开发环境) 生成一次并保存在这个文件里：
+# 每个进程随机生成的话，--reload / 重启之后已经登录的客户端全部变成 401
+AUTH_SECRET_FILE = Path(os.getenv("AUTH_SECRET_FILE", Path(__file__).resolve().parents[2] / "data" / "auth_secret"))
+
+
+def _load_or_create_secret(path: Path) -> str:
+    """读取已保存的密钥；不存在时原子地创建 (多个 worker 同时启动只会有一个写成功，其余读它的)"""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for _ in range(50):
+            value = path.read_text(encoding="utf-8").strip()
+            if value:
+                return value
+            # 另一个进程刚创建文件、还没写完
+            time.sleep(0.01)
+        raise RuntimeError(f"{path} exists but is empty; delete it or set AUTH_SECRET")
+    value = secrets.token_hex(32)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(value)
+    return value
+
+
+if not AUTH_SECRET:
+    if os.getenv("APP_ENV", "development").lower() in ("production", "prod"):
+        raise RuntimeError("AUTH_SECRET must be set in production (all workers and replicas need the same value)")
+    AUTH_SECRET = _load_or_create_secret(AUTH_SECRET_FILE)
+    logger.warning(f"AUTH_SECRET is not set; using the development secret stored in {AUTH_SECRET_FILE}")
+
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# user_id -> 时间戳 (epoch 秒)；在这之前签发的 token 一律作废 (用户被删除 / 换了 user_code / 改了密码)。
+# 持久的那一份在 auth_revocations 表里，由 app/services/auth_revocation.py 加载并在进程之间同步
+_revoked_before: Dict[int, float] = {}
+_revoked_lock = threading.Lock()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(AUTH_SECRET.encode("utf-8"), payload.encode("ascii"), hashlib.sha256).digest())
+
+
+def issue_session_token(user: AuthUser) -> Tuple[str, datetime]:
+    now = time.time()
+    exp = int(now + SESSION_TTL_SECONDS)
+    body = {"uid": user.id, "u": user.username, "c": user.user_code, "iat": now, "exp": exp}
+    payload = _b64encode(json.dumps(body, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_sign(payload)}", datetime.fromtimestamp(exp, tz=timezone.utc)
+
+
+def verify_session_token(token: str) -> Optional[AuthUser]:
+    """签名、过期时间、吊销记录都通过才返回用户；任何问题 (包括非 ASCII、格式错误的 token) 都返回 None"""
+    try:
+        payload, signature = token.split(".", 1)
+        # _sign 按 ASCII 编码 payload，非 ASCII 的 token 会在这里抛 UnicodeEncodeError (ValueError 的子类)
+        if not hmac.compare_digest(signature.encode("utf-8"), _sign(payload).encode("ascii")):
+            return None
+        body = json.loads(_b64decode(payload))
+        if body.get("exp", 0) < time.time():
+            return None
+        with _revoked_lock:
+            revoked = _revoked_before.get(body["uid"])
+        if revoked is not None and body.get("iat", 0) <= revoked:
+            return None
+        return AuthUser(id=body["uid"], username=body["u"], user_code=body["c"])
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+
+
+# ==========================================
+# 2. 旧的 X-Username / X-User-Code 认证缓存
+# ==========================================
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
+legacy_auth_cache: TTLCache[AuthUser] = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+# 每次吊销都加一：查库期间发生过吊销的话，查到的结果不写回缓存 (和 membership 缓存同样的做法)
+_revocation_generation = 0
+
+
+def revocation_generation() -> int:
+    return _revocation_generation
+
+
+# ==========================================
+# 3. 失效钩子
+# ==========================================
+
+def revoke_local(user_id: int, before: float) -> None:
+    """
+    本进程内生效：作废该用户在 before 之前签发的 token，并清掉旧 header 认证缓存里的条目。
+    由 auth_revocation 在加载 / 收到控制消息时调用，只会往后推，不会撤销更晚的吊销。
+    """
+    global _revocation_generation
+    with _revoked_lock:
+        _revocation_generation += 1
+        if before > _revoked_before.get(user_id, 0.0):
+            _revoked_before[user_id] = before
+    legacy_auth_cache.invalidate_where(lambda _key, user: user.id == user_id)
@@ -1,31 +1,86 @@
+import os
 import json
+import time
 import asyncio
 import logging
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Optional
 from datetime import datetime
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
-from app.routers import auth, social, routes
-from app.core.database import SessionLocal, fetch_one, fetch_one_returning, engine
-from app.models.sql_models import AuthUser
-from app.services.planner import AutoPlannerService
+from app.routers import auth, social, routes, admin
+from app.routers.auth import user_from_query
+from app.core.database import (
+    engine,
+    close_pool, get_pool_stats, init_async_pool, close_async_pool,
+)
+from app.services.realtime import group_manager
+from app.services.message_writer import message_writer
+from app.services.membership import get_member_role
+from app.services.message_outbox import outbox_relay, prune_outbox
+from app.services.llm import llm_client
+from app.services.ai_scheduler import ai_scheduler
+from app.services.ai_jobs import AI_WORKER_IN_PROCESS, ai_worker, prune_ai_jobs
+from app.services.auth_revocation import refresh_revocations, revocation_loop
 from app.core.init_db import init_tables
+from app.services.message_archive import ensure_partitions, archive_old_partitions
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("uvicorn")
 
 app = FastAPI(title="HikeBot Backend")
 
+# 分区维护 / 冷归档 / outbox 清理的执行间隔
+MESSAGE_MAINTENANCE_INTERVAL = float(os.getenv("MESSAGE_MAINTENANCE_INTERVAL_HOURS", "24")) * 3600
+
+async def _message_maintenance_loop():
+    """定期补齐未来的月分区，把过期分区归档到本地 parquet，并清理过了补发窗口的 outbox 和已结束的 AI 任务"""
+    while True:
+        try:
+            await asyncio.to_thread(ensure_partitions)
+            await asyncio.to_thread(archive_old_partitions)
+            await asyncio.to_thread(prune_outbox)
+            await asyncio.to_thread(prune_ai_jobs)
+        except Exception as e:
+            logger.error(f"Message partition maintenance failed: {e}")
+        await asyncio.sleep(MESSAGE_MAINTENANCE_INTERVAL)
+
 @app.on_event("startup")
 async def startup_event():
     # ✅ 启动时自动检查并创建表，数据持久化全靠它
     init_tables()
+    await init_async_pool()
+    await group_manager.start()
+    # 先加载吊销记录再开始服务，避免重启后的一小段时间里已作废的 token 又能用
+    try:
+        await refresh_revocations()
+    except Exception as e:
+        logger.error(f"Failed to load session revocations: {e}")
+    app.state.revocation_task = asyncio.create_task(revocation_loop())
+    await message_writer.start()
+    await outbox_relay.start()
+    if AI_WORKER_IN_PROCESS:
+        await ai_worker.start()
+    app.state.maintenance_task = asyncio.create_task(_message_maintenance_loop())
     logger.info("HikeBot Backend is warming up...")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.maintenance_task.cancel()
+    app.state.revocation_task.cancel()
+    await ai_scheduler.stop()
+    await ai_worker.stop()
+    # 先把缓冲中的消息写完，再关连接和连接池
+    await message_writer.stop()
+    await outbox_relay.stop()
+    await group_manager.stop()
+    await llm_client.close()
+    await close_async_pool()
+    close_pool()
+
 # 挂载静态文件
 static_dir = Path(__file__).parent.parent / "static"
 if static_dir.exists():
@@ -35,6 +90,7 @@ if static_dir.exists():
 app.include_router(auth.router)
 app.include_router(social.router)
 app.include_router(routes.router)
+app.include_router(admin.router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -46,97 +102,56 @@ app.add_middleware(
 
 # --- WebSocket 辅助函数 ---
 
-async def _get_user_for_ws(username: str, user_code: str) -> Optional[AuthUser]:
-    row = fetch_one(
-        "SELECT id, username, user_code FROM users WHERE username = %(u)s AND user_code = %(c)s",
-        {"u": username, "c": user_code},
-    )
-    if not row: return None
-    return AuthUser(id=row["id"], username=row["username"], user_code=row["user_code"])
-
-async def run_ai_pipeline_for_ws(group_id: str, user_content: str):
-    db = SessionLocal()
-    try:
-        planner = AutoPlannerService(db)
-        await planner.run_pipeline(chat_id=group_id, user_message=user_content)
-        # 触发 AI 回复并广播（逻辑参考你之前的 main.py）
-    except Exception as e:
-        logger.error(f"AI WebSocket Error: {e}")
-    finally:
-        db.close()
-
-# --- WebSocket Manager ---
-class GroupConnectionManager:
-    def __init__(self) -> None:
-        self.rooms: Dict[str, Dict[int, WebSocket]] = {}
-
-    async def connect(self, group_id: str, user_id: int, websocket: WebSocket):
-        await websocket.accept()
-        self.rooms.setdefault(group_id, {})
-        self.rooms[group_id][user_id] = websocket
-
-    def disconnect(self, group_id: str, user_id: int):
-        if group_id in self.rooms and user_id in self.rooms[group_id]:
-            del self.rooms[group_id][user_id]
-            if not self.rooms[group_id]:
-                del self.rooms[group_id]
-
-    async def broadcast_json(self, group_id: str, message: dict):
-        data = json.dumps(message)
-        room = self.rooms.get(group_id)
-        if not room: return
-        for uid, ws in list(room.items()):
-            try:
-                await ws.send_text(data)
-            except:
-                self.disconnect(group_id, uid)
-
-group_manager = GroupConnectionManager()
-
 @app.websocket("/ws/groups/{group_id}")
-async def group_ws(websocket: WebSocket, group_id: str, username: str, user_code: str):
-    user = await _get_user_for_ws(username, user_code)
+async def group_ws(
+    websocket: WebSocket,
+    group_id: str,
+    username: str = "",
+    user_code: str = "",
+    token: str = "",
+    last_id: Optional[int] = None,
+):
+    # last_id: 重连时带上收到的最后一条消息 id，连接建立后先收到一帧 {"type": "replay", ...} 补齐缺口
+    user = await user_from_query(username, user_code, token)
     if not user:
         await websocket.close(code=4401)
         return
 
-    membership = fetch_one(
-        "SELECT 1 FROM group_members WHERE group_id = %(gid)s AND user_id = %(uid)s",
-        {"gid": group_id, "uid": user.id},
-    )
-    if not membership:
+    # 和 REST 共用的成员缓存；被踢 / 退群时会主动关闭这条连接
+    if await get_member_role(group_id, user.id) is None:
         await websocket.close(code=4403)
         return
 
-    await group_manager.connect(group_id, user.id, websocket)
+    conn = await group_manager.connect(group_id, user.id, websocket, last_id=last_id)
 
     try:
         while True:
             text = await websocket.receive_text()
-            # 存入数据库并广播
-            row = fetch_one_returning(
-                """
-                INSERT INTO group_messages (group_id, user_id, sender_display, role, content)
-                VALUES (%(gid)s, %(uid)s, %(s)s, 'user', %(c)s)
-                RETURNING id, group_id, sender_display AS sender, role, content, created_at
-                """,
-                {"gid": group_id, "uid": user.id, "s": user.username, "c": text},
-            )
-
-            msg_payload = {
-                "id": row["id"],
-                "group_id": str(row["group_id"]),
-                "sender": row["sender"],
-                "role": row["role"],
-                "content": row["content"],
-                "created_at": row["created_at"].isoformat(),
-            }
-            await group_manager.broadcast_json(group_id, msg_payload)
-            asyncio.create_task(run_ai_pipeline_for_ws(group_id, text))
+            # 交给 message_writer 和其它房间的消息一起批量写库；
+            # 推送由 outbox 触发器 + outbox_relay 完成，这里不用再广播
+            # 写不进去只影响这一条：给发送者回一个 error 帧，连接保持打开
+            try:
+                await message_writer.submit(group_id, user.id, user.username, "user", text)
+            except ValueError as e:
+                conn.enqueue(json.dumps({"type": "error", "detail": str(e)}), time.monotonic())
+                continue
+            except Exception as e:
+                logger.error(f"Failed to save message in group {group_id}: {e}")
+                conn.enqueue(json.dumps({"type": "error", "detail": "Message could not be saved, please retry"}), time.monotonic())
+                continue
+            # 按群去抖：一段讨论结束后只跑一次 AI
+            await ai_scheduler.dispatch(group_id, text)
 
     except WebSocketDisconnect:
-        group_manager.disconnect(group_id, user.id)
+        pass
+    finally:
+        await asyncio.shield(group_manager.disconnect(conn))
 
 @app.get("/")
 def read_root():
-    return {"message": "HikeBot Backend is Running!"}
\ No newline at end of file
+    return {"message": "HikeBot Backend is Running!"}
+
+@app.get("/health/db")
+def db_health():
+    # 连接池状态：用来对照 Postgres 的 max_connections 调整 POSTGRES_POOL_MAX
+    return {"pool": get_pool_stats()}
\ No newline at end of file
@@ -71,6 +71,8 @@ class LoginRequest(BaseModel):
 class AuthResponse(BaseModel):
     user: AuthUser
     message: str
+    token: Optional[str] = None
+    expires_at: Optional[datetime] = None
 
 class ChatRequest(BaseModel):
     user_message: str
@@ -86,6 +88,12 @@ class GroupMessageModel(BaseModel):
     content: str
     created_at: Optional[datetime] = None
 
+class GroupMessagePage(BaseModel):
+    messages: List[GroupMessageModel]
+    # 按时间正序；has_more 表示这一页外 (更早 / 更新的方向) 还有消息
+    has_more: bool = False
+    latest_id: Optional[int] = None
+
 class MessageCreateRequest(BaseModel):
     content: str
 
@@ -117,7 +125,33 @@ class GroupSummary(BaseModel):
     id: str
     name: str
     description: Optional[str] = None
+    kind: str = "group"  # group / dm
     created_at: datetime
+    last_read_message_id: int = 0
+    unread_count: int = 0
+
+class LastMessagePreview(BaseModel):
+    id: int
+    sender: Optional[str] = None
+    role: str
+    content: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+class GroupBootstrapItem(GroupSummary):
+    member_count: int = 0
+    last_message: Optional[LastMessagePreview] = None
+
+class BootstrapResponse(BaseModel):
+    profile: AuthUser
+    groups: List[GroupBootstrapItem]
+    friends: List[FriendSummary]
+    requests: List[FriendRequestItem]
+    # 内容的 hash，和 ETag 一致；客户端用它判断要不要重新渲染
+    version: str
+
+class MarkReadRequest(BaseModel):
+    # 不传表示读到群里最新的一条
+    message_id: Optional[int] = None
 
 class GroupCreateRequest(BaseModel):
     name: str
@@ -133,5 +167,8 @@ class GroupMemberInfo(BaseModel):
 class InviteRequest(BaseModel):
     friend_code: str
 
+class BulkInviteRequest(BaseModel):
+    friend_codes: List[str]
+
 class KickRequest(BaseModel):
     user_id: int
\ No newline at end of file
@@ -0,0 +1,73 @@
+import os
+from typing import Any, Dict
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+
+from app.core.database import get_pool_stats
+from app.core.security import legacy_auth_cache
+from app.services.realtime import group_manager
+from app.services.membership import membership_cache
+from app.services.message_outbox import outbox_relay
+from app.services.message_writer import message_writer
+from app.services.llm import llm_client
+from app.services.ai_scheduler import ai_scheduler
+from app.services.ai_jobs import ai_worker, queue_depth
+from app.services.planner import intent_classifier
+from app.core.query_stats import query_stats_snapshot, reset_query_stats, slow_queries, SLOW_QUERY_MS
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def require_admin(x_admin_token: str = Header("", alias="X-Admin-Token")) -> None:
+    # 没配置 ADMIN_TOKEN 时所有 admin 接口都关闭
+    if not ADMIN_TOKEN:
+        raise HTTPException(403, "Admin endpoints are disabled (ADMIN_TOKEN not set)")
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(403, "Invalid admin token")
+
+@router.get("/query-stats", dependencies=[Depends(require_admin)])
+def get_query_stats(
+    sort_by: str = Query("total_ms", pattern="^(total_ms|calls|avg_ms|p50_ms|p95_ms|p99_ms|max_ms|rows|errors)$"),
+    limit: int = Query(50, ge=1, le=500),
+) -> Dict[str, Any]:
+    """按 SQL 指纹汇总的调用次数、延迟分位数和返回行数"""
+    return {"slow_query_ms": SLOW_QUERY_MS, "queries": query_stats_snapshot(sort_by=sort_by, limit=limit)}
+
+@router.post("/query-stats/reset", dependencies=[Depends(require_admin)])
+def post_reset_query_stats() -> Dict[str, Any]:
+    reset_query_stats()
+    return {"message": "Reset"}
+
+@router.get("/slow-queries", dependencies=[Depends(require_admin)])
+def get_slow_queries(limit: int = Query(50, ge=1, le=500)) -> Dict[str, Any]:
+    """最近的慢查询 (新的在前)"""
+    return {"slow_query_ms": SLOW_QUERY_MS, "queries": slow_queries(limit)}
+
+@router.get("/pool", dependencies=[Depends(require_admin)])
+def get_pool() -> Dict[str, Any]:
+    return {"pool": get_pool_stats()}
+
+@router.get("/caches", dependencies=[Depends(require_admin)])
+def get_caches() -> Dict[str, Any]:
+    return {"auth": legacy_auth_cache.stats(), "membership": membership_cache.stats()}
+
+@router.get("/realtime", dependencies=[Depends(require_admin)])
+def get_realtime() -> Dict[str, Any]:
+    """每个群的连接数、投递延迟分位数和慢客户端处理次数，以及 outbox relay 的状态"""
+    return {**group_manager.stats(), "outbox": outbox_relay.stats()}
+
+@router.get("/message-writer", dependencies=[Depends(require_admin)])
+def get_message_writer() -> Dict[str, Any]:
+    """批量写入的批次大小、排队数和每次 flush 的耗时"""
+    return message_writer.stats()
+
+@router.get("/llm", dependencies=[Depends(require_admin)])
+def get_llm() -> Dict[str, Any]:
+    """正在生成 / 排队的 LLM 请求数、排队等待和调用耗时的分位数，AI 去抖调度的合并情况，以及意图预筛省掉的调用"""
+    return {**llm_client.stats(), "scheduler": ai_scheduler.stats(), "intent": intent_classifier.stats()}
+
+@router.get("/ai-jobs", dependencies=[Depends(require_admin)])
+async def get_ai_jobs() -> Dict[str, Any]:
+    """AI 任务队列的深度 (按状态和优先级)、排队等待 / 执行耗时，以及本进程 worker 的计数"""
+    return {**ai_worker.stats(), "queue": await queue_depth()}
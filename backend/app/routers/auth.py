@@ -1,5 +1,7 @@
 import re
 import hashlib
+from typing import Optional
+import psycopg2.errors
 from fastapi import APIRouter, HTTPException, Header
 
 # ✅ 修正：使用完整路径导入
@@ -10,7 +12,9 @@ from app.models.sql_models import (
     AuthUser,
 )
 # ✅ 修正：从数据库核心模块导入
-from app.core.database import fetch_one, fetch_one_returning
+from app.core.database import fetch_one, fetch_one_returning, afetch_one
+from app.core.queries import AUTH_LOOKUP_SQL
+from app.core.security import issue_session_token, verify_session_token, legacy_auth_cache, revocation_generation
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -38,32 +42,29 @@ def signup(payload: SignupRequest) -> AuthResponse:
 
     _validate_user_code(user_code)
 
-    # 1. 检查 Username 是否存在
-    existing_user = fetch_one("SELECT id FROM users WHERE LOWER(username) = LOWER(%(u)s)", {"u": username})
-    if existing_user:
-        raise HTTPException(400, "Username 已经存在")
-
-    # 2. 🔴 核心新增：检查 user_code 是否已被占用 (解决 2001 重复问题)
-    existing_code = fetch_one("SELECT id FROM users WHERE LOWER(user_code) = LOWER(%(c)s)", {"c": user_code})
-    if existing_code:
+    # 一条 INSERT 搞定：重名 / user_code 被占用 (忽略大小写) 由唯一索引判断
+    try:
+        row = fetch_one_returning(
+            """
+            INSERT INTO users (username, user_code, password_hash)
+            VALUES (%(u)s, %(code)s, %(pwd)s)
+            RETURNING id, username, user_code
+            """,
+            {
+                "u": username,
+                "code": user_code,
+                "pwd": _hash_password(password),
+            },
+        )
+    except psycopg2.errors.UniqueViolation as e:
+        if "username" in (e.diag.constraint_name or ""):
+            raise HTTPException(400, "Username 已经存在")
+        # 🔴 user_code 已被占用 (解决 2001 重复问题)
         raise HTTPException(400, f"这个 user_code ({user_code}) 已被使用，请换一个")
 
-    # 3. 插入数据
-    row = fetch_one_returning(
-        """
-        INSERT INTO users (username, user_code, password_hash)
-        VALUES (%(u)s, %(code)s, %(pwd)s)
-        RETURNING id, username, user_code
-        """,
-        {
-            "u": username,
-            "code": user_code,
-            "pwd": _hash_password(password),
-        },
-    )
-
     user = AuthUser(id=row["id"], username=row["username"], user_code=row["user_code"])
-    return AuthResponse(user=user, message="Signup successful")
+    token, expires_at = issue_session_token(user)
+    return AuthResponse(user=user, message="Signup successful", token=token, expires_at=expires_at)
 
 @router.post("/login", response_model=AuthResponse)
 def login(payload: LoginRequest) -> AuthResponse:
@@ -78,16 +79,54 @@ def login(payload: LoginRequest) -> AuthResponse:
         raise HTTPException(400, "Invalid username or password")
 
     user = AuthUser(id=row["id"], username=row["username"], user_code=row["user_code"])
-    return AuthResponse(user=user, message="Login successful")
-
-def get_current_user(
-    x_username: str = Header(..., alias="X-Username"),
-    x_user_code: str = Header(..., alias="X-User-Code"),
-) -> AuthUser:
-    row = fetch_one(
-        "SELECT id, username, user_code FROM users WHERE username = %(u)s AND user_code = %(c)s",
-        {"u": x_username, "c": x_user_code},
-    )
+    token, expires_at = issue_session_token(user)
+    return AuthResponse(user=user, message="Login successful", token=token, expires_at=expires_at)
+
+async def lookup_user(username: str, user_code: str) -> Optional[AuthUser]:
+    """旧的 username + user_code 认证，结果在进程内缓存 AUTH_CACHE_TTL 秒"""
+    key = (username, user_code)
+    hit, user = legacy_auth_cache.get(key)
+    if hit:
+        return user
+    generation = revocation_generation()
+    row = await afetch_one(AUTH_LOOKUP_SQL, {"u": username, "c": user_code})
     if not row:
+        return None
+    user = AuthUser(id=row["id"], username=row["username"], user_code=row["user_code"])
+    if generation == revocation_generation():
+        legacy_auth_cache.set(key, user)
+    return user
+
+async def user_from_query(username: str = "", user_code: str = "", token: str = "") -> Optional[AuthUser]:
+    """浏览器的 WebSocket / EventSource 不能带自定义 header，token 或旧凭据通过 query 参数传"""
+    if token:
+        user = verify_session_token(token)
+        if user:
+            return user
+    # token 失效 (过期 / 密钥轮换) 时退回旧凭据，客户端迁移完之前两种都会带上
+    if not username or not user_code:
+        return None
+    return await lookup_user(username, user_code)
+
+async def get_current_user(
+    authorization: Optional[str] = Header(None),
+    x_username: Optional[str] = Header(None, alias="X-Username"),
+    x_user_code: Optional[str] = Header(None, alias="X-User-Code"),
+) -> AuthUser:
+    # 优先用签名 token (不查库)；token 无效时如果同时带了 X-Username / X-User-Code 就退回旧认证，
+    # 客户端迁移期间两种都会发，服务重启 / 密钥轮换后不会一下子全部 401
+    has_legacy = bool(x_username and x_user_code)
+    if authorization:
+        scheme, _, token = authorization.partition(" ")
+        user = verify_session_token(token.strip()) if scheme.lower() == "bearer" and token else None
+        if user:
+            return user
+        if not has_legacy:
+            raise HTTPException(401, "Invalid or expired session token")
+
+    if not has_legacy:
+        raise HTTPException(401, "Missing auth headers")
+    user = await lookup_user(x_username, x_user_code)
+    if not user:
         raise HTTPException(401, "Invalid auth headers")
-    return AuthUser(id=row["id"], username=row["username"], user_code=row["user_code"])
\ No newline at end of file
+    return user
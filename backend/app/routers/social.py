@@ -1,160 +1,457 @@
-from typing import List, Dict, Any
+import os
+import json
+import asyncio
+import hashlib
+from typing import List, Dict, Any, Optional, Tuple
 from uuid import UUID
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Header, Response
+from fastapi.responses import StreamingResponse
 
-from app.routers.auth import get_current_user
-from app.core.database import fetch_all, fetch_one, fetch_one_returning, execute, SessionLocal 
+from app.routers.auth import get_current_user, user_from_query
+from app.core.database import (
+    fetch_all, fetch_one, execute, unit_of_work,
+    afetch_one, afetch_all, aexecute,
+)
+from app.core.queries import (
+    GROUP_HEAD_SQL, GROUP_HISTORY_LATEST_SQL, GROUP_HISTORY_BEFORE_SQL, GROUP_HISTORY_AFTER_SQL,
+    MY_GROUPS_SQL, GROUP_MEMBERS_SQL, MARK_READ_SQL, READ_CURSOR_SQL, BOOTSTRAP_SQL,
+    FRIENDS_SQL, PENDING_REQUESTS_SQL, ADD_FRIEND_SQL, USER_PREFIX_SEARCH_SQL, USER_PREFIX_SEARCH_OPEN_SQL,
+    DM_PAIR_SQL, GET_OR_CREATE_DM_SQL,
+)
 from app.models.sql_models import (
     AuthUser, FriendAddRequest, FriendRequestItem, FriendAcceptRequest, FriendSummary,
-    GroupCreateRequest, GroupSummary, GroupMemberInfo, GroupMessageModel, MessageCreateRequest,
-    DMRequest, InviteRequest, KickRequest, RemoveFriendRequest
+    GroupCreateRequest, GroupSummary, GroupMemberInfo, GroupMessageModel, GroupMessagePage, MessageCreateRequest,
+    DMRequest, InviteRequest, BulkInviteRequest, KickRequest, RemoveFriendRequest, MarkReadRequest,
+    BootstrapResponse,
 )
-from app.services.planner import AutoPlannerService
+from app.services.ai_scheduler import ai_scheduler
+from app.services.message_archive import read_archived_messages, has_archived_messages
+from app.services.message_writer import message_writer
+from app.services.realtime import group_manager
+from app.services.membership import get_member_role, require_member, membership_granted, membership_revoked
 
 router = APIRouter(prefix="/social", tags=["social"])
 
-async def run_ai_task_in_background(group_id: str, content: str):
-    print(f"🔄 [Background] Starting AI task for Group {group_id}...")
-    db = SessionLocal()
-    try:
-        service = AutoPlannerService(db)
-        await service.run_pipeline(chat_id=group_id, user_message=content)
-        print(f"✅ [Background] AI task finished for Group {group_id}")
-    except Exception as e:
-        print(f"❌ [Background] AI task failed: {e}")
-    finally:
-        db.close()
+# 消息历史每页默认 / 最多多少条
+MESSAGE_PAGE_DEFAULT = 50
+MESSAGE_PAGE_MAX = 200
+# SSE 空闲时多久发一次注释行，防止代理断开长连接
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+
+def _add_members_by_code(uow, group_id: str, codes: List[str]) -> List[int]:
+    """按 user_code 批量加成员：一条多行 VALUES 语句，已在群里的跳过，返回新加入的 user_id"""
+    codes = sorted({c.strip() for c in codes if c and c.strip()})
+    rows = uow.execute_values(
+        """
+        INSERT INTO group_members (group_id, user_id, role)
+        SELECT v.group_id::uuid, u.id, 'member'
+        FROM (VALUES %s) AS v(group_id, user_code)
+        JOIN users u ON u.user_code = v.user_code
+        ON CONFLICT DO NOTHING
+        RETURNING user_id
+        """,
+        [(group_id, c) for c in codes],
+        fetch=True,
+    )
+    return [r["user_id"] for r in rows]
 
 # --- FRIENDS ---
 @router.get("/friends", response_model=Dict[str, List[FriendSummary]])
-def list_friends(u: AuthUser = Depends(get_current_user)):
-    rows = fetch_all("SELECT u.id, u.username, u.user_code FROM friendships f JOIN users u ON f.friend_id = u.id WHERE f.user_id = %(me)s", {"me": u.id})
+async def list_friends(u: AuthUser = Depends(get_current_user)):
+    rows = await afetch_all(FRIENDS_SQL, {"me": u.id})
     return {"friends": [FriendSummary(**row) for row in rows]}
 
 @router.post("/friends/add", response_model=Dict[str, Any])
-def add_friend(p: FriendAddRequest, u: AuthUser = Depends(get_current_user)):
-    # 🔴 支持 UserID 和 Username 双重搜索，并且忽略大小写
+def add_friend(p: FriendAddRequest, background_tasks: BackgroundTasks, u: AuthUser = Depends(get_current_user)):
+    # 🔴 支持 UserID 和 Username 双重搜索，并且忽略大小写 (走 LOWER(...) 唯一索引)
+    # 查找目标、检查已有请求、插入请求合并成一条语句
     search_term = p.friend_code.strip()
     
-    target = fetch_one(
-        """
-        SELECT id, username 
-        FROM users 
-        WHERE LOWER(user_code) = LOWER(%(term)s) OR LOWER(username) = LOWER(%(term)s)
-        """, 
-        {"term": search_term}
-    )
+    row = fetch_one(ADD_FRIEND_SQL, {"term": search_term, "me": u.id})
     
-    if not target: 
+    if not row: 
         raise HTTPException(404, "User not found")
         
-    if target["id"] == u.id: 
+    if row["id"] == u.id: 
         raise HTTPException(400, "Cannot add self")
         
-    existing = fetch_one(
-        "SELECT id FROM friend_requests WHERE (from_user_id=%(me)s AND to_user_id=%(t)s) OR (from_user_id=%(t)s AND to_user_id=%(me)s)", 
-        {"me": u.id, "t": target["id"]}
-    )
-    if existing: 
+    if not row["request_id"]: 
         return {"message": "Exists"}
-        
-    execute("INSERT INTO friend_requests (from_user_id, to_user_id, status) VALUES (%(me)s, %(t)s, 'pending')", 
-            {"me": u.id, "t": target["id"]})
-    return {"message": "Sent", "username": target["username"]}
+
+    background_tasks.add_task(
+        group_manager.notify_user, row["id"], "friend_request.received",
+        request_id=row["request_id"], from_user_id=u.id, from_username=u.username,
+    )
+    return {"message": "Sent", "username": row["username"]}
+
+_MAX_CODE_POINT = 0x10FFFF
+
+def _prefix_bounds(prefix: str) -> Tuple[str, Optional[str]]:
+    """
+    前缀 abc 转成区间 [abc, abd)：用 ~>=~ / ~<~ 比较，即使是预编译的通用计划也能走 text_pattern_ops 索引。
+    最后一个字符已经是 U+10FFFF 时去掉它、向前进位；整个前缀都是 U+10FFFF 时上界为 None (不设上界)。
+    """
+    head = prefix.rstrip(chr(_MAX_CODE_POINT))
+    if not head:
+        return prefix, None
+    nxt = ord(head[-1]) + 1
+    if 0xD800 <= nxt <= 0xDFFF:
+        # 跳过代理区，单独的代理字符无法编码成 UTF-8
+        nxt = 0xE000
+    return prefix, head[:-1] + chr(nxt)
+
+@router.get("/users/search", response_model=Dict[str, List[FriendSummary]])
+async def search_users(
+    q: str = Query(..., min_length=1, max_length=50),
+    limit: int = Query(10, ge=1, le=25),
+    u: AuthUser = Depends(get_current_user),
+):
+    """按 username / user_code 前缀搜索 (忽略大小写)，给加好友的输入框做自动补全"""
+    prefix = q.strip().lower()
+    if not prefix:
+        return {"users": []}
+    lo, hi = _prefix_bounds(prefix)
+    if hi is None:
+        rows = await afetch_all(USER_PREFIX_SEARCH_OPEN_SQL, {"lo": lo, "me": u.id, "lim": limit})
+    else:
+        rows = await afetch_all(USER_PREFIX_SEARCH_SQL, {"lo": lo, "hi": hi, "me": u.id, "lim": limit})
+    return {"users": [FriendSummary(**r) for r in rows]}
 
 @router.get("/friends/requests", response_model=Dict[str, List[FriendRequestItem]])
-def get_friend_requests(u: AuthUser = Depends(get_current_user)):
-    rows = fetch_all("SELECT r.id, r.from_user_id, u.username as from_username, u.user_code as from_user_code, r.created_at FROM friend_requests r JOIN users u ON r.from_user_id = u.id WHERE r.to_user_id = %(me)s AND r.status = 'pending'", {"me": u.id})
+async def get_friend_requests(u: AuthUser = Depends(get_current_user)):
+    rows = await afetch_all(PENDING_REQUESTS_SQL, {"me": u.id})
     return {"requests": [FriendRequestItem(**r) for r in rows]}
 
 @router.post("/friends/accept", response_model=Dict[str, Any])
-def accept_friend(p: FriendAcceptRequest, u: AuthUser = Depends(get_current_user)):
+def accept_friend(p: FriendAcceptRequest, background_tasks: BackgroundTasks, u: AuthUser = Depends(get_current_user)):
     rid = int(p.request_id)
-    req = fetch_one("SELECT * FROM friend_requests WHERE id=%(rid)s AND to_user_id=%(me)s", {"rid": rid, "me": u.id})
-    if not req: raise HTTPException(404, "Not found")
-    
-    # 🔴 分 3 次独立执行，彻底解决单向好友 Bug
-    execute("UPDATE friend_requests SET status='accepted' WHERE id=%(rid)s", {"rid": rid})
-    execute("INSERT INTO friendships (user_id, friend_id) VALUES (%(u)s, %(f)s) ON CONFLICT DO NOTHING", {"u": u.id, "f": req["from_user_id"]})
-    execute("INSERT INTO friendships (user_id, friend_id) VALUES (%(f)s, %(u)s) ON CONFLICT DO NOTHING", {"u": u.id, "f": req["from_user_id"]})
-    
+    # 🔴 一条语句、一个事务：更新请求 + 双向写入好友关系，不会出现单向好友
+    row = fetch_one(
+        """
+        WITH req AS (
+            UPDATE friend_requests SET status='accepted', responded_at=NOW()
+            WHERE id=%(rid)s AND to_user_id=%(me)s
+            RETURNING from_user_id, to_user_id
+        ),
+        pairs AS (
+            INSERT INTO friendships (user_id, friend_id)
+            SELECT to_user_id, from_user_id FROM req
+            UNION ALL
+            SELECT from_user_id, to_user_id FROM req
+            ON CONFLICT DO NOTHING
+        )
+        SELECT from_user_id FROM req
+        """,
+        {"rid": rid, "me": u.id},
+    )
+    if not row: raise HTTPException(404, "Not found")
+
+    background_tasks.add_task(
+        group_manager.notify_user, row["from_user_id"], "friend_request.accepted",
+        request_id=rid, by_user_id=u.id, by_username=u.username,
+    )
     return {"message": "Accepted"}
 
 @router.post("/friends/remove", response_model=Dict[str, Any])
-def remove_friend(p: RemoveFriendRequest, u: AuthUser = Depends(get_current_user)):
-    execute("DELETE FROM friendships WHERE (user_id=%(u)s AND friend_id=%(f)s) OR (user_id=%(f)s AND friend_id=%(u)s)", {"u": u.id, "f": p.friend_id})
+def remove_friend(p: RemoveFriendRequest, background_tasks: BackgroundTasks, u: AuthUser = Depends(get_current_user)):
+    removed = execute("DELETE FROM friendships WHERE (user_id=%(u)s AND friend_id=%(f)s) OR (user_id=%(f)s AND friend_id=%(u)s)", {"u": u.id, "f": p.friend_id})
+    if removed:
+        background_tasks.add_task(group_manager.notify_user, p.friend_id, "friend.removed", by_user_id=u.id)
     return {"message": "Friend removed"}
 
 @router.post("/friends/dm", response_model=Dict[str, Any])
 def get_or_create_dm(p: DMRequest, u: AuthUser = Depends(get_current_user)):
     if p.friend_id == u.id: raise HTTPException(400, "Cannot DM self")
-    existing = fetch_one("""SELECT g.id FROM groups g JOIN group_members gm1 ON g.id=gm1.group_id JOIN group_members gm2 ON g.id=gm2.group_id WHERE gm1.user_id=%(me)s AND gm2.user_id=%(f)s AND g.name LIKE 'DM:%%' LIMIT 1""", {"me": u.id, "f": p.friend_id})
-    if existing: return {"group_id": existing["id"], "new": False}
-    friend = fetch_one("SELECT username FROM users WHERE id=%(id)s", {"id": p.friend_id})
-    if not friend: raise HTTPException(404, "Friend not found")
-    dm_name = f"DM: {u.username} & {friend['username']}"
-    gid = fetch_one_returning("INSERT INTO groups (name, description, created_by) VALUES (%(n)s, 'DM', %(u)s) RETURNING id", {"n": dm_name, "u": u.id})["id"]
-    execute("INSERT INTO group_members (group_id, user_id, role) VALUES (%(gid)s, %(u)s, 'admin')", {"gid": gid, "u": u.id})
-    execute("INSERT INTO group_members (group_id, user_id, role) VALUES (%(gid)s, %(u)s, 'admin')", {"gid": gid, "u": p.friend_id})
-    return {"group_id": gid, "new": True}
+    pair = {"me": u.id, "me_name": u.username, "f": p.friend_id, "lo": min(u.id, p.friend_id), "hi": max(u.id, p.friend_id)}
+    # dm_pairs 主键就是这一对用户，一条语句抢占并建群，见 GET_OR_CREATE_DM_SQL
+    row = fetch_one(GET_OR_CREATE_DM_SQL, pair)
+    if row["existing_id"]: return {"group_id": row["existing_id"], "new": False}
+    if row["new_id"]: return {"group_id": row["new_id"], "new": True}
+    if not row["friend_found"]: raise HTTPException(404, "Friend not found")
+    # 输给了并发的请求：语句快照里看不到对方刚提交的行，重新读一次
+    row = fetch_one(DM_PAIR_SQL, pair)
+    if not row: raise HTTPException(409, "DM creation conflicted, please retry")
+    return {"group_id": row["group_id"], "new": False}
 
 # --- GROUPS ---
 @router.get("/groups", response_model=Dict[str, List[GroupSummary]])
-def list_groups(u: AuthUser = Depends(get_current_user)):
-    rows = fetch_all("SELECT g.id, g.name, g.description, g.created_at FROM groups g JOIN group_members gm ON g.id=gm.group_id WHERE gm.user_id=%(u)s ORDER BY g.created_at DESC", {"u": u.id})
+async def list_groups(u: AuthUser = Depends(get_current_user)):
+    # unread_count 由触发器在插入消息时维护，这里只是读列
+    rows = await afetch_all(MY_GROUPS_SQL, {"u": u.id})
     return {"groups": [GroupSummary(**r) for r in rows]}
 
+# 群列表里最后一条消息的预览最多保留多少字符
+BOOTSTRAP_PREVIEW_CHARS = 120
+
+@router.get("/bootstrap", response_model=BootstrapResponse)
+async def bootstrap(response: Response, if_none_match: Optional[str] = Header(None), u: AuthUser = Depends(get_current_user)):
+    """
+    侧边栏 / 首页需要的全部数据一次返回：个人信息、群 (含未读数、成员数、最后一条消息)、好友、待处理的好友请求。
+    一条语句、一次往返；每个群的最后一条消息和成员数都走索引 (LATERAL + LIMIT 1 / 主键)。
+    version 是内容的 hash (同时作为 ETag)，没变化时返回 304。
+    """
+    row = await afetch_one(BOOTSTRAP_SQL, {"me": u.id, "preview": BOOTSTRAP_PREVIEW_CHARS})
+    parts = {k: json.loads(row[k]) if isinstance(row[k], str) else row[k] for k in ("profile", "groups", "friends", "requests")}
+    # asyncpg 把 json 当文本返回：直接对这几段文本做 hash，不用再序列化一遍
+    digest = hashlib.sha1("\x1f".join(str(row[k]) for k in ("profile", "groups", "friends", "requests")).encode("utf-8"))
+    version = digest.hexdigest()[:16]
+    etag = f'W/"{version}"'
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return BootstrapResponse(profile=parts["profile"] or u.model_dump(), version=version, **{k: parts[k] for k in ("groups", "friends", "requests")})
+
 @router.post("/groups", response_model=Dict[str, Any])
-def create_group(p: GroupCreateRequest, u: AuthUser = Depends(get_current_user)):
-    gid = fetch_one_returning("INSERT INTO groups (name, description, created_by) VALUES (%(n)s, %(d)s, %(u)s) RETURNING id", {"n": p.name, "d": p.description, "u": u.id})["id"]
-    execute("INSERT INTO group_members (group_id, user_id, role) VALUES (%(gid)s, %(u)s, 'admin')", {"gid": gid, "u": u.id})
-    if p.member_codes:
-        codes = list(set(p.member_codes))
-        plc = ",".join(["%s"]*len(codes))
-        users = fetch_all(f"SELECT id FROM users WHERE user_code IN ({plc})", codes)
-        for user in users:
-            if user["id"] != u.id:
-                execute("INSERT INTO group_members (group_id, user_id, role) VALUES (%(gid)s, %(u)s, 'member') ON CONFLICT DO NOTHING", {"gid": gid, "u": user["id"]})
+def create_group(p: GroupCreateRequest, background_tasks: BackgroundTasks, u: AuthUser = Depends(get_current_user)):
+    # 建群、成员写入在同一个连接 / 事务里完成，中途失败不会留下半个群
+    with unit_of_work() as uow:
+        gid = uow.fetch_one_returning(
+            """
+            WITH g AS (
+                INSERT INTO groups (name, description, created_by) VALUES (%(n)s, %(d)s, %(u)s) RETURNING id
+            ),
+            admin AS (
+                INSERT INTO group_members (group_id, user_id, role) SELECT id, %(u)s, 'admin' FROM g
+            )
+            SELECT id FROM g
+            """,
+            {"n": p.name, "d": p.description, "u": u.id},
+        )["id"]
+        added: List[int] = []
+        if p.member_codes:
+            # 创建者已经是 admin，ON CONFLICT 会跳过
+            added = _add_members_by_code(uow, gid, p.member_codes)
+    if added:
+        background_tasks.add_task(
+            group_manager.notify_users, added, "group.invited",
+            group_id=str(gid), group_name=p.name, by_username=u.username,
+        )
     return {"message": "Created", "group_id": gid}
 
 @router.get("/groups/{group_id}/members", response_model=Dict[str, List[GroupMemberInfo]])
-def get_members(group_id: UUID, u: AuthUser = Depends(get_current_user)):
-    rows = fetch_all("SELECT u.id as user_id, u.username, u.user_code, gm.role FROM group_members gm JOIN users u ON gm.user_id=u.id WHERE gm.group_id=%(gid)s", {"gid": str(group_id)})
+async def get_members(group_id: UUID, u: AuthUser = Depends(require_member)):
+    rows = await afetch_all(GROUP_MEMBERS_SQL, {"gid": str(group_id)})
     return {"members": [GroupMemberInfo(**r) for r in rows]}
 
 @router.post("/groups/{group_id}/invite")
-def invite_member(group_id: UUID, p: InviteRequest, u: AuthUser = Depends(get_current_user)):
-    execute("INSERT INTO group_members (group_id, user_id, role) VALUES (%(gid)s, (SELECT id FROM users WHERE user_code=%(c)s), 'member') ON CONFLICT DO NOTHING", {"gid": str(group_id), "c": p.friend_code})
+async def invite_member(group_id: UUID, p: InviteRequest, background_tasks: BackgroundTasks, u: AuthUser = Depends(require_member)):
+    row = await afetch_one(
+        """
+        WITH ins AS (
+            INSERT INTO group_members (group_id, user_id, role)
+            SELECT %(gid)s, id, 'member' FROM users WHERE user_code=%(c)s
+            ON CONFLICT DO NOTHING
+            RETURNING user_id
+        )
+        SELECT ins.user_id, g.name AS group_name FROM ins JOIN groups g ON g.id = %(gid)s
+        """,
+        {"gid": str(group_id), "c": p.friend_code},
+    )
+    if row:
+        await membership_granted(str(group_id), [row["user_id"]])
+        background_tasks.add_task(
+            group_manager.notify_user, row["user_id"], "group.invited",
+            group_id=str(group_id), group_name=row["group_name"], by_username=u.username,
+        )
     return {"message": "Invited"}
 
+@router.post("/groups/{group_id}/invite/bulk", response_model=Dict[str, Any])
+async def invite_members_bulk(group_id: UUID, p: BulkInviteRequest, background_tasks: BackgroundTasks, u: AuthUser = Depends(require_member)):
+    def _invite() -> List[int]:
+        with unit_of_work() as uow:
+            return _add_members_by_code(uow, str(group_id), p.friend_codes)
+
+    added = await asyncio.to_thread(_invite)
+    if added:
+        await membership_granted(str(group_id), added)
+        background_tasks.add_task(
+            group_manager.notify_users, added, "group.invited",
+            group_id=str(group_id), by_username=u.username,
+        )
+    return {"message": "Invited", "invited": len(added)}
+
 @router.post("/groups/{group_id}/kick")
-def kick_member(group_id: UUID, p: KickRequest, u: AuthUser = Depends(get_current_user)):
-    me = fetch_one("SELECT role FROM group_members WHERE group_id=%(gid)s AND user_id=%(uid)s", {"gid": str(group_id), "uid": u.id})
-    if not me or me["role"] != "admin": raise HTTPException(403, "Admin only")
+async def kick_member(group_id: UUID, p: KickRequest, background_tasks: BackgroundTasks, u: AuthUser = Depends(get_current_user)):
+    # 权限检查和删除在同一条语句里完成
+    row = await afetch_one(
+        """
+        WITH me AS (
+            SELECT role FROM group_members WHERE group_id=%(gid)s AND user_id=%(me)s
+        ),
+        kicked AS (
+            DELETE FROM group_members
+            WHERE group_id=%(gid)s AND user_id=%(uid)s AND user_id <> %(me)s
+              AND EXISTS (SELECT 1 FROM me WHERE role='admin')
+            RETURNING user_id
+        )
+        SELECT (SELECT role FROM me) AS my_role, EXISTS (SELECT 1 FROM kicked) AS kicked
+        """,
+        {"gid": str(group_id), "me": u.id, "uid": p.user_id},
+    )
+    if row["my_role"] != "admin": raise HTTPException(403, "Admin only")
     if p.user_id == u.id: raise HTTPException(400, "Cannot kick self")
-    execute("DELETE FROM group_members WHERE group_id=%(gid)s AND user_id=%(uid)s", {"gid": str(group_id), "uid": p.user_id})
+    if row["kicked"]:
+        # 在返回之前清缓存并断开被踢用户的连接 (所有进程)
+        await membership_revoked(str(group_id), [p.user_id])
+        background_tasks.add_task(
+            group_manager.notify_user, p.user_id, "group.kicked",
+            group_id=str(group_id), by_username=u.username,
+        )
     return {"message": "Kicked"}
 
 @router.post("/groups/{group_id}/leave")
-def leave_group(group_id: UUID, u: AuthUser = Depends(get_current_user)):
-    execute("DELETE FROM group_members WHERE group_id=%(gid)s AND user_id=%(u)s", {"gid": str(group_id), "u": u.id})
+async def leave_group(group_id: UUID, u: AuthUser = Depends(get_current_user)):
+    left = await aexecute("DELETE FROM group_members WHERE group_id=%(gid)s AND user_id=%(u)s", {"gid": str(group_id), "u": u.id})
+    if left:
+        await membership_revoked(str(group_id), [u.id])
     return {"message": "Left"}
 
 @router.post("/groups/{group_id}/join")
-def join_group(group_id: UUID, u: AuthUser = Depends(get_current_user)):
-    execute("INSERT INTO group_members (group_id, user_id, role) VALUES (%(gid)s, %(u)s, 'member') ON CONFLICT DO NOTHING", {"gid": str(group_id), "u": u.id})
+async def join_group(group_id: UUID, u: AuthUser = Depends(get_current_user)):
+    joined = await aexecute("INSERT INTO group_members (group_id, user_id, role) VALUES (%(gid)s, %(u)s, 'member') ON CONFLICT DO NOTHING", {"gid": str(group_id), "u": u.id})
+    if joined:
+        await membership_granted(str(group_id), [u.id])
     return {"message": "Joined"}
 
-@router.get("/groups/{group_id}/messages", response_model=Dict[str, List[GroupMessageModel]])
-def get_msgs(group_id: UUID, u: AuthUser = Depends(get_current_user)):
-    rows = fetch_all("SELECT id, group_id, sender_display as sender, role, content, created_at FROM group_messages WHERE group_id=%(gid)s ORDER BY created_at ASC LIMIT 100", {"gid": str(group_id)})
-    return {"messages": [GroupMessageModel(**r) for r in rows]}
+@router.post("/groups/{group_id}/read", response_model=Dict[str, Any])
+async def mark_read(group_id: UUID, p: MarkReadRequest, background_tasks: BackgroundTasks, u: AuthUser = Depends(require_member)):
+    """
+    把已读游标推进到 message_id (默认最新)。游标只前进不后退；
+    未读数减去这段区间里别人发的消息条数，区间之后并发插入的新消息计数不受影响。
+    """
+    row = await afetch_one(MARK_READ_SQL, {"gid": str(group_id), "me": u.id, "mid": p.message_id})
+    if row is None:
+        # 游标已经在目标之后：什么都不用改
+        row = await afetch_one(READ_CURSOR_SQL, {"gid": str(group_id), "me": u.id})
+    else:
+        # 同一个用户的其它标签页更新未读角标
+        background_tasks.add_task(group_manager.notify_user, u.id, "group.read", group_id=str(group_id), **row)
+    return {"group_id": str(group_id), **(row or {"last_read_message_id": 0, "unread_count": 0})}
+
+@router.get("/groups/{group_id}/messages", response_model=GroupMessagePage)
+async def get_msgs(
+    group_id: UUID,
+    response: Response,
+    before_id: Optional[int] = Query(None, ge=1),
+    after_id: Optional[int] = Query(None, ge=0),
+    limit: int = Query(MESSAGE_PAGE_DEFAULT, ge=1, le=MESSAGE_PAGE_MAX),
+    if_none_match: Optional[str] = Header(None),
+    u: AuthUser = Depends(require_member),
+):
+    """
+    按 id 做游标分页 (走 (group_id, id) 索引)，结果总是按时间正序：
+      - 默认：最新的 limit 条，has_more 表示还有更早的
+      - before_id：比它更早的 limit 条，用来往上翻
+      - after_id：比它新的 limit 条，用来增量同步，has_more 表示还没追完
+    消息只追加不修改，所以群里最新的 id 就能当 ETag，没变化时直接 304。
+    """
+    gid = str(group_id)
+    if before_id is not None and after_id is not None:
+        raise HTTPException(status_code=400, detail="Use either before_id or after_id, not both")
+
+    head = await afetch_one(GROUP_HEAD_SQL, {"gid": gid})
+    latest_id = head["latest_id"] if head else None
+    etag = f'W/"{latest_id or 0}"'
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    if after_id is not None:
+        rows = await afetch_all(GROUP_HISTORY_AFTER_SQL, {"gid": gid, "after": after_id, "lim": limit + 1})
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+    else:
+        # 两条独立的语句，让 prepared statement 的通用计划都是纯索引倒序扫描
+        if before_id is None:
+            rows = await afetch_all(GROUP_HISTORY_LATEST_SQL, {"gid": gid, "lim": limit + 1})
+        else:
+            rows = await afetch_all(GROUP_HISTORY_BEFORE_SQL, {"gid": gid, "before": before_id, "lim": limit + 1})
+        has_more = len(rows) > limit
+        rows = rows[:limit][::-1]
+        # 更早的消息可能已经归档到 parquet；没有归档的群不会读文件
+        if not has_more and await asyncio.to_thread(has_archived_messages, gid):
+            floor = rows[0]["id"] if rows else before_id
+            older = await asyncio.to_thread(read_archived_messages, gid, limit + 1 - len(rows), floor)
+            has_more = len(rows) + len(older) > limit
+            rows = older[len(rows) + len(older) - limit:] + rows if has_more else older + rows
+
+    return GroupMessagePage(messages=[GroupMessageModel(**r) for r in rows], has_more=has_more, latest_id=latest_id)
 
 @router.post("/groups/{group_id}/messages", response_model=GroupMessageModel)
-def send_msg(group_id: UUID, p: MessageCreateRequest, background_tasks: BackgroundTasks, u: AuthUser = Depends(get_current_user)):
-    r = fetch_one_returning(
-        "INSERT INTO group_messages (group_id, user_id, sender_display, role, content) VALUES (%(gid)s, %(u)s, %(s)s, 'user', %(c)s) RETURNING id, group_id, sender_display as sender, role, content, created_at",
-        {"gid": str(group_id), "u": u.id, "s": u.username, "c": p.content}
+async def send_msg(group_id: UUID, p: MessageCreateRequest, u: AuthUser = Depends(require_member)):
+    try:
+        r = await message_writer.submit(str(group_id), u.id, u.username, "user", p.content)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except Exception:
+        raise HTTPException(503, "Message could not be saved, please retry")
+    await ai_scheduler.dispatch(str(group_id), p.content)
+    return GroupMessageModel(**r)
+
+def _event_stream(conn_factory):
+    """
+    把一个房间订阅变成 SSE 响应。conn_factory(send, close) 负责把连接挂到 manager 上。
+    内部队列只放一帧：流没读走之前 put 会等待，积压留在 Connection 自己的队列里，慢客户端策略照常生效。
+    """
+    frames: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+    async def _close(code: int):
+        try:
+            frames.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+    async def stream():
+        conn = await conn_factory(frames.put, _close)
+        getter = None
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                if getter is None:
+                    getter = asyncio.ensure_future(frames.get())
+                done, _ = await asyncio.wait({getter}, timeout=SSE_KEEPALIVE_SECONDS)
+                if not done:
+                    yield ": keepalive\n\n"
+                    continue
+                data, getter = getter.result(), None
+                if data is None or conn.closed:
+                    break
+                yield f"event: message\ndata: {data}\n\n"
+        finally:
+            if getter is not None:
+                getter.cancel()
+            # 客户端断开时这里运行在已取消的任务里：shield 保证 unsubscribe / 关闭一定做完
+            await asyncio.shield(group_manager.disconnect(conn))
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    background_tasks.add_task(run_ai_task_in_background, group_id=str(group_id), content=p.content)
-    return GroupMessageModel(**r)
\ No newline at end of file
+
+@router.get("/groups/{group_id}/events")
+async def group_events(group_id: UUID, username: str = "", user_code: str = "", token: str = ""):
+    """
+    Server-Sent Events：和 /ws/groups/{group_id} 用同一套房间 / 广播 / 发送队列，
+    只是单向推送，给不方便维持 WebSocket 的客户端 (Streamlit 组件里的 EventSource) 用。
+    EventSource 不能带 header，鉴权和 WebSocket 一样走 query 参数。
+    """
+    gid = str(group_id)
+    user = await user_from_query(username, user_code, token)
+    if not user:
+        raise HTTPException(401, "Invalid or missing credentials")
+    if await get_member_role(gid, user.id) is None:
+        raise HTTPException(403, "Not a member of this group")
+    return _event_stream(lambda send, close: group_manager.attach(gid, user.id, send, close))
+
+@router.get("/me/events")
+async def user_events(username: str = "", user_code: str = "", token: str = ""):
+    """
+    当前用户的通知流 (SSE)。事件带 type，客户端据此只刷新对应的数据：
+      friend_request.received / friend_request.accepted / friend.removed → 好友 / 好友请求
+      group.invited / group.kicked → 群列表
+    """
+    user = await user_from_query(username, user_code, token)
+    if not user:
+        raise HTTPException(401, "Invalid or missing credentials")
+    return _event_stream(lambda send, close: group_manager.attach_user(user.id, send, close))
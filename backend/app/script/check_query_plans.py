@@ -0,0 +1,52 @@
+import sys
+import os
+import json
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 确保能引用 app 模块
+sys.path.append(os.getcwd())
+
+from app.core.database import get_cursor
+from app.core.queries import HOT_QUERIES
+
+# 热点查询在 app/core/queries.py，路由执行的就是同一份 SQL。
+# 用 enable_seqscan = off 来问规划器：有没有可用的索引？
+# 如果仍然是 Seq Scan，说明这条查询没有任何索引可以支撑，检查失败。
+
+
+def _seq_scans(plan: dict) -> list:
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name"))
+    for child in plan.get("Plans", []):
+        found.extend(_seq_scans(child))
+    return found
+
+
+def explain_seq_scans(cur, query: str, params: dict) -> list:
+    """返回这条查询计划里做了 Seq Scan 的表；调用方需要先 SET LOCAL enable_seqscan = off"""
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    plan = cur.fetchone()["QUERY PLAN"]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return _seq_scans(plan[0]["Plan"])
+
+
+def check_query_plans() -> bool:
+    ok = True
+    with get_cursor() as cur:
+        cur.execute("SET LOCAL enable_seqscan = off")
+        for name, (query, params) in HOT_QUERIES.items():
+            scans = explain_seq_scans(cur, query, params)
+            if scans:
+                ok = False
+                logger.error(f"❌ {name}: sequential scan on {', '.join(scans)}")
+            else:
+                logger.info(f"✅ {name}: index-backed")
+    return ok
+
+if __name__ == "__main__":
+    sys.exit(0 if check_query_plans() else 1)
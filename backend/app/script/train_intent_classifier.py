@@ -0,0 +1,148 @@
+import sys
+import os
+import json
+import math
+import logging
+import random
+import argparse
+from datetime import date
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 确保能引用 app 模块
+sys.path.append(os.getcwd())
+
+from app.services.planner import MOCK_TRAILS_DB, has_trigger
+from app.services.intent_classifier import INTENT_WEIGHTS_PATH, IntentClassifier, extract_features, load_labeled
+
+# 训练 / 评估意图预筛模型 (纯 Python，不依赖 numpy / sklearn)：
+#   python app/script/train_intent_classifier.py            训练并写入 weights.json
+#   python app/script/train_intent_classifier.py --eval-only 只评估当前的 weights.json
+# 只有通过关键词过滤 (has_trigger) 的消息才会走到预筛，所以评估也只在这部分消息上做。
+# 线上打分的是 ai_scheduler 合并后的一段讨论 (换行拼接)，所以除了单条消息，还在合成的讨论窗口上评估，
+# 阈值也在训练集的单条 + 窗口上一起选。
+CATALOG = [t["name"].lower() for t in MOCK_TRAILS_DB]
+# 每个 split 合成多少个讨论窗口、每个窗口最多几条消息；固定种子，结果可复现
+WINDOWS_PER_SPLIT = 400
+WINDOW_MAX_MESSAGES = 8
+WINDOW_SEED = 7
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + math.exp(-z)) if z >= 0 else math.exp(z) / (1.0 + math.exp(z))
+
+
+def train(rows, epochs=3000, lr=0.5, l2=0.01):
+    """全量梯度下降的逻辑回归，bias 不加正则"""
+    xs = [extract_features(r["text"], CATALOG) for r in rows]
+    ys = [float(r["label"]) for r in rows]
+    names = list(xs[0].keys())
+    w = {n: 0.0 for n in names}
+    for _ in range(epochs):
+        grad = {n: 0.0 for n in names}
+        for x, y in zip(xs, ys):
+            err = _sigmoid(sum(w[n] * x[n] for n in names)) - y
+            for n in names:
+                grad[n] += err * x[n]
+        for n in names:
+            reg = 0.0 if n == "bias" else l2 * w[n]
+            w[n] -= lr * (grad[n] / len(xs) + reg)
+    return {n: round(v, 4) for n, v in w.items()}
+
+
+def pick_threshold(scores, labels, target_recall):
+    """召回率不低于 target_recall 的前提下，阈值尽量高 (省掉的 LLM 调用最多)"""
+    positives = sorted(s for s, y in zip(scores, labels) if y)
+    if not positives:
+        return 0.0
+    # 最多允许漏掉 floor((1 - target) * P) 个正例
+    allowed_misses = int(math.floor((1.0 - target_recall) * len(positives) + 1e-9))
+    return max(0.0, positives[allowed_misses] - 1e-6)
+
+
+def make_windows(rows, count=WINDOWS_PER_SPLIT, seed=WINDOW_SEED):
+    """
+    合成讨论窗口：一半是 1 条规划消息混在若干条闲聊里 (label 1)，一半全是闲聊 (label 0)。
+    前者正是 "一个无关的词把整段讨论否决掉" 的情况。
+    """
+    rng = random.Random(seed)
+    positives = [r["text"] for r in rows if r["label"]]
+    negatives = [r["text"] for r in rows if not r["label"]]
+    windows = []
+    for i in range(count):
+        label = i % 2
+        texts = rng.sample(negatives, rng.randint(1, WINDOW_MAX_MESSAGES - label))
+        if label:
+            texts.insert(rng.randint(0, len(texts)), rng.choice(positives))
+        windows.append({"text": "\n".join(texts), "label": label})
+    return windows
+
+
+def evaluate(clf, rows, threshold):
+    gated = [r for r in rows if has_trigger(r["text"])]
+    scores = [clf.score_window(r["text"]) for r in gated]
+    labels = [r["label"] for r in gated]
+    called = [s >= threshold for s in scores]
+    tp = sum(1 for c, y in zip(called, labels) if c and y)
+    positives = sum(labels)
+    return {
+        "messages": len(rows),
+        "passed_keyword_gate": len(gated),
+        "keyword_gate_recall": round(positives / max(1, sum(r["label"] for r in rows)), 3),
+        "threshold": round(threshold, 4),
+        "llm_calls": sum(called),
+        "llm_calls_saved": round(1 - sum(called) / len(gated), 3) if gated else 0.0,
+        "recall": round(tp / positives, 3) if positives else 1.0,
+        "precision": round(tp / sum(called), 3) if sum(called) else 1.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train / evaluate the intent pre-classifier")
+    parser.add_argument("--eval-only", action="store_true", help="evaluate the current weights.json")
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--threshold", type=float, default=None, help="evaluate at a fixed threshold")
+    args = parser.parse_args()
+
+    rows = load_labeled()
+    train_rows = [r for r in rows if r["split"] == "train"]
+    eval_rows = [r for r in rows if r["split"] == "eval"]
+    train_windows = make_windows(train_rows)
+    eval_windows = make_windows(eval_rows)
+
+    if args.eval_only:
+        clf = IntentClassifier.load(catalog=CATALOG, threshold=args.threshold)
+    else:
+        weights = train(train_rows)
+        clf = IntentClassifier(weights, 0.0, CATALOG)
+        # 阈值在训练集 (单条 + 窗口) 上选，评估集只用来报告
+        gated = [r for r in train_rows + train_windows if has_trigger(r["text"])]
+        clf.threshold = args.threshold if args.threshold is not None else pick_threshold(
+            [clf.score_window(r["text"]) for r in gated], [r["label"] for r in gated], args.target_recall
+        )
+
+    train_report = evaluate(clf, train_rows, clf.threshold)
+    eval_report = evaluate(clf, eval_rows, clf.threshold)
+    eval_window_report = evaluate(clf, eval_windows, clf.threshold)
+    logger.info(f"train:         {train_report}")
+    logger.info(f"train windows: {evaluate(clf, train_windows, clf.threshold)}")
+    logger.info(f"eval:          {eval_report}")
+    logger.info(f"eval windows:  {eval_window_report}")
+
+    if not args.eval_only:
+        model = {
+            "version": 1,
+            "trained_at": date.today().isoformat(),
+            "target_recall": args.target_recall,
+            "threshold": round(clf.threshold, 4),
+            "weights": clf.weights,
+            "eval": eval_report,
+            "eval_windows": eval_window_report,
+        }
+        INTENT_WEIGHTS_PATH.write_text(json.dumps(model, ensure_ascii=False, indent=1) + "\n", encoding="utf-8")
+        logger.info(f"✅ Wrote {INTENT_WEIGHTS_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ import random
 import re
 from typing import List, Dict, Any
 from pg_db import fetch_one_returning, fetch_all, fetch_one
+from app.core.queries import RECENT_CONTEXT_SQL
 
 # Mock Database of Trails
 MOCK_TRAILS = [
@@ -35,10 +36,7 @@ def post_system_message(group_id: str, content: str, sender_name: str = "Trail M
     )
 
 def _get_recent_context(group_id: str, limit: int = 20) -> str:
-    rows = fetch_all(
-        "SELECT content FROM group_messages WHERE group_id = %(gid)s ORDER BY created_at DESC LIMIT %(lim)s",
-        {"gid": group_id, "lim": limit}
-    )
+    rows = fetch_all(RECENT_CONTEXT_SQL, {"gid": group_id, "lim": limit})
     texts = [r["content"] for r in reversed(rows)]
     return " ".join(texts).lower()
 
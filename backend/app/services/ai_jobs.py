@@ -0,0 +1,388 @@
+"""Postgres-backed AI job queue and worker pool."""
+
+from __future__ import annotations
+
+import os
+import json
+import socket
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import asyncpg
+
+from app.core.database import SessionLocal, afetch_one, afetch_all, aexecute, execute
+from app.core.queries import AI_JOB_DEQUEUE_SQL
+from app.services.planner import AutoPlannerService
+from app.utils.metrics import LatencyWindow
+
+logger = logging.getLogger(__name__)
+
+# 每个进程里同时跑几个任务 (LLM 的总并发另外由 LLM_MAX_CONCURRENCY 限制)
+AI_WORKER_CONCURRENCY = int(os.getenv("AI_WORKER_CONCURRENCY", "2"))
+# false 时 API 进程只入队，由单独的 `python -m app.services.ai_jobs` 进程执行
+AI_WORKER_IN_PROCESS = os.getenv("AI_WORKER_IN_PROCESS", "true").lower() in ("1", "true", "yes")
+# 没有任务时多久查一次队列 (同一进程里入队会立即唤醒 worker)
+AI_JOB_POLL_SECONDS = float(os.getenv("AI_JOB_POLL_SECONDS", "1"))
+AI_JOB_MAX_ATTEMPTS = int(os.getenv("AI_JOB_MAX_ATTEMPTS", "3"))
+# 第 n 次重试前等待 backoff * 2^(n-1) 秒
+AI_JOB_BACKOFF_SECONDS = float(os.getenv("AI_JOB_BACKOFF_SECONDS", "5"))
+# 入队后多久还没跑完就放弃 (聊天里的规划过时就没有意义了)
+AI_JOB_DEADLINE_SECONDS = float(os.getenv("AI_JOB_DEADLINE_SECONDS", "120"))
+# running 超过这个时间认为 worker 已经挂了，任务重新排队
+AI_JOB_LEASE_SECONDS = float(os.getenv("AI_JOB_LEASE_SECONDS", "300"))
+AI_JOB_RETENTION_HOURS = float(os.getenv("AI_JOB_RETENTION_HOURS", "72"))
+
+# 优先级：数字越小越先执行
+PRIORITY_MENTION = 0
+PRIORITY_PASSIVE = 1
+MENTION_TOKEN = "@hikebot"
+# 合并后的 payload 文本最多保留多少字符
+_PAYLOAD_TEXT_MAX = 4000
+
+Handler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+def is_mention(text: str) -> bool:
+    return MENTION_TOKEN in (text or "").lower()
+
+
+# 同一个群同一种任务只会有一行 queued：再入队时把文本追加进去 (旧的那次不会单独再跑)
+_ENQUEUE_SQL = """
+INSERT INTO ai_jobs (kind, group_id, payload, priority, max_attempts, deadline)
+VALUES (%(kind)s, %(gid)s, %(payload)s::jsonb, %(prio)s, %(max)s, NOW() + make_interval(secs => %(ttl)s))
+ON CONFLICT (group_id, kind) WHERE status = 'queued' DO UPDATE SET
+    payload = ai_jobs.payload || EXCLUDED.payload || jsonb_build_object(
+        'text', RIGHT(concat_ws(E'\\n', ai_jobs.payload->>'text', EXCLUDED.payload->>'text'), %(text_max)s)),
+    priority = LEAST(ai_jobs.priority, EXCLUDED.priority),
+    deadline = GREATEST(ai_jobs.deadline, EXCLUDED.deadline),
+    run_after = LEAST(ai_jobs.run_after, EXCLUDED.run_after)
+RETURNING id, (xmax::text <> '0') AS merged
+"""
+
+# 失败 / 租约过期后重新排队：次数用完 -> failed；这个群已经有同类任务在排队 -> 把本任务的文本并进那一行，
+# 本任务 superseded；否则退避后重新排队。终态 (failed / superseded) 都写 finished_at，prune 才能清理。
+# 只处理仍是 running 的行，重复回收 / 任务已经结束时什么都不做。
+# refund=1 把出队时加上的那次 attempts 退回去 (worker 正常停止时被打断的任务不算一次失败)
+_REQUEUE_SQL = """
+WITH cur AS (
+    SELECT id, group_id, kind, payload, priority, attempts - %(refund)s AS attempts, max_attempts FROM ai_jobs
+    WHERE id = %(id)s AND status = 'running'
+),
+merged AS (
+    UPDATE ai_jobs q SET
+        payload = cur.payload || q.payload || jsonb_build_object(
+            'text', RIGHT(concat_ws(E'\\n', cur.payload->>'text', q.payload->>'text'), %(text_max)s)),
+        priority = LEAST(q.priority, cur.priority)
+    FROM cur
+    WHERE q.group_id = cur.group_id AND q.kind = cur.kind AND q.status = 'queued'
+      AND cur.attempts < cur.max_attempts
+    RETURNING q.id
+)
+UPDATE ai_jobs j SET
+    status = CASE
+        WHEN cur.attempts >= cur.max_attempts THEN 'failed'
+        WHEN EXISTS (SELECT 1 FROM merged) THEN 'superseded'
+        ELSE 'queued' END,
+    attempts = cur.attempts,
+    run_after = NOW() + make_interval(secs => %(backoff)s),
+    last_error = %(err)s,
+    locked_by = NULL,
+    finished_at = CASE
+        WHEN cur.attempts >= cur.max_attempts OR EXISTS (SELECT 1 FROM merged) THEN NOW()
+        ELSE NULL END
+FROM cur
+WHERE j.id = cur.id
+RETURNING j.status
+"""
+
+_EXPIRED_LEASES_SQL = """
+SELECT id FROM ai_jobs
+WHERE status = 'running' AND started_at < NOW() - make_interval(secs => %(lease)s)
+"""
+# 本进程 (worker_id) 名下还在 running 的任务：stop() 时放回队列
+_OWN_RUNNING_SQL = "SELECT id FROM ai_jobs WHERE status = 'running' AND locked_by = %(worker)s"
+# 重新排队时撞上并发入队刚插入的 queued 行 (唯一索引冲突) 的重试次数
+_REQUEUE_ATTEMPTS = 3
+
+
+async def run_planner(job: Dict[str, Any]) -> None:
+    payload = job["payload"]
+    # 合并进来的批次里只要有一条 @hikebot，整个任务都按明确请求处理 (优先级也会被合并成 0)
+    explicit = bool(payload.get("mention")) or job.get("priority") == PRIORITY_MENTION
+    db = SessionLocal()
+    try:
+        # 出错直接抛给 _execute 退避重试；最后一次尝试时 WTA 这类可选数据失败就降级继续
+        await AutoPlannerService(db).run_pipeline(
+            chat_id=job["group_id"],
+            user_message=payload.get("text", ""),
+            explicit=explicit,
+            final_attempt=job["attempts"] >= job["max_attempts"],
+        )
+    finally:
+        db.close()
+
+
+class AIJobWorker:
+    """
+    从 ai_jobs 里按优先级取任务执行。每个进程 concurrency 个并发循环，
+    多个进程 (API / 独立 worker) 可以同时跑，靠 SKIP LOCKED 互不重复。
+    """
+
+    def __init__(self, concurrency: int = AI_WORKER_CONCURRENCY, poll_interval: float = AI_JOB_POLL_SECONDS) -> None:
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.handlers: Dict[str, Handler] = {"planner": run_planner}
+        self._tasks: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+
+        self.queue_wait = LatencyWindow(window=1024)
+        self.run_latency = LatencyWindow(window=1024)
+        self.enqueued = 0
+        self.merged = 0
+        self.done = 0
+        self.retried = 0
+        self.failed = 0
+        self.expired = 0
+        self.superseded = 0
+        self.reaped = 0
+
+    def register(self, kind: str, handler: Handler) -> None:
+        self.handlers[kind] = handler
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._loop()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.create_task(self._reap_loop()))
+        logger.info(f"AI job worker {self.worker_id} started with {self.concurrency} slot(s)")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # 被打断的任务立即放回队列 (不算一次尝试)，否则这个群要等租约过期才能再跑 AI；
+        # shield：关闭流程本身被取消时也把这一步做完
+        try:
+            await asyncio.shield(self._release_own_jobs())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Could not requeue interrupted AI jobs, they will wait for the lease to expire: {e}")
+
+    async def _release_own_jobs(self) -> int:
+        released = 0
+        for row in await afetch_all(_OWN_RUNNING_SQL, {"worker": self.worker_id}):
+            if await self._requeue(row["id"], 0, "worker stopped", refund=1) is not None:
+                released += 1
+        if released:
+            logger.info(f"Requeued {released} interrupted AI job(s)")
+        return released
+
+    def notify(self) -> None:
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                job = await afetch_one(AI_JOB_DEQUEUE_SQL, {"worker": self.worker_id})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"AI job dequeue failed: {e}")
+                job = None
+            if job is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._execute(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 记录结果失败 (数据库不可用等)：任务留在 running，租约过期后由 reaper 重新排队，这个槽位继续工作
+                logger.error(f"AI job {job['id']} could not be completed: {e}")
+
+    async def _execute(self, job: Dict[str, Any]) -> None:
+        if isinstance(job["payload"], str):
+            job["payload"] = json.loads(job["payload"])
+        self.queue_wait.observe(max(0.0, job["waited_s"] or 0.0))
+
+        remaining = job["remaining_s"]
+        if remaining is not None and remaining <= 0:
+            await self._finish(job["id"], "expired")
+            return
+        handler = self.handlers.get(job["kind"])
+        if handler is None:
+            await self._finish(job["id"], "failed", f"no handler for kind {job['kind']!r}")
+            return
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            await asyncio.wait_for(handler(job), remaining)
+        except asyncio.TimeoutError:
+            await self._finish(job["id"], "expired", "deadline exceeded")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"AI job {job['id']} ({job['kind']}) failed on attempt {job['attempts']}: {e}")
+            await self._retry(job, repr(e))
+        else:
+            await self._finish(job["id"], "done")
+        finally:
+            self.run_latency.observe(loop.time() - started)
+
+    async def _finish(self, job_id: int, status: str, error: Optional[str] = None) -> None:
+        await aexecute(
+            "UPDATE ai_jobs SET status = %(s)s, last_error = %(err)s, locked_by = NULL, finished_at = NOW() WHERE id = %(id)s",
+            {"s": status, "err": error, "id": job_id},
+        )
+        if status == "done":
+            self.done += 1
+        elif status == "expired":
+            self.expired += 1
+        else:
+            self.failed += 1
+
+    async def _requeue(self, job_id: int, backoff: float, error: str, refund: int = 0) -> Optional[str]:
+        """执行 _REQUEUE_SQL，返回新的状态；行已经不是 running 时返回 None"""
+        params = {
+            "id": job_id, "backoff": backoff, "err": error[:2000], "text_max": _PAYLOAD_TEXT_MAX, "refund": refund,
+        }
+        for attempt in range(_REQUEUE_ATTEMPTS):
+            try:
+                row = await afetch_one(_REQUEUE_SQL, params)
+            except asyncpg.UniqueViolationError:
+                # 语句快照之后有并发的入队插入了同一个群的 queued 行：重跑一次，这次会合并进那一行
+                if attempt == _REQUEUE_ATTEMPTS - 1:
+                    raise
+                continue
+            status = row["status"] if row else None
+            if status == "queued":
+                self.retried += 1
+            elif status == "superseded":
+                self.superseded += 1
+            elif status == "failed":
+                self.failed += 1
+            return status
+        return None
+
+    async def _retry(self, job: Dict[str, Any], error: str) -> None:
+        await self._requeue(job["id"], AI_JOB_BACKOFF_SECONDS * (2 ** (job["attempts"] - 1)), error)
+
+    async def _reap_loop(self) -> None:
+        while True:
+            try:
+                for row in await afetch_all(_EXPIRED_LEASES_SQL, {"lease": AI_JOB_LEASE_SECONDS}):
+                    if await self._requeue(row["id"], 0, "lease expired") is not None:
+                        self.reaped += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"AI job reaper failed: {e}")
+            await asyncio.sleep(max(1.0, AI_JOB_LEASE_SECONDS / 2))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker_id": self.worker_id,
+            "running_here": bool(self._tasks),
+            "concurrency": self.concurrency,
+            "enqueued": self.enqueued,
+            "merged": self.merged,
+            "done": self.done,
+            "retried": self.retried,
+            "failed": self.failed,
+            "expired": self.expired,
+            "superseded": self.superseded,
+            "reaped": self.reaped,
+            "queue_wait": self.queue_wait.snapshot(),
+            "run": self.run_latency.snapshot(),
+        }
+
+
+ai_worker = AIJobWorker()
+
+
+async def enqueue_ai_job(
+    group_id: str,
+    text: str,
+    priority: int = PRIORITY_PASSIVE,
+    kind: str = "planner",
+    deadline_seconds: float = AI_JOB_DEADLINE_SECONDS,
+    mention: bool = False,
+) -> int:
+    """
+    入队一个 AI 任务，返回任务 id；这个群已经有同类任务在排队时合并进去。
+    mention=True 时 payload 带上 "mention": true (只写 true，jsonb 合并后不会被后来的被动消息覆盖掉)。
+    """
+    payload: Dict[str, Any] = {"text": text}
+    if mention:
+        payload["mention"] = True
+    row = await afetch_one(
+        _ENQUEUE_SQL,
+        {
+            "kind": kind,
+            "gid": group_id,
+            "payload": json.dumps(payload, ensure_ascii=False),
+            "prio": priority,
+            "max": AI_JOB_MAX_ATTEMPTS,
+            "ttl": deadline_seconds,
+            "text_max": _PAYLOAD_TEXT_MAX,
+        },
+    )
+    ai_worker.enqueued += 1
+    if row["merged"]:
+        ai_worker.merged += 1
+    ai_worker.notify()
+    return row["id"]
+
+
+async def queue_depth() -> List[Dict[str, Any]]:
+    """排队中 / 执行中的任务数和最老一条等了多久，按状态和优先级分组"""
+    return await afetch_all(
+        """
+        SELECT status, priority, COUNT(*) AS jobs,
+               EXTRACT(EPOCH FROM (NOW() - MIN(created_at)))::float8 AS oldest_s
+        FROM ai_jobs WHERE status IN ('queued', 'running')
+        GROUP BY status, priority ORDER BY status, priority
+        """
+    )
+
+
+def prune_ai_jobs(retention_hours: float = AI_JOB_RETENTION_HOURS) -> int:
+    """删除早已结束的任务记录，返回删除条数"""
+    return execute(
+        "DELETE FROM ai_jobs WHERE finished_at < NOW() - %(h)s * INTERVAL '1 hour'",
+        {"h": retention_hours},
+    )
+
+
+async def _run_standalone() -> None:
+    from app.core.database import init_async_pool, close_async_pool
+    from app.services.llm import llm_client
+
+    await init_async_pool()
+    await ai_worker.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await ai_worker.stop()
+        await llm_client.close()
+        await close_async_pool()
+
+
+if __name__ == "__main__":
+    # 单独的 worker 进程：python -m app.services.ai_jobs (API 那边设置 AI_WORKER_IN_PROCESS=false)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    try:
+        asyncio.run(_run_standalone())
+    except KeyboardInterrupt:
+        pass
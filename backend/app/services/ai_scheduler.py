@@ -0,0 +1,141 @@
+"""Per-group debounce and coalescing of AI pipeline triggers."""
+
+from __future__ import annotations
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from app.services.planner import has_trigger
+from app.services.ai_jobs import PRIORITY_MENTION, PRIORITY_PASSIVE, enqueue_ai_job, is_mention
+
+logger = logging.getLogger(__name__)
+
+# 群里安静多久之后才跑一次 AI (期间每来一条消息重新计时)
+AI_DEBOUNCE_SECONDS = float(os.getenv("AI_DEBOUNCE_SECONDS", "3"))
+# 一直有人说话时最多推迟多久，避免永远等不到安静
+AI_DEBOUNCE_MAX_WAIT_SECONDS = float(os.getenv("AI_DEBOUNCE_MAX_WAIT_SECONDS", "15"))
+# 合并进一次运行的最近消息条数
+AI_COALESCE_MAX_MESSAGES = int(os.getenv("AI_COALESCE_MAX_MESSAGES", "20"))
+
+Runner = Callable[[str, str], Awaitable[Any]]
+
+
+async def enqueue_passive(group_id: str, text: str) -> None:
+    await enqueue_ai_job(group_id, text, priority=PRIORITY_PASSIVE)
+
+
+class _GroupState:
+    __slots__ = ("pending", "first_at", "timer")
+
+    def __init__(self) -> None:
+        self.pending: Deque[str] = deque(maxlen=AI_COALESCE_MAX_MESSAGES)
+        self.first_at = 0.0
+        self.timer: Optional[asyncio.Task] = None
+
+
+class AIScheduler:
+    """
+    每个群一个去抖计时器：带触发词的消息开始计时，之后的消息 (作为上下文) 一起攒着，
+    群里安静 debounce 秒后把攒下的消息合并成一次 runner 调用 (默认是写入 ai_jobs 队列)。
+    runner 只负责入队，很快返回；同一个群还在排队的任务由 ai_jobs 在数据库里合并，
+    每个群同时只跑一个任务也由 worker 出队时保证，这里不再跟踪运行中的任务。
+    """
+
+    def __init__(
+        self,
+        runner: Runner = enqueue_passive,
+        debounce: float = AI_DEBOUNCE_SECONDS,
+        max_wait: float = AI_DEBOUNCE_MAX_WAIT_SECONDS,
+    ) -> None:
+        self.runner = runner
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self._groups: Dict[str, _GroupState] = {}
+
+        self.submitted = 0
+        self.runs = 0
+        self.failed = 0
+
+    async def dispatch(self, group_id: str, content: str) -> None:
+        """
+        路由收到消息后调用：明确 @hikebot 的消息不等去抖，连同已经攒下的上下文立即以高优先级入队；
+        其它消息走 submit() 去抖。
+        """
+        if not is_mention(content):
+            self.submit(group_id, content)
+            return
+        st = self._groups.get(group_id)
+        messages = [content]
+        if st is not None:
+            if st.timer is not None:
+                st.timer.cancel()
+                st.timer = None
+            messages = list(st.pending) + messages
+            del self._groups[group_id]
+        self.submitted += 1
+        self.runs += 1
+        await enqueue_ai_job(group_id, "\n".join(messages), priority=PRIORITY_MENTION, mention=True)
+
+    def submit(self, group_id: str, content: str) -> None:
+        """记录一条新消息；不带触发词、且这个群没有在计时的消息直接忽略"""
+        st = self._groups.get(group_id)
+        if st is None or (st.timer is None and not st.pending):
+            if not has_trigger(content):
+                return
+            if st is None:
+                st = self._groups[group_id] = _GroupState()
+        self.submitted += 1
+        if not st.pending:
+            st.first_at = time.monotonic()
+        st.pending.append(content)
+
+        if st.timer is not None:
+            st.timer.cancel()
+        # 不超过第一条消息之后的 max_wait
+        delay = max(0.0, min(self.debounce, st.first_at + self.max_wait - time.monotonic()))
+        st.timer = asyncio.create_task(self._fire_after(group_id, st, delay))
+
+    async def _fire_after(self, group_id: str, st: _GroupState, delay: float) -> None:
+        await asyncio.sleep(delay)
+        # 先摘掉状态：之后到达的消息开始新的一批，正在进行的入队也不会被 submit / stop 取消
+        st.timer = None
+        messages = list(st.pending)
+        st.pending.clear()
+        if self._groups.get(group_id) is st:
+            del self._groups[group_id]
+
+        self.runs += 1
+        try:
+            await self.runner(group_id, "\n".join(messages))
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"AI pipeline failed for group {group_id}: {e}")
+
+    async def stop(self) -> None:
+        tasks = []
+        for st in self._groups.values():
+            if st.timer is not None and not st.timer.done():
+                st.timer.cancel()
+                tasks.append(st.timer)
+        self._groups.clear()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "debounce_seconds": self.debounce,
+            "max_wait_seconds": self.max_wait,
+            "active_groups": len(self._groups),
+            "submitted": self.submitted,
+            "runs": self.runs,
+            "failed": self.failed,
+            # 平均每次运行合并了多少条消息
+            "coalesce_ratio": round(self.submitted / self.runs, 2) if self.runs else 0.0,
+        }
+
+
+ai_scheduler = AIScheduler()
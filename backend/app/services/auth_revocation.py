@@ -0,0 +1,83 @@
+"""Per-user session revocation shared by signed tokens and the legacy header auth cache."""
+
+from __future__ import annotations
+
+import os
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+from app.core.database import afetch_all, afetch_one
+from app.core.security import SESSION_TTL_SECONDS, revoke_local
+from app.services.realtime import group_manager
+
+logger = logging.getLogger(__name__)
+
+# 定期从 auth_revocations 增量拉取：手工 SQL 改了用户 (触发器写入) 也会在这个时间内对所有进程生效
+AUTH_REVOCATION_REFRESH_SECONDS = float(os.getenv("AUTH_REVOCATION_REFRESH_SECONDS", "30"))
+
+_REVOKE_SQL = """
+INSERT INTO auth_revocations (user_id, revoked_before) VALUES (%(uid)s, NOW())
+ON CONFLICT (user_id) DO UPDATE SET revoked_before = GREATEST(auth_revocations.revoked_before, EXCLUDED.revoked_before)
+RETURNING EXTRACT(EPOCH FROM revoked_before)::float8 AS before
+"""
+
+# 早于最长 token 有效期的记录已经没有意义，不加载
+_LOAD_SQL = """
+SELECT user_id, EXTRACT(EPOCH FROM revoked_before)::float8 AS before
+FROM auth_revocations
+WHERE revoked_before > GREATEST(NOW() - make_interval(secs => %(ttl)s), to_timestamp(%(since)s))
+"""
+
+# 已经加载到的最新 revoked_before；下次只拉这之后的 (留一点余量给并发提交)
+_loaded_until = 0.0
+_SINCE_MARGIN_SECONDS = 5.0
+
+
+async def refresh_revocations() -> int:
+    """把 auth_revocations 里的新记录同步到本进程，返回处理的条数"""
+    global _loaded_until
+    rows = await afetch_all(
+        _LOAD_SQL, {"ttl": float(SESSION_TTL_SECONDS), "since": max(0.0, _loaded_until - _SINCE_MARGIN_SECONDS)}
+    )
+    for r in rows:
+        revoke_local(r["user_id"], r["before"])
+        _loaded_until = max(_loaded_until, r["before"])
+    return len(rows)
+
+
+async def invalidate_user(user_id: int) -> None:
+    """
+    用户被删除、换了 user_code 或改了密码之后调用：
+    记录到数据库 (重启后仍然有效)，本进程立即生效，再通过控制频道通知其它进程。
+    users 表上的触发器也会写同一张表，这里负责让所有进程不用等下一次刷新。
+    """
+    row = await afetch_one(_REVOKE_SQL, {"uid": user_id})
+    before = row["before"]
+    revoke_local(user_id, before)
+    try:
+        await group_manager.publish_control("auth.revoked", user_id=user_id, before=before)
+    except Exception as e:
+        logger.error(f"Failed to publish session revocation for user {user_id}: {e}")
+
+
+async def revocation_loop(interval: float = AUTH_REVOCATION_REFRESH_SECONDS) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh_revocations()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Session revocation refresh failed: {e}")
+
+
+async def _on_control(event: Dict[str, Any]) -> None:
+    if event.get("type") != "auth.revoked":
+        return
+    before: Optional[float] = event.get("before")
+    if before is not None:
+        revoke_local(int(event["user_id"]), float(before))
+
+
+group_manager.add_control_handler(_on_control)
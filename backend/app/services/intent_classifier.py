@@ -0,0 +1,168 @@
+"""Cheap local pre-classifier that decides whether a chat message is worth an LLM intent extraction."""
+
+from __future__ import annotations
+
+import os
+import re
+import json
+import math
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+INTENT_MODEL_DIR = Path(__file__).resolve().parent / "intent_model"
+INTENT_WEIGHTS_PATH = Path(os.getenv("INTENT_WEIGHTS_PATH", INTENT_MODEL_DIR / "weights.json"))
+# 低于这个分数的消息不调用 LLM；不设置时用 weights.json 里按目标召回率选出的阈值，设成 0 等于关闭预筛
+_INTENT_THRESHOLD_ENV = os.getenv("INTENT_THRESHOLD", "")
+
+_WORD = r"(?<![a-z]){}(?![a-z])"
+
+
+def _any(*patterns: str) -> re.Pattern:
+    return re.compile("|".join(patterns), re.IGNORECASE)
+
+
+_WEEKDAY_RE = _any(
+    _WORD.format(r"(?:mon|tues?|wed(?:nes)?|thu(?:rs)?|fri|sat(?:ur)?|sun)(?:day)?"),
+    r"周[一二三四五六日天末]", r"星期[一二三四五六日天]", r"礼拜[一二三四五六日天]",
+)
+_RELATIVE_DATE_RE = _any(
+    _WORD.format(r"(?:tomorrow|tmr|tmrw|tonight|weekend|next week|this week)"),
+    r"明天|后天|下周|这周|周末",
+)
+_ABSOLUTE_DATE_RE = _any(
+    r"\b\d{1,2}/\d{1,2}\b", r"\b\d{4}-\d{2}-\d{2}\b", r"\b\d{1,2}(?:st|nd|rd|th)\b",
+    _WORD.format(r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.? \d{1,2}"),
+    r"\d{1,2}月\d{1,2}[日号]",
+)
+_TIME_RE = _any(
+    r"\b\d{1,2}(?::\d{2})?\s?(?:am|pm)\b", _WORD.format(r"(?:sunrise|sunset|morning|early start)"),
+    r"早上|上午|下午|\d{1,2}点",
+)
+_PLACE_RE = _any(
+    _WORD.format(r"(?:peak|lake|ledge|mountain|mt|mount|falls|ridge|pass|summit|trailhead|loop|canyon|park)"),
+    r"山|湖|峰|步道",
+)
+_HIKE_VERB_RE = _any(_WORD.format(r"(?:hike|hiking|hiked|backpack(?:ing)?|scramble|climb|trek(?:king)?)"), r"爬山|徒步|登山")
+_PROPOSAL_RE = _any(
+    _WORD.format(r"(?:let'?s|lets|we should|should we|wanna|who'?s in|anyone|join us|are you free|count me in|down for|up for|how about)"),
+    r"要不要|一起|有人|去不去",
+)
+_LOGISTICS_RE = _any(
+    _WORD.format(r"(?:carpool|drive|ride|pick (?:you |me )?up|meet at|permit|parking|gear|start at|leave at)"),
+    r"拼车|集合|出发",
+)
+_OFF_TOPIC_RE = _any(
+    _WORD.format(r"(?:lunch|dinner|breakfast|eat|food|meeting|homework|exam|class|work|project|movie|coffee|game|sleep|study|budget|phone)"),
+    r"吃饭|开会|作业|考试|上班",
+)
+# "plan" 在别的搭配里 (meal plan / data plan / plan to eat ...) 基本和出行无关
+_OTHER_PLAN_RE = _any(
+    _WORD.format(r"(?:meal|data|phone|lesson|business|study|workout|payment|floor|project) plans?"),
+    _WORD.format(r"plan (?:b|to (?:eat|sleep|study|work|finish|watch|cook|call))"),
+)
+_PAST_RE = _any(_WORD.format(r"(?:last (?:week|weekend|time|year)|yesterday|went|was|were|did)"), r"上次|昨天|去过")
+_QUESTION_RE = re.compile(r"[?？]")
+_TRIGGER_RE = _any(
+    _WORD.format(r"(?:go to|hike|trail|plan|weekend|trip|join)"), r"去|爬山|路线",
+)
+
+
+def extract_features(text: str, catalog: Iterable[str] = ()) -> Dict[str, float]:
+    """把一条 (或合并后的几条) 消息变成 0/1 为主的特征；名字和 weights.json 里的一一对应。catalog 是小写的步道名"""
+    t = (text or "").lower()
+    words = t.split()
+    features = {
+        "bias": 1.0,
+        "weekday": float(bool(_WEEKDAY_RE.search(t))),
+        "relative_date": float(bool(_RELATIVE_DATE_RE.search(t))),
+        "absolute_date": float(bool(_ABSOLUTE_DATE_RE.search(t))),
+        "time_of_day": float(bool(_TIME_RE.search(t))),
+        "trail_catalog": float(any(name in t for name in catalog)),
+        "place_word": float(bool(_PLACE_RE.search(t))),
+        "hike_verb": float(bool(_HIKE_VERB_RE.search(t))),
+        "proposal": float(bool(_PROPOSAL_RE.search(t))),
+        "logistics": float(bool(_LOGISTICS_RE.search(t))),
+        "question": float(bool(_QUESTION_RE.search(t))),
+        "off_topic": float(bool(_OFF_TOPIC_RE.search(t))),
+        "other_plan": float(bool(_OTHER_PLAN_RE.search(t))),
+        "past_tense": float(bool(_PAST_RE.search(t))),
+        "trigger_count": min(len(_TRIGGER_RE.findall(t)), 3) / 3.0,
+        "short": float(len(words) <= 3 and len(t) <= 12),
+    }
+    return features
+
+
+def _sigmoid(z: float) -> float:
+    if z >= 0:
+        return 1.0 / (1.0 + math.exp(-z))
+    e = math.exp(z)
+    return e / (1.0 + e)
+
+
+class IntentClassifier:
+    """
+    线性模型 (逻辑回归)：score = sigmoid(w · features)。
+    权重由 app/script/train_intent_classifier.py 从 intent_model/labeled.jsonl 训练得到，纯 Python 打分，微秒级。
+    """
+
+    def __init__(self, weights: Dict[str, float], threshold: float, catalog: Iterable[str] = ()) -> None:
+        self.weights = weights
+        self.threshold = threshold
+        self.catalog = sorted({c.lower() for c in catalog if c})
+
+        self.scored = 0
+        self.skipped = 0
+
+    @classmethod
+    def load(cls, path: Path = INTENT_WEIGHTS_PATH, catalog: Iterable[str] = (), threshold: Optional[float] = None) -> "IntentClassifier":
+        """读取 weights.json；文件不存在或损坏时退化成全部放行 (阈值 0)，不影响原有流程"""
+        try:
+            model = json.loads(Path(path).read_text(encoding="utf-8"))
+            weights = {k: float(v) for k, v in model["weights"].items()}
+            default_threshold = float(model.get("threshold", 0.5))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Intent classifier weights unavailable ({e}); every triggered message goes to the LLM")
+            weights, default_threshold = {}, 0.0
+        if threshold is None:
+            threshold = float(_INTENT_THRESHOLD_ENV) if _INTENT_THRESHOLD_ENV else default_threshold
+        return cls(weights, threshold, catalog)
+
+    def score(self, text: str) -> float:
+        features = extract_features(text, self.catalog)
+        return _sigmoid(sum(self.weights.get(name, 0.0) * value for name, value in features.items()))
+
+    def score_window(self, text: str) -> float:
+        """
+        ai_scheduler / ai_jobs 把一段讨论用换行拼成一个批次：逐条打分取最大值。
+        整段一起打分的话，一条无关的消息 (off_topic / past_tense 特征) 就能把真正的规划压到阈值以下。
+        """
+        lines = [line for line in (text or "").split("\n") if line.strip()]
+        if len(lines) <= 1:
+            return self.score(text)
+        return max(self.score(line) for line in lines)
+
+    def should_call_llm(self, text: str) -> bool:
+        if self.threshold <= 0:
+            return True
+        self.scored += 1
+        if self.score_window(text) >= self.threshold:
+            return True
+        self.skipped += 1
+        return False
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "threshold": self.threshold,
+            "scored": self.scored,
+            "skipped": self.skipped,
+            "skip_rate": round(self.skipped / self.scored, 3) if self.scored else 0.0,
+        }
+
+
+def load_labeled(path: Path = INTENT_MODEL_DIR / "labeled.jsonl") -> List[Dict[str, object]]:
+    """标注集：每行 {"text": ..., "label": 0/1, "split": "train"/"eval"}"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,122 @@
+"""Process-wide LLM client with a concurrency limit."""
+
+from __future__ import annotations
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+from app.utils.metrics import LatencyWindow
+
+logger = logging.getLogger(__name__)
+
+# OpenAI 兼容的接口地址 (默认是 Docker 里访问宿主机上的 Ollama)
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "http://host.docker.internal:11434/v1")
+LLM_MODEL = os.getenv("LLM_MODEL", "llama3.2")
+LLM_API_KEY = os.getenv("LLM_API_KEY", "ollama")
+# 同时最多几个请求在生成，其余的排队等待；本地模型一般只能并行处理很少几个
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+
+
+class LLMClient:
+    """
+    整个进程共用一个 AsyncOpenAI 客户端 (底层 httpx 连接池保持 keep-alive)，
+    并用信号量限制同时进行的生成数，统计排队深度和等待时间。
+    """
+
+    def __init__(
+        self,
+        base_url: str = LLM_BASE_URL,
+        model: str = LLM_MODEL,
+        api_key: str = LLM_API_KEY,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        timeout: float = LLM_TIMEOUT_SECONDS,
+    ) -> None:
+        self.base_url = base_url
+        self.model = model
+        self.api_key = api_key
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self._client: Optional[AsyncOpenAI] = None
+        # 第一次使用时再创建，保证绑定的是正在运行的事件循环
+        self._sem: Optional[asyncio.Semaphore] = None
+
+        self.wait_latency = LatencyWindow(window=1024)
+        self.call_latency = LatencyWindow(window=1024)
+        self.waiting = 0
+        self.in_flight = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client is None:
+            # 连接数和并发上限一致：排队发生在信号量上，而不是 httpx 的连接池里
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                ),
+                timeout=self.timeout,
+            )
+            self._client = AsyncOpenAI(base_url=self.base_url, api_key=self.api_key, http_client=http_client)
+        return self._client
+
+    async def chat(self, messages: List[Dict[str, Any]], model: Optional[str] = None, **kwargs: Any) -> Any:
+        """chat.completions.create 的包装：先在信号量上排队，再发请求"""
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+        started = time.perf_counter()
+        self.wait_latency.observe(started - queued_at)
+
+        self.in_flight += 1
+        try:
+            response = await self.client.chat.completions.create(
+                model=model or self.model, messages=messages, **kwargs
+            )
+            self.completed += 1
+            return response
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.call_latency.observe(time.perf_counter() - started)
+            self._sem.release()
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "model": self.model,
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "wait": self.wait_latency.snapshot(),
+            "call": self.call_latency.snapshot(),
+        }
+
+
+llm_client = LLMClient()
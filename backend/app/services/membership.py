@@ -0,0 +1,115 @@
+"""Cached group membership checks shared by REST and realtime authorization."""
+
+from __future__ import annotations
+
+import os
+import logging
+import threading
+from typing import Any, Dict, Iterable, Optional
+from uuid import UUID
+
+from fastapi import Depends, HTTPException
+
+from app.core.database import afetch_one
+from app.core.queries import MEMBER_ROLE_SQL
+from app.models.sql_models import AuthUser
+from app.routers.auth import get_current_user
+from app.services.realtime import group_manager
+from app.utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+MEMBERSHIP_CACHE_TTL = float(os.getenv("MEMBERSHIP_CACHE_TTL", "60"))
+# 不是成员的结果也缓存，但时间短一些 (被邀请后最多等这么久；本进程内的邀请会直接清掉)
+MEMBERSHIP_NEGATIVE_TTL = float(os.getenv("MEMBERSHIP_NEGATIVE_TTL", "10"))
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "50000"))
+
+# (group_id, user_id) -> role；None 表示不是成员
+membership_cache: TTLCache[Optional[str]] = TTLCache(maxsize=MEMBERSHIP_CACHE_SIZE, ttl=MEMBERSHIP_CACHE_TTL)
+
+# 每次失效都加一：查库期间发生过失效的话，查到的结果可能已经过期，不写回缓存
+_generation = 0
+_generation_lock = threading.Lock()
+
+
+async def get_member_role(group_id: str, user_id: int) -> Optional[str]:
+    key = (str(group_id), user_id)
+    hit, role = membership_cache.get(key)
+    if hit:
+        return role
+    generation = _generation
+    row = await afetch_one(MEMBER_ROLE_SQL, {"gid": str(group_id), "uid": user_id})
+    role = row["role"] if row else None
+    if generation == _generation:
+        membership_cache.set(key, role, None if role else MEMBERSHIP_NEGATIVE_TTL)
+    return role
+
+
+async def require_member(group_id: UUID, u: AuthUser = Depends(get_current_user)) -> AuthUser:
+    """路由依赖：当前用户必须是 group_id 的成员，否则 403"""
+    if await get_member_role(str(group_id), u.id) is None:
+        raise HTTPException(403, "Not a member of this group")
+    return u
+
+
+# ==========================================
+# 失效：本进程立即生效，再通过控制频道通知其它进程
+# ==========================================
+
+def _invalidate_local(group_id: str, user_ids: Optional[Iterable[int]]) -> None:
+    global _generation
+    with _generation_lock:
+        _generation += 1
+    if user_ids is None:
+        membership_cache.invalidate_where(lambda key, _role: key[0] == group_id)
+    else:
+        for uid in user_ids:
+            membership_cache.pop((group_id, uid))
+
+
+async def membership_granted(group_id: str, user_ids: Iterable[int]) -> None:
+    """join / invite 之后调用：清掉这些用户的负缓存"""
+    group_id, user_ids = str(group_id), list(user_ids)
+    if not user_ids:
+        return
+    _invalidate_local(group_id, user_ids)
+    try:
+        await group_manager.publish_control("membership.granted", group_id=group_id, user_ids=user_ids)
+    except Exception as e:
+        logger.error(f"Failed to publish membership change for {group_id}: {e}")
+
+
+async def membership_revoked(group_id: str, user_ids: Optional[Iterable[int]] = None) -> None:
+    """
+    leave / kick / 删群之后调用 (user_ids=None 表示整个群)：
+    清缓存，并立即关闭这些用户在这个群里的 WebSocket / SSE 连接。
+    """
+    group_id = str(group_id)
+    user_ids = None if user_ids is None else list(user_ids)
+    _invalidate_local(group_id, user_ids)
+    await _close_local(group_id, user_ids)
+    try:
+        await group_manager.publish_control("membership.revoked", group_id=group_id, user_ids=user_ids)
+    except Exception as e:
+        logger.error(f"Failed to publish membership change for {group_id}: {e}")
+
+
+async def _close_local(group_id: str, user_ids: Optional[Iterable[int]]) -> None:
+    if user_ids is None:
+        await group_manager.close_group_connections(group_id)
+    else:
+        for uid in user_ids:
+            await group_manager.close_group_connections(group_id, uid)
+
+
+async def _on_control(event: Dict[str, Any]) -> None:
+    kind = event.get("type")
+    if kind not in ("membership.granted", "membership.revoked"):
+        return
+    group_id, user_ids = event["group_id"], event.get("user_ids")
+    _invalidate_local(group_id, user_ids)
+    if kind == "membership.revoked":
+        await _close_local(group_id, user_ids)
+
+
+group_manager.add_control_handler(_on_control)
@@ -0,0 +1,252 @@
+"""Monthly partition maintenance and cold archive for group_messages."""
+
+from __future__ import annotations
+
+import os
+import re
+import json
+import logging
+import threading
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from psycopg2 import sql
+
+from app.core.database import fetch_all, fetch_one, get_autocommit_cursor, get_cursor
+
+logger = logging.getLogger(__name__)
+
+# 提前建好多少个月的分区
+MESSAGE_PARTITION_MONTHS_AHEAD = int(os.getenv("MESSAGE_PARTITION_MONTHS_AHEAD", "3"))
+# Postgres 里保留最近多少个月 (含本月)，更早的分区会被归档
+MESSAGE_HOT_MONTHS = int(os.getenv("MESSAGE_HOT_MONTHS", "12"))
+MESSAGE_ARCHIVE_DIR = Path(
+    os.getenv("MESSAGE_ARCHIVE_DIR", Path(__file__).resolve().parents[2] / "data" / "archive" / "group_messages")
+)
+
+_PARTITION_RE = re.compile(r"^group_messages_(\d{4})_(\d{2})$")
+_MANIFEST_NAME = "manifest.json"
+_EXPORT_BATCH = 50_000
+# 多个 worker 同时跑归档时只让一个执行
+_ARCHIVE_LOCK_KEY = 560_007
+
+ARCHIVE_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("group_id", pa.string()),
+    ("user_id", pa.int32()),
+    ("sender_display", pa.string()),
+    ("role", pa.string()),
+    ("content", pa.string()),
+    ("created_at", pa.timestamp("us", tz="UTC")),
+])
+
+
+# ==========================================
+# 1. 分区维护
+# ==========================================
+
+def ensure_partitions(months_ahead: int = MESSAGE_PARTITION_MONTHS_AHEAD) -> int:
+    """补齐从本月到未来 months_ahead 个月的分区，返回新建个数"""
+    row = fetch_one(
+        "SELECT ensure_group_message_partitions(CURRENT_DATE, %(n)s) AS created",
+        {"n": months_ahead},
+    )
+    created = row["created"] if row else 0
+    if created:
+        logger.info(f"Created {created} group_messages partition(s)")
+    return created
+
+
+def _month_index(year: int, month: int) -> int:
+    return year * 12 + (month - 1)
+
+
+def _archivable_tables(keep_months: int) -> List[Dict[str, Any]]:
+    """早于保留期的分区 (含上次归档中断后留下的已 detach / detach 到一半的表)"""
+    today = date.today()
+    cutoff = _month_index(today.year, today.month) - (keep_months - 1)
+    rows = fetch_all(
+        """
+        SELECT c.relname AS name,
+               i.inhrelid IS NOT NULL AS attached,
+               COALESCE(i.inhdetachpending, FALSE) AS detach_pending
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid AND i.inhparent = 'group_messages'::regclass
+        WHERE n.nspname = current_schema() AND c.relkind = 'r'
+          AND c.relname ~ '^group_messages_[0-9]{4}_[0-9]{2}$'
+        ORDER BY c.relname
+        """
+    )
+    result = []
+    for r in rows:
+        m = _PARTITION_RE.match(r["name"])
+        if m and _month_index(int(m.group(1)), int(m.group(2))) < cutoff:
+            result.append(r)
+    return result
+
+
+# ==========================================
+# 2. 归档 (detach -> parquet -> drop)
+# ==========================================
+
+_manifest_lock = threading.Lock()
+_manifest_cache: Optional[Dict[str, Any]] = None
+_manifest_mtime: Optional[float] = None
+
+
+def _manifest_path() -> Path:
+    return MESSAGE_ARCHIVE_DIR / _MANIFEST_NAME
+
+
+def load_manifest() -> Dict[str, Any]:
+    """
+    manifest 记录每个归档文件里有哪些群 (条数、id 范围)，
+    读取历史时只打开真正包含该群的文件。文件有变化时自动重新加载。
+    """
+    global _manifest_cache, _manifest_mtime
+    path = _manifest_path()
+    with _manifest_lock:
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
+            return {"files": {}}
+        if _manifest_cache is None or mtime != _manifest_mtime:
+            _manifest_cache = json.loads(path.read_text(encoding="utf-8"))
+            _manifest_mtime = mtime
+        return _manifest_cache
+
+
+def _write_manifest(manifest: Dict[str, Any]) -> None:
+    path = _manifest_path()
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _export_table(table: str, target: Path) -> Dict[str, Dict[str, int]]:
+    """把一个分区按 (group_id, id) 排序写成 zstd 压缩的 parquet，返回每个群的统计"""
+    groups: Dict[str, Dict[str, int]] = {}
+    tmp = target.with_suffix(".parquet.tmp")
+    writer = pq.ParquetWriter(tmp, ARCHIVE_SCHEMA, compression="zstd")
+    try:
+        with get_cursor() as cur:
+            # 服务器端游标，分批取，不把整个月的数据放进内存
+            with cur.connection.cursor(name=f"export_{table}") as named:
+                named.execute(
+                    sql.SQL(
+                        "SELECT id, group_id::text AS group_id, user_id, sender_display, role, content, created_at "
+                        "FROM {} ORDER BY group_id, id"
+                    ).format(sql.Identifier(table))
+                )
+                while True:
+                    rows = named.fetchmany(_EXPORT_BATCH)
+                    if not rows:
+                        break
+                    batch = {name: [r[name] for r in rows] for name in ARCHIVE_SCHEMA.names}
+                    writer.write_table(pa.Table.from_pydict(batch, schema=ARCHIVE_SCHEMA))
+                    for r in rows:
+                        g = groups.setdefault(r["group_id"], {"count": 0, "min_id": r["id"], "max_id": r["id"]})
+                        g["count"] += 1
+                        g["min_id"] = min(g["min_id"], r["id"])
+                        g["max_id"] = max(g["max_id"], r["id"])
+    finally:
+        writer.close()
+    os.replace(tmp, target)
+    return groups
+
+
+def archive_old_partitions(keep_months: int = MESSAGE_HOT_MONTHS) -> List[str]:
+    """
+    把早于保留期的月分区 detach，导出成 parquet 后删除。返回归档的分区名。
+    中途失败时，已 detach 的表会在下次运行时继续处理。
+    """
+    if keep_months < 1:
+        raise ValueError("keep_months must be >= 1")
+
+    archived: List[str] = []
+    with get_cursor() as lock_cur:
+        lock_cur.execute("SELECT pg_try_advisory_lock(%(k)s) AS locked", {"k": _ARCHIVE_LOCK_KEY})
+        if not lock_cur.fetchone()["locked"]:
+            logger.info("Message archival already running elsewhere; skipping")
+            return archived
+        try:
+            MESSAGE_ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+            for part in _archivable_tables(keep_months):
+                table = part["name"]
+                ident = sql.Identifier(table)
+                if part["attached"]:
+                    # CONCURRENTLY 只拿 SHARE UPDATE EXCLUSIVE 锁，不阻塞父表上的读写；它不能在事务块里执行，
+                    # 所以用单独的 autocommit 连接。上次在中途被打断的 (detach pending) 用 FINALIZE 收尾
+                    action = "FINALIZE" if part["detach_pending"] else "CONCURRENTLY"
+                    with get_autocommit_cursor() as cur:
+                        cur.execute(
+                            sql.SQL("ALTER TABLE group_messages DETACH PARTITION {} {}").format(ident, sql.SQL(action))
+                        )
+
+                filename = f"{table}.parquet"
+                groups = _export_table(table, MESSAGE_ARCHIVE_DIR / filename)
+
+                manifest = dict(load_manifest())
+                files = dict(manifest.get("files", {}))
+                files[filename] = {"partition": table, "groups": groups}
+                manifest["files"] = files
+                _write_manifest(manifest)
+
+                with get_cursor() as cur:
+                    cur.execute(sql.SQL("DROP TABLE {}").format(ident))
+                archived.append(table)
+                logger.info(f"Archived {table} ({sum(g['count'] for g in groups.values())} messages)")
+        finally:
+            lock_cur.execute("SELECT pg_advisory_unlock(%(k)s)", {"k": _ARCHIVE_LOCK_KEY})
+    return archived
+
+
+# ==========================================
+# 3. 读取归档
+# ==========================================
+
+def _to_message(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": row["id"],
+        "group_id": row["group_id"],
+        "sender": row["sender_display"],
+        "role": row["role"],
+        "content": row["content"],
+        "created_at": row["created_at"],
+    }
+
+
+def read_archived_messages(group_id: str, limit: int = 100, before_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    返回某个群 id < before_id 的最新 limit 条归档消息，按时间正序 (格式与 get_msgs 的行一致)。
+    没有归档数据的群、或 manifest 显示 id 范围不相交的文件都不会被打开。
+    """
+    files = load_manifest().get("files", {})
+    candidates = []
+    for name, meta in files.items():
+        g = meta.get("groups", {}).get(group_id)
+        if g and (before_id is None or g["min_id"] < before_id):
+            candidates.append(name)
+    # 文件名里带年月，倒序就是从新到旧
+    candidates.sort(reverse=True)
+
+    result: List[Dict[str, Any]] = []
+    for name in candidates:
+        if len(result) >= limit:
+            break
+        filters = [("group_id", "=", group_id)]
+        if before_id is not None:
+            filters.append(("id", "<", before_id))
+        table = pq.read_table(MESSAGE_ARCHIVE_DIR / name, filters=filters)
+        rows = sorted(table.to_pylist(), key=lambda r: r["id"], reverse=True)
+        result.extend(_to_message(r) for r in rows[: limit - len(result)])
+    result.reverse()
+    return result
+
+
+def has_archived_messages(group_id: str) -> bool:
+    return any(group_id in meta.get("groups", {}) for meta in load_manifest().get("files", {}).values())
@@ -0,0 +1,216 @@
+"""LISTEN/NOTIFY relay from the group message outbox to local realtime rooms."""
+
+from __future__ import annotations
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Set
+
+import asyncpg
+
+from app.core.database import afetch_all, connect_async_listener, execute
+from app.core.queries import GROUP_ACTIVITY_MEMBERS_SQL
+from app.services.realtime import GroupConnectionManager, group_manager
+from app.utils.metrics import LatencyWindow
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_OUTBOX_CHANNEL = "message_outbox"
+# outbox 只用来补发断线期间的消息，保留一天足够
+MESSAGE_OUTBOX_RETENTION_HOURS = float(os.getenv("MESSAGE_OUTBOX_RETENTION_HOURS", "24"))
+# 重连后从断线前多久开始补发 (outbox.created_at 是事务开始时间，长事务可能晚提交)
+OUTBOX_CATCHUP_MARGIN_SECONDS = 60
+_RECONNECT_MAX_DELAY = 30
+# 记住最近投递过的消息 id，补发和 NOTIFY 重叠时不重复推送
+_RECENT_IDS = 10_000
+
+_MESSAGE_COLUMNS = "m.id, m.group_id, m.sender_display AS sender, m.role, m.content, m.created_at"
+
+
+class OutboxRelay:
+    """
+    每个 API 进程一个：用一条独立连接 LISTEN message_outbox，
+    把本进程有人在线的群的新消息查出来交给 GroupConnectionManager；
+    同时给本进程在线 (订阅了用户通知) 的群成员发一条轻量的 group.activity，侧边栏据此刷新未读角标。
+    写消息的代码 (WebSocket、REST、planner、ai_chat ...) 不需要知道 socket 的存在。
+    """
+
+    def __init__(self, manager: GroupConnectionManager) -> None:
+        self.manager = manager
+        self._task: Optional[asyncio.Task] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._pending: Dict[str, Set[int]] = {}
+        self._activity: Set[str] = set()
+        self._wakeup = asyncio.Event()
+        self._recent: Deque[int] = deque()
+        self._recent_set: Set[int] = set()
+        self._lost_at: Optional[float] = None
+        self.connected = False
+
+        self.lag = LatencyWindow(window=1024)
+        self.notifications = 0
+        self.delivered = 0
+        self.skipped = 0
+        self.caught_up = 0
+        self.activity_events = 0
+        self.reconnects = 0
+
+    async def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._flusher):
+            if task:
+                task.cancel()
+        for task in (self._task, self._flusher):
+            if task:
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._flusher = None
+
+    # ---- LISTEN 连接 ----
+
+    async def _run(self) -> None:
+        delay = 1
+        while True:
+            conn: Optional[asyncpg.Connection] = None
+            try:
+                conn = await connect_async_listener()
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda _c: lost.set())
+                await conn.add_listener(MESSAGE_OUTBOX_CHANNEL, self._on_notify)
+                self.connected = True
+                delay = 1
+                if self._lost_at is not None:
+                    await self._catch_up(self._lost_at - OUTBOX_CATCHUP_MARGIN_SECONDS)
+                    self._lost_at = None
+                await lost.wait()
+                logger.warning("Outbox listener connection lost; reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Outbox listener failed: {e}")
+            finally:
+                self.connected = False
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            if self._lost_at is None:
+                self._lost_at = time.time()
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, _RECONNECT_MAX_DELAY)
+
+    def _on_notify(self, _conn, _pid, _channel, payload: str) -> None:
+        # payload: "group_id:message_id,group_id:message_id,..."
+        self.notifications += 1
+        track_activity = bool(self.manager.user_ids())
+        for item in payload.split(","):
+            gid, _, mid = item.partition(":")
+            if not mid:
+                continue
+            if track_activity:
+                self._activity.add(gid)
+            if not self.manager.has_group(gid):
+                self.skipped += 1
+                continue
+            self._pending.setdefault(gid, set()).add(int(mid))
+        if self._pending or self._activity:
+            self._wakeup.set()
+
+    # ---- 查询并投递 ----
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            batch, self._pending = self._pending, {}
+            activity, self._activity = self._activity, set()
+            ids = [mid for mids in batch.values() for mid in mids if mid not in self._recent_set]
+            if ids:
+                try:
+                    rows = await afetch_all(
+                        f"SELECT {_MESSAGE_COLUMNS} FROM group_messages m "
+                        "WHERE m.group_id = ANY(%(gids)s::uuid[]) AND m.id = ANY(%(ids)s::bigint[]) ORDER BY m.id",
+                        {"gids": list(batch), "ids": ids},
+                    )
+                    self._deliver(rows)
+                except Exception as e:
+                    logger.error(f"Outbox relay fetch failed ({len(ids)} messages): {e}")
+            if activity:
+                try:
+                    await self._notify_activity(activity)
+                except Exception as e:
+                    logger.error(f"Outbox relay activity notify failed ({len(activity)} groups): {e}")
+
+    async def _notify_activity(self, gids: Set[str]) -> None:
+        """群里有新消息：通知本进程在线的成员 (不带消息内容，客户端带 etag 重新拉 bootstrap)"""
+        uids = self.manager.user_ids()
+        if not uids:
+            return
+        rows = await afetch_all(GROUP_ACTIVITY_MEMBERS_SQL, {"gids": list(gids), "uids": uids})
+        for r in rows:
+            self.manager.notify_local_user(r["user_id"], "group.activity", group_id=str(r["group_id"]))
+        self.activity_events += len(rows)
+
+    async def _catch_up(self, since: float) -> None:
+        """监听连接断开期间错过的 NOTIFY：按时间从 outbox 补发本进程在线群的消息"""
+        gids = self.manager.group_ids()
+        if not gids:
+            return
+        rows = await afetch_all(
+            f"SELECT {_MESSAGE_COLUMNS} FROM message_outbox o "
+            "JOIN group_messages m ON m.group_id = o.group_id AND m.id = o.message_id "
+            "WHERE o.created_at >= to_timestamp(%(since)s) AND o.group_id = ANY(%(gids)s::uuid[]) ORDER BY m.id",
+            {"since": since, "gids": gids},
+        )
+        before = self.delivered
+        self._deliver(rows)
+        self.caught_up += self.delivered - before
+
+    def _deliver(self, rows: List[Dict[str, Any]]) -> None:
+        now = time.time()
+        for row in rows:
+            mid = row["id"]
+            if mid in self._recent_set:
+                continue
+            self._recent.append(mid)
+            self._recent_set.add(mid)
+            if len(self._recent) > _RECENT_IDS:
+                self._recent_set.discard(self._recent.popleft())
+
+            self.manager.deliver_message(row)
+            self.delivered += 1
+            created = row.get("created_at")
+            if isinstance(created, datetime):
+                self.lag.observe(max(0.0, now - created.timestamp()))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connected": self.connected,
+            "notifications": self.notifications,
+            "delivered": self.delivered,
+            "skipped": self.skipped,
+            "caught_up": self.caught_up,
+            "activity_events": self.activity_events,
+            "reconnects": self.reconnects,
+            "lag": self.lag.snapshot(),
+        }
+
+
+def prune_outbox(retention_hours: float = MESSAGE_OUTBOX_RETENTION_HOURS) -> int:
+    """删除过了补发窗口的 outbox 记录，返回删除条数"""
+    return execute(
+        "DELETE FROM message_outbox WHERE created_at < NOW() - %(h)s * INTERVAL '1 hour'",
+        {"h": retention_hours},
+    )
+
+
+outbox_relay = OutboxRelay(group_manager)
@@ -0,0 +1,191 @@
+"""Write-behind group commit for chat messages."""
+
+from __future__ import annotations
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import asyncpg
+
+from app.core.database import afetch_all
+from app.utils.metrics import LatencyWindow
+
+logger = logging.getLogger(__name__)
+
+# 第一条消息到达后最多等多久再一起写库
+MESSAGE_FLUSH_INTERVAL_MS = float(os.getenv("MESSAGE_FLUSH_INTERVAL_MS", "5"))
+# 一条 INSERT 最多写多少行
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "500"))
+# 待写入队列的上限，写库跟不上时 submit() 会等待 (反压)
+MESSAGE_WRITER_QUEUE_SIZE = int(os.getenv("MESSAGE_WRITER_QUEUE_SIZE", "10000"))
+
+# 按 ord 排序插入，id 的默认值 nextval() 在排序之后依次计算，
+# 所以 id 递增的顺序就是提交的顺序，RETURNING 的行按 id 排序即可对应回每个 future。
+_INSERT_BATCH_SQL = """
+INSERT INTO group_messages (group_id, user_id, sender_display, role, content)
+SELECT t.group_id, t.user_id, t.sender, t.role, t.content
+FROM unnest(
+    %(gids)s::uuid[], %(uids)s::int[], %(senders)s::text[], %(roles)s::text[], %(contents)s::text[]
+) WITH ORDINALITY AS t(group_id, user_id, sender, role, content, ord)
+ORDER BY t.ord
+RETURNING id, group_id, sender_display AS sender, role, content, created_at
+"""
+
+_Pending = Tuple[Tuple[str, Optional[int], str, str, str], asyncio.Future]
+
+# 这些错误是某一行数据本身的问题 (NUL 字符、群 / 用户已被删除导致外键失败...)，重试这一行也不会成功；
+# 其它错误 (连接断开、超时) 跟具体哪一行无关
+_ROW_ERRORS = (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError)
+
+
+class MessageWriter:
+    """
+    把所有群收到的消息缓冲几毫秒，合并成一条多行 INSERT 写入，
+    再把每条消息分配到的 id / created_at 交回给各自的发送者。
+    """
+
+    def __init__(
+        self,
+        flush_interval_ms: float = MESSAGE_FLUSH_INTERVAL_MS,
+        batch_size: int = MESSAGE_BATCH_SIZE,
+        queue_size: int = MESSAGE_WRITER_QUEUE_SIZE,
+    ) -> None:
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        self.flush_latency = LatencyWindow(window=1024)
+        self.batches = 0
+        self.messages = 0
+        self.failed = 0
+        self.rejected = 0
+        self.splits = 0
+        self.max_batch = 0
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """不再接收新消息，把已经排队的全部写完再退出"""
+        if self._task is None:
+            return
+        self._closing = True
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, group_id: str, user_id: Optional[int], sender: str, role: str, content: str) -> Dict[str, Any]:
+        """
+        返回写入后的行。这条消息本身写不进去时抛 ValueError (调用方应告诉发送者并继续)，
+        数据库不可用等其它错误原样抛出。
+        """
+        if self._task is None or self._closing:
+            raise RuntimeError("Message writer is not running")
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put(((group_id, user_id, sender, role, content), fut))
+        return await fut
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                break
+            # 第一条到达后等一个 flush 间隔，让同一时间段的消息凑成一批
+            if self.flush_interval > 0:
+                await asyncio.sleep(self.flush_interval)
+            batch: List[_Pending] = [first]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+        # 关闭时把剩下的也写掉
+        leftover: List[_Pending] = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if item is not None:
+                leftover.append(item)
+        for i in range(0, len(leftover), self.batch_size):
+            await self._flush(leftover[i:i + self.batch_size])
+
+    async def _flush(self, batch: List[_Pending]) -> None:
+        started = time.perf_counter()
+        params = {
+            "gids": [p[0][0] for p in batch],
+            "uids": [p[0][1] for p in batch],
+            "senders": [p[0][2] for p in batch],
+            "roles": [p[0][3] for p in batch],
+            "contents": [p[0][4] for p in batch],
+        }
+        try:
+            rows = await afetch_all(_INSERT_BATCH_SQL, params)
+            if len(rows) != len(batch):
+                raise RuntimeError(f"Inserted {len(rows)} rows for a batch of {len(batch)}")
+        except _ROW_ERRORS as e:
+            if len(batch) > 1:
+                # 一条坏行会让整条 INSERT 失败：二分后分别重试，最终只有出问题的那条失败，
+                # 同一批里其它房间的消息照常写入
+                self.splits += 1
+                mid = len(batch) // 2
+                await self._flush(batch[:mid])
+                await self._flush(batch[mid:])
+                return
+            self.rejected += 1
+            logger.warning(f"Message rejected by the database: {e}")
+            fut = batch[0][1]
+            if not fut.done():
+                fut.set_exception(ValueError(f"Message rejected: {e}"))
+            return
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Message batch insert failed ({len(batch)} messages): {e}")
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        rows.sort(key=lambda r: r["id"])
+        for (_, fut), row in zip(batch, rows):
+            if not fut.done():
+                fut.set_result(row)
+
+        self.flush_latency.observe(time.perf_counter() - started)
+        self.batches += 1
+        self.messages += len(batch)
+        self.max_batch = max(self.max_batch, len(batch))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "flush_interval_ms": self.flush_interval * 1000,
+            "batch_size": self.batch_size,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "batches": self.batches,
+            "messages": self.messages,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "splits": self.splits,
+            "max_batch": self.max_batch,
+            "avg_batch": round(self.messages / self.batches, 2) if self.batches else 0.0,
+            "flush": self.flush_latency.snapshot(),
+        }
+
+
+message_writer = MessageWriter()
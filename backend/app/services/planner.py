@@ -4,7 +4,6 @@ from datetime import datetime
 from typing import Optional, Dict, List
 
 from thefuzz import process
-from openai import AsyncOpenAI
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, Field
 
@@ -14,6 +13,8 @@ from app.core.database import execute
 from app.models.sql_models import Trail
 # ✅ 修正 3: 引用 wta_service (现在它在 app.services 里了)
 from app.services.wta_service import search_wta_trail, get_recent_trip_reports, check_hazards
+from app.services.llm import llm_client
+from app.services.intent_classifier import IntentClassifier
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +44,16 @@ MOCK_TRAILS_DB = [
     },
 ]
 
+# 关键词之后的第二道过滤：本地线性模型打分，低于 INTENT_THRESHOLD 的消息不调用 LLM
+intent_classifier = IntentClassifier.load(catalog=[t["name"] for t in MOCK_TRAILS_DB])
+
+# 只有包含这些词的消息才可能触发 AI 规划
+TRIGGER_WORDS = ["go to", "hike", "trail", "plan", "weekend", "trip", "join", "去", "爬山", "路线"]
+
+def has_trigger(text: str) -> bool:
+    lowered = (text or "").lower()
+    return any(k in lowered for k in TRIGGER_WORDS)
+
 class ExtractionSchema(BaseModel):
     is_planning_trip: bool = Field(description="True only if users are actively proposing a plan.")
     trail_name_raw: Optional[str] = None
@@ -54,17 +65,21 @@ class ExtractionSchema(BaseModel):
 class AutoPlannerService:
     def __init__(self, db: Session):
         self.db = db
-        # 确保 Docker 内部能访问 Ollama
-        self.client = AsyncOpenAI(
-            base_url="http://host.docker.internal:11434/v1",
-            api_key="ollama",
-        )
-        self.model_name = "llama3.2" 
+        # 进程共用的客户端 (连接池 + 并发上限)，地址和模型名来自 LLM_BASE_URL / LLM_MODEL
+        self.client = llm_client
 
-    async def run_pipeline(self, chat_id: str, user_message: str):
-        triggers = ["go to", "hike", "trail", "plan", "weekend", "trip", "join", "去", "爬山", "路线"]
-        if not any(k in user_message.lower() for k in triggers):
-            return
+    async def run_pipeline(self, chat_id: str, user_message: str, explicit: bool = False, final_attempt: bool = True):
+        """
+        explicit=True 表示有人明确 @hikebot：跳过关键词和预筛，一定交给 LLM 判断。
+        LLM / 数据库出错时直接抛出，由 ai_jobs 退避重试；
+        WTA 只是补充信息，只有最后一次尝试 (final_attempt) 才降级成没有 WTA 数据继续发。
+        """
+        if not explicit:
+            if not has_trigger(user_message):
+                return
+            if not intent_classifier.should_call_llm(user_message):
+                logger.debug("Intent pre-classifier skipped message below threshold")
+                return
 
         extraction = await self._extract_intent(user_message)
         if not extraction.is_planning_trip or not extraction.trail_name_raw:
@@ -93,6 +108,8 @@ class AutoPlannerService:
             else:
                 wta_context = "Trail not found on WTA."
         except Exception as e:
+            if not final_attempt:
+                raise
             logger.error(f"WTA lookup failed: {e}")
             wta_context = "WTA data unavailable."
 
@@ -115,16 +132,12 @@ class AutoPlannerService:
         Check if user is planning a hike.
         Return ONLY a JSON object: {{"is_planning_trip": true, "trail_name_raw": "...", "target_date_str": "..."}}
         """
-        try:
-            response = await self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": message}],
-                response_format={"type": "json_object"}, 
-                temperature=0.0
-            )
-            return ExtractionSchema(**json.loads(response.choices[0].message.content))
-        except Exception:
-            return ExtractionSchema(is_planning_trip=False)
+        response = await self.client.chat(
+            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": message}],
+            response_format={"type": "json_object"}, 
+            temperature=0.0
+        )
+        return ExtractionSchema(**json.loads(response.choices[0].message.content))
 
     def _fuzzy_match_trail(self, raw_name: str):
         # 1. Try DB
@@ -158,23 +171,16 @@ class AutoPlannerService:
         Return JSON:
         {{"title": "Trip Plan: {trail.name}", "summary": "...", "stats": {{"dist": "{trail.length_km}km", "elev": "{trail.elevation_gain_m}m"}}, "weather_warning": "...", "gear_required": ["Item1", "Item2"], "fun_fact": "..."}}
         """
-        try:
-            response = await self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": "Generate plan"}],
-                response_format={"type": "json_object"},
-                temperature=0.7
-            )
-            return json.loads(response.choices[0].message.content)
-        except Exception:
-            return {"title": "Error", "stats": {}}
+        response = await self.client.chat(
+            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": "Generate plan"}],
+            response_format={"type": "json_object"},
+            temperature=0.7
+        )
+        return json.loads(response.choices[0].message.content)
 
     def _post_announcement_to_db(self, chat_id: str, content_json: Dict):
         content_str = json.dumps(content_json)
-        try:
-            execute(
-                "INSERT INTO group_messages (group_id, sender_display, role, content, created_at) VALUES (%(gid)s, 'HikeBot', 'assistant', %(c)s, NOW())",
-                {"gid": chat_id, "c": content_str}
-            )
-        except Exception as e:
-            logger.error(f"DB Write failed: {e}")
\ No newline at end of file
+        execute(
+            "INSERT INTO group_messages (group_id, sender_display, role, content, created_at) VALUES (%(gid)s, 'HikeBot', 'assistant', %(c)s, NOW())",
+            {"gid": chat_id, "c": content_str}
+        )
\ No newline at end of file
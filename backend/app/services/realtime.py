@@ -0,0 +1,444 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import itertools
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import WebSocket
+
+from app.core.broadcast import BroadcastBackend, create_backend
+from app.core.database import afetch_all
+from app.utils.metrics import LatencyWindow
+
+logger = logging.getLogger(__name__)
+
+GROUP_CHANNEL_PREFIX = "hikebot:group:"
+# 每个用户自己的通知频道 (好友请求、被邀请进群、被踢等)，和群房间分开
+USER_CHANNEL_PREFIX = "hikebot:user:"
+# 进程之间的控制消息 (成员变更后清缓存、关闭被踢用户的连接)，每个进程都订阅
+CONTROL_CHANNEL = "hikebot:control"
+# 被移出群时关闭连接用的 close code (和连接时不是成员一样)
+WS_CLOSE_NOT_MEMBER = 4403
+
+# 每个连接最多积压多少帧没发出去
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+# 队列满时怎么处理慢客户端：drop_oldest / coalesce / disconnect
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest")
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+# disconnect 策略关闭连接时用的 close code (1013 = try again later)
+WS_CLOSE_SLOW_CONSUMER = 1013
+# 每个在线群在内存里保留最近多少条消息，断线重连时按 last_id 补发
+WS_REPLAY_BUFFER_SIZE = int(os.getenv("WS_REPLAY_BUFFER_SIZE", "256"))
+# 缺口比内存缓冲更早时，从数据库最多补多少条 (更多的让客户端走 REST 分页)
+WS_REPLAY_DB_LIMIT = int(os.getenv("WS_REPLAY_DB_LIMIT", "500"))
+
+_connection_ids = itertools.count(1)
+
+
+def _group_channel(group_id: str) -> str:
+    return f"{GROUP_CHANNEL_PREFIX}{group_id}"
+
+
+def _user_channel(user_id: int) -> str:
+    return f"{USER_CHANNEL_PREFIX}{user_id}"
+
+
+def _message_frame(row: Dict[str, Any]) -> str:
+    """group_messages 的一行 -> 推给客户端的 JSON 帧 (GroupMessageModel 的格式)"""
+    created = row.get("created_at")
+    return json.dumps({
+        "type": "message",
+        "id": row["id"],
+        "group_id": str(row["group_id"]),
+        "sender": row["sender"],
+        "role": row["role"],
+        "content": row["content"],
+        "created_at": created.isoformat() if created else None,
+    })
+
+
+class RoomStats:
+    """单个房间 (群或用户频道) 的投递指标：从收到广播到写进 socket 的耗时，以及丢帧 / 合并 / 踢出次数"""
+
+    def __init__(self) -> None:
+        self.fanout = LatencyWindow(window=1024)
+        self.broadcasts = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.slow_disconnects = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "broadcasts": self.broadcasts,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "slow_disconnects": self.slow_disconnects,
+            "delivery": self.fanout.snapshot(),
+        }
+
+
+class ReplayBuffer:
+    """
+    一个群最近投递过的消息 (message_id, 已序列化的帧)，按到达顺序。
+    只在房间存在期间持续接收，所以只要 last_id 不早于缓冲里最旧一条的前一个 id，缺口就一定完整地在这里。
+    """
+
+    def __init__(self, size: int) -> None:
+        self._frames: Deque[Tuple[int, str]] = deque(maxlen=size)
+
+    def append(self, message_id: int, data: str) -> None:
+        self._frames.append((message_id, data))
+
+    def since(self, last_id: int) -> Optional[List[str]]:
+        """last_id 之后的帧；缓冲覆盖不到这个缺口时返回 None"""
+        # last_id == 最旧 id - 1：客户端正好停在缓冲开始之前，缺口就是整个缓冲
+        if not self._frames or last_id < self._frames[0][0] - 1:
+            return None
+        return [data for mid, data in self._frames if mid > last_id]
+
+
+# 慢客户端 coalesce 策略合并出来的帧：{"type": "batch", "messages": [原来的帧, ...]}
+_BATCH_HEAD = '{"type": "batch", "messages": ['
+_BATCH_TAIL = "]}"
+
+
+def _batch_frame(frames: List[str]) -> str:
+    """把多帧合成一个 batch 帧；已经是 batch 的帧先拆开，不会嵌套"""
+    parts = [f[len(_BATCH_HEAD):-len(_BATCH_TAIL)] if f.startswith(_BATCH_HEAD) else f for f in frames]
+    return _BATCH_HEAD + ",".join(p for p in parts if p) + _BATCH_TAIL
+
+
+def _replay_frame(source: str, frames: List[str], truncated: bool = False) -> str:
+    # 补发的消息合成一帧发出，不占用发送队列的名额，也不会触发慢客户端策略
+    head = json.dumps({"type": "replay", "source": source, "truncated": truncated})
+    return head[:-1] + ', "messages": [' + ",".join(frames) + "]}"
+
+
+class Connection:
+    """
+    一个客户端连接 + 它自己的有界发送队列。
+    广播只负责入队 (不等待)，由独立的 writer task 按顺序写进 socket，
+    一个网络很差的客户端不会拖慢同一个群里的其他人。
+    """
+
+    def __init__(
+        self,
+        manager: "GroupConnectionManager",
+        channel: str,
+        user_id: int,
+        send: Callable[[str], Awaitable[None]],
+        close: Callable[[int], Awaitable[None]],
+    ) -> None:
+        self.id = next(_connection_ids)
+        self.manager = manager
+        self.channel = channel
+        self.user_id = user_id
+        self._send = send
+        self._close = close
+        self._queue: Deque[Tuple[str, float]] = deque()
+        self._ready = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        # 从数据库补发期间先把实时消息扣下来，补发完再按 id 去重放行，保证顺序
+        self._held: Optional[List[Tuple[str, float, Optional[int]]]] = None
+        self.closed = False
+        # 慢消费者被踢时的关闭任务：保留引用 (避免被 GC)，同时表示连接正在关闭，之后的入队全部忽略
+        self._closing: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def hold(self) -> None:
+        self._held = []
+
+    def release(self, after_id: int, first: Optional[str] = None) -> None:
+        """结束 hold：先发 first (补发帧)，再按顺序放行扣下的实时消息里 id > after_id 的部分"""
+        held, self._held = self._held or [], None
+        if first is not None:
+            self.enqueue(first, time.monotonic())
+        for data, received_at, message_id in held:
+            if message_id is None or message_id > after_id:
+                self.enqueue(data, received_at, message_id)
+
+    @property
+    def closing(self) -> bool:
+        return self.closed or self._closing is not None
+
+    def enqueue(self, data: str, received_at: float, message_id: Optional[int] = None) -> None:
+        if self.closing:
+            return
+        if self._held is not None:
+            self._held.append((data, received_at, message_id))
+            return
+        stats = self.manager.room_stats(self.channel)
+        if len(self._queue) >= self.manager.queue_size:
+            policy = self.manager.policy
+            if policy == "disconnect":
+                stats.slow_disconnects += 1
+                self._queue.clear()
+                self._closing = asyncio.create_task(self.manager.disconnect(self, code=WS_CLOSE_SLOW_CONSUMER))
+                return
+            if policy == "coalesce":
+                # 把积压的帧合并成一个 batch 帧，客户端一次收到全部 (客户端按 type == "batch" 拆开)
+                oldest = self._queue[0][1]
+                stats.coalesced += len(self._queue) - 1
+                merged = _batch_frame([frame for frame, _ in self._queue])
+                self._queue.clear()
+                self._queue.append((merged, oldest))
+            else:
+                self._queue.popleft()
+                stats.dropped += 1
+        self._queue.append((data, received_at))
+        self._ready.set()
+
+    async def _write_loop(self) -> None:
+        while True:
+            await self._ready.wait()
+            while self._queue:
+                data, received_at = self._queue.popleft()
+                try:
+                    await self._send(data)
+                except Exception as e:
+                    logger.info(f"Dropping connection {self.id} (user {self.user_id}) in {self.channel}: {e}")
+                    await self.manager.disconnect(self)
+                    return
+                self.manager.room_stats(self.channel).fanout.observe(time.monotonic() - received_at)
+            self._ready.clear()
+
+    def shutdown(self) -> bool:
+        """同步地标记关闭并停掉 writer (不含 await，调用方被取消也不会做一半)；第一次调用返回 True"""
+        if self.closed:
+            return False
+        self.closed = True
+        if self._writer and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        return True
+
+    async def send_close(self, code: int) -> None:
+        try:
+            await self._close(code)
+        except Exception:
+            pass
+
+    async def aclose(self, code: Optional[int] = None) -> None:
+        if self.shutdown() and code is not None:
+            await self.send_close(code)
+
+
+class GroupConnectionManager:
+    """
+    每个进程只管理自己的连接。
+    房间以频道名为 key：群房间 hikebot:group:{id}，用户通知频道 hikebot:user:{id}。
+    群消息不走 backend，而是由每个进程的 message_outbox relay 调 deliver_message 投递，所以群房间不订阅 backend；
+    用户通知和控制消息发布到 backend，再由 _on_message 交回每个订阅了的进程。
+    """
+
+    def __init__(
+        self,
+        backend: BroadcastBackend,
+        queue_size: int = WS_SEND_QUEUE_SIZE,
+        policy: str = WS_SLOW_CONSUMER_POLICY,
+    ) -> None:
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.backend = backend
+        self.backend.set_handler(self._on_message)
+        self.queue_size = queue_size
+        self.policy = policy
+        self.rooms: Dict[str, Dict[int, Connection]] = {}
+        self._stats: Dict[str, RoomStats] = {}
+        self._replay: Dict[str, ReplayBuffer] = {}
+        self._control_handlers: List[Callable[[Dict[str, Any]], Awaitable[None]]] = []
+        self.replays_memory = 0
+        self.replays_db = 0
+        self.replayed_messages = 0
+
+    async def start(self) -> None:
+        await self.backend.start()
+        await self.backend.subscribe(CONTROL_CHANNEL)
+
+    async def stop(self) -> None:
+        for room in list(self.rooms.values()):
+            for conn in list(room.values()):
+                await self.disconnect(conn, code=1001)
+        await self.backend.stop()
+
+    def room_stats(self, channel: str) -> RoomStats:
+        stats = self._stats.get(channel)
+        if stats is None:
+            stats = self._stats[channel] = RoomStats()
+        return stats
+
+    async def _add(self, conn: Connection, last_id: Optional[int] = None) -> Connection:
+        if conn.channel not in self.rooms:
+            self.rooms[conn.channel] = {}
+            if conn.channel.startswith(GROUP_CHANNEL_PREFIX):
+                self._replay[conn.channel] = ReplayBuffer(WS_REPLAY_BUFFER_SIZE)
+            else:
+                await self.backend.subscribe(conn.channel)
+        self.rooms[conn.channel][conn.id] = conn
+        conn.start()
+        if last_id is not None:
+            # 注册和读缓冲之间没有 await，缓冲里的最后一条和之后的实时消息正好接上
+            frames = self._replay[conn.channel].since(last_id) if conn.channel in self._replay else None
+            if frames is not None:
+                self.replays_memory += 1
+                self.replayed_messages += len(frames)
+                conn.enqueue(_replay_frame("memory", frames), time.monotonic())
+            else:
+                conn.hold()
+                await self._replay_from_db(conn, last_id)
+        return conn
+
+    async def _replay_from_db(self, conn: Connection, last_id: int) -> None:
+        """缺口比内存缓冲更早 (或房间刚建立)：按 (group_id, id) 索引从数据库补"""
+        group_id = conn.channel[len(GROUP_CHANNEL_PREFIX):]
+        rows: List[Dict[str, Any]] = []
+        try:
+            rows = await afetch_all(
+                "SELECT id, group_id, sender_display AS sender, role, content, created_at FROM group_messages "
+                "WHERE group_id = %(gid)s AND id > %(after)s ORDER BY id ASC LIMIT %(lim)s",
+                {"gid": group_id, "after": last_id, "lim": WS_REPLAY_DB_LIMIT + 1},
+            )
+        except Exception as e:
+            logger.error(f"Replay from database failed for {group_id}: {e}")
+        truncated = len(rows) > WS_REPLAY_DB_LIMIT
+        rows = rows[:WS_REPLAY_DB_LIMIT]
+        self.replays_db += 1
+        self.replayed_messages += len(rows)
+        # truncated 时客户端应该用 REST 的 after_id 分页补齐剩下的部分
+        conn.release(rows[-1]["id"] if rows else last_id, _replay_frame("db", [_message_frame(r) for r in rows], truncated))
+
+    async def connect(self, group_id: str, user_id: int, websocket: WebSocket, last_id: Optional[int] = None) -> Connection:
+        """last_id 是客户端收到的最后一条消息 id：重连时只补发缺口，内存缓冲覆盖不到才查数据库"""
+        await websocket.accept()
+        return await self._add(
+            Connection(self, _group_channel(group_id), user_id, websocket.send_text, lambda code: websocket.close(code=code)),
+            last_id,
+        )
+
+    async def attach(
+        self,
+        group_id: str,
+        user_id: int,
+        send: Callable[[str], Awaitable[None]],
+        close: Callable[[int], Awaitable[None]],
+    ) -> Connection:
+        """非 WebSocket 的订阅者 (比如 SSE) 用自己的 send / close 加入房间，享受同样的队列和慢客户端策略"""
+        return await self._add(Connection(self, _group_channel(group_id), user_id, send, close))
+
+    async def attach_user(
+        self,
+        user_id: int,
+        send: Callable[[str], Awaitable[None]],
+        close: Callable[[int], Awaitable[None]],
+    ) -> Connection:
+        """订阅用户自己的通知频道"""
+        return await self._add(Connection(self, _user_channel(user_id), user_id, send, close))
+
+    async def disconnect(self, conn: Connection, code: Optional[int] = None):
+        # 本地注销和停掉 writer 都在第一个 await 之前完成：即使调用方在 unsubscribe 时被取消，也不会留下半个连接
+        room = self.rooms.get(conn.channel)
+        emptied = bool(room) and room.pop(conn.id, None) is not None and not room
+        if emptied:
+            del self.rooms[conn.channel]
+            self._stats.pop(conn.channel, None)
+            # 房间没人之后不再接收消息，缓冲也就不再连续，直接丢掉
+            self._replay.pop(conn.channel, None)
+        first = conn.shutdown()
+        if emptied and not conn.channel.startswith(GROUP_CHANNEL_PREFIX):
+            await self.backend.unsubscribe(conn.channel)
+        if first and code is not None:
+            await conn.send_close(code)
+
+    def has_group(self, group_id: str) -> bool:
+        return _group_channel(group_id) in self.rooms
+
+    def group_ids(self) -> List[str]:
+        return [c[len(GROUP_CHANNEL_PREFIX):] for c in self.rooms if c.startswith(GROUP_CHANNEL_PREFIX)]
+
+    def user_ids(self) -> List[int]:
+        return [int(c[len(USER_CHANNEL_PREFIX):]) for c in self.rooms if c.startswith(USER_CHANNEL_PREFIX)]
+
+    def notify_local_user(self, user_id: int, event_type: str, **payload: Any) -> None:
+        """和 notify_user 一样的帧，但只投给本进程的连接 (每个进程各自都会收到触发它的 NOTIFY)"""
+        self._send_local(
+            _user_channel(user_id), json.dumps({"type": event_type, "at": time.time(), **payload}, default=str)
+        )
+
+    def deliver_message(self, row: Dict[str, Any]) -> None:
+        """
+        把一条 group_messages 行 (GroupMessageModel 的格式) 放进本进程该群所有连接的队列。
+        消息不走 backend：每个进程的 outbox relay 都会从 Postgres 收到 NOTIFY，各自投递给本地连接。
+        """
+        channel = _group_channel(str(row["group_id"]))
+        data = _message_frame(row)
+        replay = self._replay.get(channel)
+        if replay is not None:
+            replay.append(row["id"], data)
+        self._send_local(channel, data, row["id"])
+
+    async def close_group_connections(self, group_id: str, user_id: Optional[int] = None, code: int = WS_CLOSE_NOT_MEMBER) -> int:
+        """关闭本进程里某个群 (某个用户，或 user_id=None 时所有人) 的连接，返回关闭个数"""
+        room = self.rooms.get(_group_channel(group_id))
+        if not room:
+            return 0
+        doomed = [c for c in room.values() if user_id is None or c.user_id == user_id]
+        for conn in doomed:
+            await self.disconnect(conn, code=code)
+        return len(doomed)
+
+    def add_control_handler(self, handler: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+        self._control_handlers.append(handler)
+
+    async def publish_control(self, event_type: str, **payload: Any):
+        """发给所有进程 (包括自己) 的控制消息，由 add_control_handler 注册的回调处理"""
+        await self.backend.publish(CONTROL_CHANNEL, json.dumps({"type": event_type, **payload}, default=str))
+
+    async def notify_user(self, user_id: int, event_type: str, **payload: Any):
+        """给某个用户的所有在线客户端推一条带类型的通知，客户端按 type 只刷新对应的数据"""
+        await self.backend.publish(
+            _user_channel(user_id),
+            json.dumps({"type": event_type, "at": time.time(), **payload}, default=str),
+        )
+
+    async def notify_users(self, user_ids: Iterable[int], event_type: str, **payload: Any):
+        for uid in user_ids:
+            await self.notify_user(uid, event_type, **payload)
+
+    async def _on_message(self, channel: str, data: str):
+        if channel == CONTROL_CHANNEL:
+            event = json.loads(data)
+            for handler in self._control_handlers:
+                await handler(event)
+            return
+        self._send_local(channel, data)
+
+    def _send_local(self, channel: str, data: str, message_id: Optional[int] = None):
+        room = self.rooms.get(channel)
+        if not room: return
+        received_at = time.monotonic()
+        self.room_stats(channel).broadcasts += 1
+        for conn in list(room.values()):
+            conn.enqueue(data, received_at, message_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy,
+            "queue_size": self.queue_size,
+            "replay": {
+                "buffer_size": WS_REPLAY_BUFFER_SIZE,
+                "from_memory": self.replays_memory,
+                "from_db": self.replays_db,
+                "messages": self.replayed_messages,
+            },
+            "rooms": {
+                channel: {"connections": len(room), **self.room_stats(channel).snapshot()}
+                for channel, room in self.rooms.items()
+            },
+        }
+
+
+group_manager = GroupConnectionManager(create_backend())
@@ -1,28 +1,16 @@
-import os
 import logging
 import pandas as pd
 import osmnx as ox
-from sqlalchemy import create_engine
-from geoalchemy2 import Geometry
 from dotenv import load_dotenv
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 必须在导入 database 之前加载，POSTGRES_* 在导入时读取
 load_dotenv()
 
-# 数据库配置
-DB_USER = os.getenv("POSTGRES_USER", "hikebot")
-DB_PASS = os.getenv("POSTGRES_PASSWORD", "hikebot")
-DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
-DB_PORT = os.getenv("POSTGRES_PORT", "5432")
-DB_NAME = os.getenv("POSTGRES_DB", "hikebot")
-
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-
-def get_db_engine():
-    return create_engine(DATABASE_URL)
+from app.core.database import unit_of_work
 
 def fetch_trails_from_point(lat: float, lon: float, dist: int = 2000):
     logger.info(f"🌍 [1/3] 正在强制抓取坐标 ({lat}, {lon}) 周围 {dist}米 的数据...")
@@ -44,6 +32,29 @@ def fetch_trails_from_osm(place_name: str):
 def add_elevation_data(G, raster_path=None):
     return G
 
+def _clean_value(value):
+    # pandas 的 NaN / NaT 在 COPY 里写成 NULL
+    if value is None:
+        return None
+    try:
+        if pd.isna(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+    return value
+
+def _iter_trail_rows(db_gdf, text_columns):
+    """逐行产出 COPY 数据，几何体转成 EWKT (SRID=4326;LINESTRING(...))"""
+    for rec in db_gdf.itertuples(index=False):
+        row = rec._asdict()
+        values = [_clean_value(row[c]) for c in text_columns]
+        values = [None if v is None else str(v) for v in values]
+        geom = row['geometry']
+        yield values + [
+            _clean_value(row['length_km']),
+            f"SRID=4326;{geom.wkt}" if geom is not None and not geom.is_empty else None,
+        ]
+
 def process_and_save_to_db(G, table_name="trails"):
     if not G or len(G.edges) == 0:
         logger.warning("⚠️  图形为空，无法保存！")
@@ -111,16 +122,29 @@ def process_and_save_to_db(G, table_name="trails"):
         # 提取数据
         db_gdf = gdf_edges[final_column_list].copy()
         
-        # 6. 存入数据库
-        engine = get_db_engine()
-        db_gdf.to_postgis(
-            name=table_name,
-            con=engine,
-            if_exists='replace', # 覆盖重建表
-            index=False,
-            dtype={'geometry': Geometry('LINESTRING', srid=4326)}
-        )
-        logger.info(f"🚀 写入成功! 表结构已更新，包含所有指定字段。")
+        # 6. 存入数据库：同一个事务里重建表 + COPY 流式写入 (替代逐行 / pandas 写入)
+        text_columns = ['name'] + target_columns
+        ddl_columns = ",\n".join(f'    "{c}" TEXT' for c in text_columns)
+        with unit_of_work() as uow:
+            uow.execute("CREATE EXTENSION IF NOT EXISTS postgis")
+            uow.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+            uow.execute(
+                f"""
+                CREATE TABLE "{table_name}" (
+                    id BIGSERIAL PRIMARY KEY,
+                {ddl_columns},
+                    length_km DOUBLE PRECISION,
+                    geometry geometry(LINESTRING, 4326)
+                )
+                """
+            )
+            copied = uow.copy_rows(
+                table_name,
+                text_columns + ['length_km', 'geometry'],
+                _iter_trail_rows(db_gdf, text_columns),
+            )
+            uow.execute(f'CREATE INDEX ON "{table_name}" (name)')
+        logger.info(f"🚀 写入成功! 共 {copied} 条路段，表结构包含所有指定字段。")
         
     except Exception as e:
         logger.error(f"❌ 数据库写入失败: {e}")
@@ -0,0 +1,57 @@
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional
+
+
+def _pick(sorted_samples, q: float) -> Optional[float]:
+    if not sorted_samples:
+        return None
+    idx = min(len(sorted_samples) - 1, max(0, int(round(q * (len(sorted_samples) - 1)))))
+    return sorted_samples[idx]
+
+
+class LatencyWindow:
+    """
+    线程安全的延迟统计：累计 count / total / max，
+    百分位数基于最近 window 个样本 (有上限，不会无限增长)。
+    """
+
+    def __init__(self, window: int = 2048) -> None:
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        return _pick(samples, q)
+
+    def snapshot(self) -> Dict[str, float]:
+        """返回毫秒单位的统计"""
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total, max_ = self.count, self.total, self.max
+
+        def _pct(q: float) -> float:
+            value = _pick(samples, q)
+            return round(value * 1000, 3) if value is not None else 0.0
+
+        return {
+            "count": count,
+            "total_ms": round(total * 1000, 3),
+            "avg_ms": round(total * 1000 / count, 3) if count else 0.0,
+            "max_ms": round(max_ * 1000, 3),
+            "p50_ms": _pct(0.50),
+            "p95_ms": _pct(0.95),
+            "p99_ms": _pct(0.99),
+        }
@@ -1,27 +1,40 @@
+-- 001: 社交功能的基础表结构 (唯一的建表来源，init_db.py 只负责按编号执行这些文件)
+CREATE EXTENSION IF NOT EXISTS "pgcrypto";
+
 -- users：用户名 + 唯一 ID + 密码 hash
 CREATE TABLE IF NOT EXISTS users (
     id SERIAL PRIMARY KEY,
-    username TEXT NOT NULL UNIQUE,
-    user_code TEXT NOT NULL UNIQUE, -- 你的 ID，字母数字组合
-    password_hash TEXT NOT NULL,
+    username VARCHAR(50) NOT NULL UNIQUE,
+    user_code VARCHAR(20) NOT NULL UNIQUE, -- 你的 ID，字母数字组合
+    password_hash VARCHAR(128) NOT NULL,
     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
 
--- 好友关系（互为好友）
-CREATE TABLE IF NOT EXISTS friendships (
+-- 好友请求：用来支持 "pending" 流程
+CREATE TABLE IF NOT EXISTS friend_requests (
     id SERIAL PRIMARY KEY,
+    from_user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    to_user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',  -- pending / accepted / declined
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    responded_at TIMESTAMPTZ,
+    UNIQUE (from_user_id, to_user_id)
+);
+
+-- 好友关系（互为好友，每对存两行）
+CREATE TABLE IF NOT EXISTS friendships (
     user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     friend_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-    CONSTRAINT friendships_unique_pair UNIQUE (user_id, friend_id)
+    PRIMARY KEY (user_id, friend_id)
 );
 
 -- groups：类似 Slack 的 channel
 CREATE TABLE IF NOT EXISTS groups (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-    name TEXT NOT NULL,
+    name VARCHAR(100) NOT NULL,
     description TEXT,
-    created_by INT NOT NULL REFERENCES users(id),
+    created_by INT REFERENCES users(id) ON DELETE SET NULL,
     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
 
@@ -29,7 +42,7 @@ CREATE TABLE IF NOT EXISTS groups (
 CREATE TABLE IF NOT EXISTS group_members (
     group_id UUID NOT NULL REFERENCES groups(id) ON DELETE CASCADE,
     user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-    role TEXT NOT NULL DEFAULT 'member', -- owner/member
+    role VARCHAR(20) NOT NULL DEFAULT 'member', -- admin / member
     joined_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     PRIMARY KEY (group_id, user_id)
 );
@@ -39,22 +52,24 @@ CREATE TABLE IF NOT EXISTS group_messages (
     id BIGSERIAL PRIMARY KEY,
     group_id UUID NOT NULL REFERENCES groups(id) ON DELETE CASCADE,
     user_id INT REFERENCES users(id) ON DELETE SET NULL,
-    sender_display TEXT NOT NULL, -- 显示名字（包括 AI / system）
-    role TEXT NOT NULL DEFAULT 'user', -- user / assistant / system
-    content TEXT NOT NULL,
+    sender_display VARCHAR(50), -- 显示名字（包括 AI / system）
+    role VARCHAR(20) NOT NULL DEFAULT 'user', -- user / assistant / system
+    content TEXT,
     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
 );
 
--- 好友请求：用来支持 "pending" 流程
-CREATE TABLE IF NOT EXISTS friend_requests (
-    id SERIAL PRIMARY KEY,
-    from_user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-    to_user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-    status TEXT NOT NULL DEFAULT 'pending',  -- pending / accepted / declined
-    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-    responded_at TIMESTAMPTZ
-);
-
--- 可选索引：加快查询当前用户的待处理请求
+-- 加快查询当前用户的待处理请求
 CREATE INDEX IF NOT EXISTS idx_friend_requests_to_user
     ON friend_requests(to_user_id, status);
+
+-- 旧版 init_tables() 建出来的库：补齐列并把类型对齐到上面的定义
+-- (全新的库上这些语句都是 no-op)
+ALTER TABLE friend_requests ADD COLUMN IF NOT EXISTS responded_at TIMESTAMPTZ;
+ALTER TABLE users ALTER COLUMN created_at TYPE TIMESTAMPTZ;
+ALTER TABLE friend_requests ALTER COLUMN created_at TYPE TIMESTAMPTZ;
+ALTER TABLE friendships ALTER COLUMN created_at TYPE TIMESTAMPTZ;
+ALTER TABLE groups ALTER COLUMN created_at TYPE TIMESTAMPTZ;
+ALTER TABLE group_members ALTER COLUMN joined_at TYPE TIMESTAMPTZ;
+ALTER TABLE group_messages ALTER COLUMN created_at TYPE TIMESTAMPTZ;
+ALTER TABLE group_messages ALTER COLUMN id TYPE BIGINT;
+ALTER SEQUENCE IF EXISTS group_messages_id_seq AS BIGINT;
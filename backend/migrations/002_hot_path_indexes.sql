@@ -0,0 +1,15 @@
+-- 002: 热点查询的复合索引
+
+-- 群聊历史：WHERE group_id = ? ORDER BY created_at / id
+CREATE INDEX IF NOT EXISTS idx_group_messages_group_created
+    ON group_messages(group_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_group_messages_group_id
+    ON group_messages(group_id, id);
+
+-- 我加入的群：WHERE user_id = ? (主键是 group_id 开头，用不上)
+CREATE INDEX IF NOT EXISTS idx_group_members_user
+    ON group_members(user_id, group_id);
+
+-- 反向好友关系：WHERE friend_id = ?
+CREATE INDEX IF NOT EXISTS idx_friendships_friend
+    ON friendships(friend_id, user_id);
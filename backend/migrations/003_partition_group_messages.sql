@@ -0,0 +1,65 @@
+-- 003: group_messages 按月分区 (RANGE created_at)
+-- 旧表改名后把数据搬进分区表，id 继续沿用原来的 sequence
+
+DROP INDEX IF EXISTS idx_group_messages_group_created;
+DROP INDEX IF EXISTS idx_group_messages_group_id;
+ALTER TABLE group_messages RENAME TO group_messages_unpartitioned;
+ALTER INDEX group_messages_pkey RENAME TO group_messages_unpartitioned_pkey;
+ALTER SEQUENCE group_messages_id_seq OWNED BY NONE;
+
+-- 分区表的主键必须包含分区键
+CREATE TABLE group_messages (
+    id BIGINT NOT NULL DEFAULT nextval('group_messages_id_seq'),
+    group_id UUID NOT NULL REFERENCES groups(id) ON DELETE CASCADE,
+    user_id INT REFERENCES users(id) ON DELETE SET NULL,
+    sender_display VARCHAR(50),
+    role VARCHAR(20) NOT NULL DEFAULT 'user',
+    content TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE group_messages_id_seq OWNED BY group_messages.id;
+
+-- 创建 from_month 到 (本月 + months_ahead) 之间缺少的月分区，返回新建的个数。
+-- 分区命名：group_messages_YYYY_MM
+CREATE OR REPLACE FUNCTION ensure_group_message_partitions(from_month DATE, months_ahead INT)
+RETURNS INT AS $$
+DECLARE
+    m DATE := date_trunc('month', from_month)::date;
+    last_month DATE := (date_trunc('month', NOW()) + make_interval(months => months_ahead))::date;
+    part TEXT;
+    created INT := 0;
+BEGIN
+    WHILE m <= last_month LOOP
+        part := format('group_messages_%s', to_char(m, 'YYYY_MM'));
+        IF to_regclass(part) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF group_messages FOR VALUES FROM (%L) TO (%L)',
+                part, m, (m + INTERVAL '1 month')::date
+            );
+            created := created + 1;
+        END IF;
+        m := (m + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_group_message_partitions(
+    COALESCE((SELECT min(created_at) FROM group_messages_unpartitioned)::date, CURRENT_DATE),
+    3
+);
+
+INSERT INTO group_messages (id, group_id, user_id, sender_display, role, content, created_at)
+SELECT id, group_id, user_id, sender_display, COALESCE(role, 'user'), content, COALESCE(created_at, NOW())
+FROM group_messages_unpartitioned
+WHERE group_id IS NOT NULL;
+
+DROP TABLE group_messages_unpartitioned;
+
+-- 建在父表上，会自动建到每个分区
+CREATE INDEX IF NOT EXISTS idx_group_messages_group_created
+    ON group_messages(group_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_group_messages_group_id
+    ON group_messages(group_id, id);
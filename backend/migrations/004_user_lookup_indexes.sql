@@ -0,0 +1,40 @@
+-- 004: 忽略大小写的用户查找 + 前缀搜索
+-- LOWER(...) 的唯一索引：signup 直接靠约束判断重名，add_friend 的等值查找也能走索引。
+-- text_pattern_ops 同时支持 = 和 LIKE 'abc%' 前缀匹配 (给 /social/users/search 用)。
+-- 以前登录按原样比较用户名，已有数据里可能有只差大小写的重复：这时不建唯一索引 (否则整个迁移失败)，
+-- 改建同样列的普通索引保证查询性能，并在日志里列出冲突的行；
+-- 处理完重复之后手动执行 CREATE UNIQUE INDEX CONCURRENTLY users_username_lower_key ... 即可。
+DO $$
+DECLARE
+    dup_names TEXT;
+    dup_codes TEXT;
+BEGIN
+    SELECT string_agg(format('%s (ids %s)', k, ids), '; ') INTO dup_names
+    FROM (
+        SELECT LOWER(username) AS k, string_agg(id::text, ',' ORDER BY id) AS ids
+        FROM users GROUP BY LOWER(username) HAVING COUNT(*) > 1
+    ) d;
+    SELECT string_agg(format('%s (ids %s)', k, ids), '; ') INTO dup_codes
+    FROM (
+        SELECT LOWER(user_code) AS k, string_agg(id::text, ',' ORDER BY id) AS ids
+        FROM users GROUP BY LOWER(user_code) HAVING COUNT(*) > 1
+    ) d;
+
+    IF dup_names IS NULL THEN
+        CREATE UNIQUE INDEX IF NOT EXISTS users_username_lower_key
+            ON users (LOWER(username) text_pattern_ops);
+    ELSE
+        RAISE WARNING 'users.username has case-insensitive duplicates, building a non-unique index instead: %', dup_names;
+        CREATE INDEX IF NOT EXISTS users_username_lower_idx
+            ON users (LOWER(username) text_pattern_ops);
+    END IF;
+
+    IF dup_codes IS NULL THEN
+        CREATE UNIQUE INDEX IF NOT EXISTS users_user_code_lower_key
+            ON users (LOWER(user_code) text_pattern_ops);
+    ELSE
+        RAISE WARNING 'users.user_code has case-insensitive duplicates, building a non-unique index instead: %', dup_codes;
+        CREATE INDEX IF NOT EXISTS users_user_code_lower_idx
+            ON users (LOWER(user_code) text_pattern_ops);
+    END IF;
+END $$;
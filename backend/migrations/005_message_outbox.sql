@@ -0,0 +1,42 @@
+-- 005: 消息 outbox + NOTIFY
+-- 任何写入 group_messages 的地方 (WebSocket、REST、planner、ai_chat、手工 SQL) 都会在同一个事务里
+-- 写一条 outbox 记录，并在提交时发出 NOTIFY message_outbox。
+-- 每个 API 进程有一个 LISTEN 任务，按 outbox 把消息转发给本进程里的 WebSocket / SSE 房间。
+CREATE TABLE IF NOT EXISTS message_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    message_id BIGINT NOT NULL,
+    group_id UUID NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- 补发和清理过期 outbox 都按时间范围查
+CREATE INDEX IF NOT EXISTS idx_message_outbox_created ON message_outbox (created_at);
+
+-- 语句级触发器 + transition table：一条多行 INSERT (message_writer 的批量写) 只触发一次。
+-- NOTIFY 的 payload 是 "group_id:message_id" 列表，每条最多 100 项 (payload 上限 8000 字节)；
+-- 监听方据此跳过本进程没有人在线的群。NOTIFY 在事务提交后才投递，回滚的写入不会被推送。
+-- outbox 是持久的那一份：监听连接断开期间错过的 NOTIFY，重连后按 created_at 从 outbox 补发。
+CREATE OR REPLACE FUNCTION group_messages_outbox_notify() RETURNS trigger AS $$
+DECLARE
+    chunk TEXT;
+BEGIN
+    INSERT INTO message_outbox (message_id, group_id)
+    SELECT id, group_id FROM new_messages;
+
+    FOR chunk IN
+        SELECT string_agg(group_id::text || ':' || id::text, ',' ORDER BY id)
+        FROM (SELECT id, group_id, (row_number() OVER (ORDER BY id) - 1) / 100 AS part FROM new_messages) numbered
+        GROUP BY part
+        ORDER BY part
+    LOOP
+        PERFORM pg_notify('message_outbox', chunk);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS group_messages_outbox ON group_messages;
+CREATE TRIGGER group_messages_outbox
+    AFTER INSERT ON group_messages
+    REFERENCING NEW TABLE AS new_messages
+    FOR EACH STATEMENT EXECUTE FUNCTION group_messages_outbox_notify();
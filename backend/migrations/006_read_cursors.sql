@@ -0,0 +1,56 @@
+-- 006: 每个成员的已读游标 + 未读计数
+-- unread_count 在插入消息时由触发器增量维护，群列表直接读这一列，不用 COUNT(*)。
+ALTER TABLE group_members ADD COLUMN IF NOT EXISTS last_read_message_id BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE group_members ADD COLUMN IF NOT EXISTS unread_count INT NOT NULL DEFAULT 0;
+
+-- 已有成员：历史消息一律算已读，从现在开始计数
+UPDATE group_members gm
+SET last_read_message_id = latest.max_id, unread_count = 0
+FROM (SELECT group_id, MAX(id) AS max_id FROM group_messages GROUP BY group_id) latest
+WHERE latest.group_id = gm.group_id;
+
+-- 新成员 (建群、邀请、加入)：游标从群里当前最新的消息开始，之前的历史不算未读
+CREATE OR REPLACE FUNCTION group_members_init_read_cursor() RETURNS trigger AS $$
+BEGIN
+    SELECT COALESCE(MAX(id), 0) INTO NEW.last_read_message_id
+    FROM group_messages WHERE group_id = NEW.group_id;
+    NEW.unread_count := 0;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS group_members_init_read_cursor ON group_members;
+CREATE TRIGGER group_members_init_read_cursor
+    BEFORE INSERT ON group_members
+    FOR EACH ROW EXECUTE FUNCTION group_members_init_read_cursor();
+
+-- 语句级触发器：一批消息 (message_writer 的多行 INSERT) 每个群只更新一次成员行。
+-- 自己发的消息不算自己的未读。先按主键顺序锁行，并发的批次不会互相死锁。
+CREATE OR REPLACE FUNCTION group_messages_bump_unread() RETURNS trigger AS $$
+BEGIN
+    PERFORM 1 FROM group_members
+    WHERE group_id IN (SELECT DISTINCT group_id FROM new_messages)
+    ORDER BY group_id, user_id
+    FOR UPDATE;
+
+    WITH per_group AS (
+        SELECT group_id, COUNT(*) AS n FROM new_messages GROUP BY group_id
+    ),
+    own AS (
+        SELECT group_id, user_id, COUNT(*) AS n FROM new_messages
+        WHERE user_id IS NOT NULL GROUP BY group_id, user_id
+    )
+    UPDATE group_members gm
+    SET unread_count = gm.unread_count + pg.n - COALESCE(
+        (SELECT o.n FROM own o WHERE o.group_id = gm.group_id AND o.user_id = gm.user_id), 0)
+    FROM per_group pg
+    WHERE gm.group_id = pg.group_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS group_messages_bump_unread ON group_messages;
+CREATE TRIGGER group_messages_bump_unread
+    AFTER INSERT ON group_messages
+    REFERENCING NEW TABLE AS new_messages
+    FOR EACH STATEMENT EXECUTE FUNCTION group_messages_bump_unread();
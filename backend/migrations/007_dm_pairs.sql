@@ -0,0 +1,33 @@
+-- 007: 私聊显式建模
+-- groups.kind 区分普通群和私聊；dm_pairs 以 (较小 user_id, 较大 user_id) 为主键，
+-- 查找 / 创建私聊只查一行，不再依赖群名前缀，也不会因为并发点击建出两个私聊群。
+ALTER TABLE groups ADD COLUMN IF NOT EXISTS kind VARCHAR(10) NOT NULL DEFAULT 'group';
+ALTER TABLE groups DROP CONSTRAINT IF EXISTS groups_kind_check;
+ALTER TABLE groups ADD CONSTRAINT groups_kind_check CHECK (kind IN ('group', 'dm'));
+
+CREATE TABLE IF NOT EXISTS dm_pairs (
+    low_user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    high_user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    -- 可延迟：创建私聊时先抢占这一行 (用预先生成的 uuid)，再在同一条语句里建群
+    group_id UUID NOT NULL UNIQUE REFERENCES groups(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (low_user_id, high_user_id),
+    CHECK (low_user_id < high_user_id)
+);
+
+-- 回填：旧的私聊群都是 'DM:' 开头
+UPDATE groups SET kind = 'dm' WHERE name LIKE 'DM:%' AND kind <> 'dm';
+
+-- 每一对用户只登记最早的那个私聊群；并发建出来的重复群仍标记为 dm (不会出现在群列表)，但不再被复用
+INSERT INTO dm_pairs (low_user_id, high_user_id, group_id, created_at)
+SELECT DISTINCT ON (p.lo, p.hi) p.lo, p.hi, p.group_id, p.created_at
+FROM (
+    SELECT g.id AS group_id, g.created_at, MIN(gm.user_id) AS lo, MAX(gm.user_id) AS hi
+    FROM groups g
+    JOIN group_members gm ON gm.group_id = g.id
+    WHERE g.kind = 'dm'
+    GROUP BY g.id, g.created_at
+    HAVING COUNT(*) = 2
+) p
+ORDER BY p.lo, p.hi, p.created_at
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,37 @@
+-- 008: 持久化的 AI 任务队列
+-- 路由 / 去抖调度只负责入队，worker 用 FOR UPDATE SKIP LOCKED 取任务；进程重启后排队中的任务不会丢。
+CREATE TABLE IF NOT EXISTS ai_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    kind VARCHAR(30) NOT NULL DEFAULT 'planner',
+    group_id UUID NOT NULL REFERENCES groups(id) ON DELETE CASCADE,
+    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+    -- 数字越小越先执行：0 = 明确 @hikebot 的请求，1 = 被动监听
+    priority SMALLINT NOT NULL DEFAULT 1,
+    -- queued / running / done / failed / expired / superseded
+    status VARCHAR(12) NOT NULL DEFAULT 'queued',
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 3,
+    run_after TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    deadline TIMESTAMPTZ,
+    last_error TEXT,
+    locked_by TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ
+);
+
+-- 取任务：只扫排队中的行，按优先级 / 可执行时间排序
+CREATE INDEX IF NOT EXISTS idx_ai_jobs_dequeue
+    ON ai_jobs (priority, run_after, id) WHERE status = 'queued';
+
+-- 每个群每种任务最多一个在排队：新任务直接合并进去 (supersede)
+CREATE UNIQUE INDEX IF NOT EXISTS uq_ai_jobs_queued_group
+    ON ai_jobs (group_id, kind) WHERE status = 'queued';
+
+-- 每个群同时只跑一个任务；回收超时任务也走这个索引
+CREATE INDEX IF NOT EXISTS idx_ai_jobs_running
+    ON ai_jobs (group_id) WHERE status = 'running';
+
+-- 清理已结束的任务
+CREATE INDEX IF NOT EXISTS idx_ai_jobs_finished_at
+    ON ai_jobs (finished_at) WHERE finished_at IS NOT NULL;
@@ -0,0 +1,4 @@
+-- 009: 之前的重试 / 回收语句只在次数用完时写 finished_at，superseded 的行永远不会被 prune 清理
+UPDATE ai_jobs
+SET finished_at = COALESCE(started_at, created_at)
+WHERE finished_at IS NULL AND status IN ('done', 'failed', 'expired', 'superseded');
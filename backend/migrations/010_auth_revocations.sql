@@ -0,0 +1,33 @@
+-- 010: 会话吊销
+-- 用户被删除、换了 user_code / username 或改了密码时，在这之前签发的 token 一律作废，
+-- 旧 header 认证缓存里的条目也会被清掉。记录由触发器写入，不管改动来自路由还是手工 SQL。
+-- 不加外键：用户删掉之后这条记录仍然要在，直到最长的 token 也过期。
+CREATE TABLE IF NOT EXISTS auth_revocations (
+    user_id INT PRIMARY KEY,
+    revoked_before TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- 各进程定期增量拉取 revoked_before 之后的新记录
+CREATE INDEX IF NOT EXISTS idx_auth_revocations_revoked_before ON auth_revocations (revoked_before);
+
+CREATE OR REPLACE FUNCTION users_revoke_sessions() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO auth_revocations (user_id, revoked_before) VALUES (OLD.id, NOW())
+    ON CONFLICT (user_id) DO UPDATE SET revoked_before = GREATEST(auth_revocations.revoked_before, EXCLUDED.revoked_before);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_revoke_sessions_on_delete ON users;
+CREATE TRIGGER users_revoke_sessions_on_delete
+    AFTER DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION users_revoke_sessions();
+
+DROP TRIGGER IF EXISTS users_revoke_sessions_on_update ON users;
+CREATE TRIGGER users_revoke_sessions_on_update
+    AFTER UPDATE OF username, user_code, password_hash ON users
+    FOR EACH ROW
+    WHEN (OLD.username IS DISTINCT FROM NEW.username
+          OR OLD.user_code IS DISTINCT FROM NEW.user_code
+          OR OLD.password_hash IS DISTINCT FROM NEW.password_hash)
+    EXECUTE FUNCTION users_revoke_sessions();
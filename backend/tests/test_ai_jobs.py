@@ -0,0 +1,31 @@
+"""Stopping the worker hands its interrupted jobs straight back to the queue."""
+
+import asyncio
+
+from app.services import ai_jobs
+
+
+def test_stop_requeues_interrupted_jobs_without_spending_an_attempt(monkeypatch):
+    requeued = []
+
+    async def own_running(sql, params):
+        assert sql == ai_jobs._OWN_RUNNING_SQL and params["worker"] == "w1"
+        return [{"id": 5}]
+
+    async def requeue(sql, params):
+        requeued.append(params)
+        return {"status": "queued"}
+
+    monkeypatch.setattr(ai_jobs, "afetch_all", own_running)
+    monkeypatch.setattr(ai_jobs, "afetch_one", requeue)
+
+    async def scenario():
+        worker = ai_jobs.AIJobWorker(concurrency=1)
+        worker.worker_id = "w1"
+        # 模拟一个正在执行任务的槽位
+        worker._tasks = [asyncio.create_task(asyncio.sleep(3600))]
+        await asyncio.sleep(0)
+        await worker.stop()
+
+    asyncio.run(scenario())
+    assert [(p["id"], p["refund"], p["backoff"]) for p in requeued] == [(5, 1, 0)]
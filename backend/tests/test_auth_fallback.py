@@ -0,0 +1,40 @@
+"""A stale bearer token falls back to the legacy X-Username / X-User-Code credentials when both are sent."""
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.models.sql_models import AuthUser
+from app.routers import auth
+
+USER = AuthUser(id=42, username="hiker", user_code="4242")
+
+
+@pytest.fixture(autouse=True)
+def fake_lookup(monkeypatch):
+    async def lookup(username, user_code):
+        return USER if (username, user_code) == (USER.username, USER.user_code) else None
+
+    monkeypatch.setattr(auth, "lookup_user", lookup)
+
+
+def test_stale_token_with_legacy_headers_falls_back():
+    user = asyncio.run(auth.get_current_user("Bearer stale.token", USER.username, USER.user_code))
+    assert user == USER
+
+
+def test_stale_token_alone_is_rejected():
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(auth.get_current_user("Bearer stale.token", None, None))
+    assert e.value.status_code == 401
+
+
+def test_stale_token_with_wrong_legacy_headers_is_rejected():
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(auth.get_current_user("Bearer stale.token", USER.username, "0000"))
+    assert e.value.status_code == 401
+
+
+def test_query_auth_falls_back_too():
+    assert asyncio.run(auth.user_from_query(USER.username, USER.user_code, "stale.token")) == USER
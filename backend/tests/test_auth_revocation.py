@@ -0,0 +1,37 @@
+"""Revoking a user must reject older session tokens and evict the legacy header cache."""
+
+import asyncio
+import time
+
+from app.core.security import issue_session_token, legacy_auth_cache, verify_session_token
+from app.models.sql_models import AuthUser
+from app.services import auth_revocation
+
+
+def _revoke_via_control(user_id: int, before: float) -> None:
+    asyncio.run(auth_revocation._on_control({"type": "auth.revoked", "user_id": user_id, "before": before}))
+
+
+def test_revocation_rejects_older_tokens_and_evicts_legacy_cache():
+    user = AuthUser(id=9001, username="revoked", user_code="9001")
+    token, _ = issue_session_token(user)
+    legacy_auth_cache.set((user.username, user.user_code), user)
+
+    _revoke_via_control(user.id, time.time())
+
+    assert verify_session_token(token) is None
+    assert legacy_auth_cache.get((user.username, user.user_code)) == (False, None)
+
+
+def test_tokens_issued_after_revocation_still_work():
+    user = AuthUser(id=9002, username="relogin", user_code="9002")
+    _revoke_via_control(user.id, time.time() - 1)
+    token, _ = issue_session_token(user)
+    assert verify_session_token(token) == user
+
+
+def test_other_users_are_unaffected():
+    user = AuthUser(id=9003, username="bystander", user_code="9003")
+    token, _ = issue_session_token(user)
+    _revoke_via_control(9004, time.time())
+    assert verify_session_token(token) == user
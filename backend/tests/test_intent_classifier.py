@@ -0,0 +1,18 @@
+"""The pre-classifier scores a coalesced discussion message by message."""
+
+from app.services.intent_classifier import IntentClassifier
+from app.services.planner import MOCK_TRAILS_DB
+
+clf = IntentClassifier.load(catalog=[t["name"] for t in MOCK_TRAILS_DB])
+
+
+def test_off_topic_message_does_not_veto_the_discussion():
+    proposal = "anyone up for Rattlesnake Ledge saturday?"
+    window = "\n".join(["ugh my coffee spilled", proposal, "gotta finish homework first lol", "I went there last year"])
+    assert clf.score_window(window) == clf.score(proposal)
+    assert clf.should_call_llm(window)
+
+
+def test_short_proposal_passes_and_chatter_does_not():
+    assert clf.should_call_llm("lets hike")
+    assert not clf.should_call_llm("the business plan meeting got moved\nmy data plan ran out")
@@ -0,0 +1,58 @@
+"""The read cursor can never move past the group's newest message (needs a migrated Postgres)."""
+
+import uuid
+
+import pytest
+
+from app.core.queries import MARK_READ_SQL
+
+
+def _db_available() -> bool:
+    try:
+        from app.core.database import fetch_one
+        return fetch_one("SELECT 1 AS ok") is not None
+    except Exception:
+        return False
+
+
+pytestmark = pytest.mark.skipif(not _db_available(), reason="PostgreSQL not reachable")
+
+
+class _Rollback(Exception):
+    pass
+
+
+def test_mark_read_clamps_to_latest_message_in_group():
+    from app.core.database import get_cursor
+
+    suffix = uuid.uuid4().hex[:8]
+    with pytest.raises(_Rollback):
+        with get_cursor() as cur:
+            ids = []
+            for name in ("reader", "writer"):
+                cur.execute(
+                    "INSERT INTO users (username, user_code, password_hash) VALUES (%s, %s, 'x') RETURNING id",
+                    (f"{name}_{suffix}", f"{name[0]}{suffix}"),
+                )
+                ids.append(cur.fetchone()[0])
+            me, other = ids
+            cur.execute("INSERT INTO groups (name) VALUES ('mark read') RETURNING id")
+            gid = str(cur.fetchone()[0])
+            cur.execute(
+                "INSERT INTO group_members (group_id, user_id) VALUES (%s, %s), (%s, %s)", (gid, me, gid, other)
+            )
+            cur.execute(
+                "INSERT INTO group_messages (group_id, user_id, content) VALUES (%s, %s, 'a'), (%s, %s, 'b') RETURNING id",
+                (gid, other, gid, other),
+            )
+            latest = max(r[0] for r in cur.fetchall())
+
+            # 一个远超最新消息的 id：游标只推进到最新一条
+            cur.execute(MARK_READ_SQL, {"gid": gid, "me": me, "mid": latest + 1_000_000})
+            assert cur.fetchone()[0] == latest
+
+            # 之后的新消息仍然算未读
+            cur.execute("INSERT INTO group_messages (group_id, user_id, content) VALUES (%s, %s, 'c')", (gid, other))
+            cur.execute("SELECT unread_count FROM group_members WHERE group_id = %s AND user_id = %s", (gid, me))
+            assert cur.fetchone()[0] == 1
+            raise _Rollback()
@@ -0,0 +1,40 @@
+"""The outbox relay tells online members about new messages so unread badges update live."""
+
+import asyncio
+import json
+
+from app.core.broadcast import MemoryBroadcast
+from app.services import message_outbox
+from app.services.realtime import GroupConnectionManager
+
+
+def test_notify_reaches_online_members_of_groups_nobody_has_open(monkeypatch):
+    async def members(_sql, params):
+        assert set(params["gids"]) == {"g1", "g2"} and params["uids"] == [7]
+        return [{"group_id": "g1", "user_id": 7}]
+
+    monkeypatch.setattr(message_outbox, "afetch_all", members)
+
+    async def scenario():
+        received = []
+
+        async def send(data):
+            received.append(json.loads(data))
+
+        async def close(_code):
+            return None
+
+        manager = GroupConnectionManager(MemoryBroadcast())
+        conn = await manager.attach_user(7, send, close)
+        relay = message_outbox.OutboxRelay(manager)
+        # 本进程没有人打开 g1 / g2，消息本身不用查，但成员仍然要收到 group.activity
+        relay._on_notify(None, 0, message_outbox.MESSAGE_OUTBOX_CHANNEL, "g1:10,g2:11")
+        assert relay._pending == {}
+        await relay._notify_activity(relay._activity)
+        await asyncio.sleep(0)
+        await manager.disconnect(conn)
+        return received, relay.activity_events
+
+    received, count = asyncio.run(scenario())
+    assert count == 1
+    assert [(e["type"], e["group_id"]) for e in received] == [("group.activity", "g1")]
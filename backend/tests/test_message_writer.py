@@ -0,0 +1,57 @@
+"""One bad row must not fail the other messages in the same group-commit batch."""
+
+import asyncio
+
+import asyncpg
+
+from app.services import message_writer as mw
+
+
+def test_bad_row_only_fails_its_own_submit(monkeypatch):
+    next_id = iter(range(1, 100))
+
+    async def fake_insert(_sql, params):
+        if any("\x00" in c for c in params["contents"]):
+            raise asyncpg.CharacterNotInRepertoireError("invalid byte sequence for encoding \"UTF8\": 0x00")
+        return [
+            {"id": next(next_id), "group_id": g, "sender": s, "role": r, "content": c, "created_at": None}
+            for g, s, r, c in zip(params["gids"], params["senders"], params["roles"], params["contents"])
+        ]
+
+    monkeypatch.setattr(mw, "afetch_all", fake_insert)
+
+    async def scenario():
+        writer = mw.MessageWriter(flush_interval_ms=20)
+        await writer.start()
+        contents = ["hi", "bad\x00row", "trail at 9?", "ok"]
+        results = await asyncio.gather(
+            *(writer.submit(f"g{i}", i, "u", "user", c) for i, c in enumerate(contents)),
+            return_exceptions=True,
+        )
+        await writer.stop()
+        return writer, results
+
+    writer, results = asyncio.run(scenario())
+    assert isinstance(results[1], ValueError)
+    assert [r["content"] for i, r in enumerate(results) if i != 1] == ["hi", "trail at 9?", "ok"]
+    assert writer.rejected == 1 and writer.failed == 0
+
+
+def test_connection_errors_still_fail_the_whole_batch(monkeypatch):
+    async def down(_sql, _params):
+        raise ConnectionError("database is down")
+
+    monkeypatch.setattr(mw, "afetch_all", down)
+
+    async def scenario():
+        writer = mw.MessageWriter(flush_interval_ms=20)
+        await writer.start()
+        results = await asyncio.gather(
+            *(writer.submit("g", i, "u", "user", "hi") for i in range(3)), return_exceptions=True
+        )
+        await writer.stop()
+        return writer, results
+
+    writer, results = asyncio.run(scenario())
+    assert all(isinstance(r, ConnectionError) for r in results)
+    assert writer.failed == 3 and writer.splits == 0
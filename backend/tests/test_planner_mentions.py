@@ -0,0 +1,56 @@
+"""An explicit @hikebot mention must always reach the LLM, whatever the intent pre-classifier says."""
+
+import asyncio
+
+import pytest
+
+from app.services import ai_jobs, planner
+from app.services.planner import AutoPlannerService, ExtractionSchema
+
+MENTION = "@hikebot plan a trip to Mount Si"
+
+
+def _job(priority, payload):
+    return {"group_id": "g", "priority": priority, "payload": payload, "attempts": 1, "max_attempts": 3}
+
+
+@pytest.fixture
+def extract_calls(monkeypatch):
+    calls = []
+
+    async def fake_extract(self, message):
+        calls.append(message)
+        return ExtractionSchema(is_planning_trip=False)
+
+    monkeypatch.setattr(AutoPlannerService, "_extract_intent", fake_extract)
+    # 预筛把所有消息都判成不值得调用 LLM
+    monkeypatch.setattr(planner.intent_classifier, "threshold", 1.01)
+    return calls
+
+
+def test_classifier_still_gates_passive_messages(extract_calls):
+    asyncio.run(AutoPlannerService(db=None).run_pipeline("g", "plan a trip to Mount Si"))
+    assert extract_calls == []
+
+
+def test_mention_job_reaches_extract_intent(extract_calls):
+    job = _job(ai_jobs.PRIORITY_MENTION, {"text": MENTION, "mention": True})
+    asyncio.run(ai_jobs.run_planner(job))
+    assert extract_calls == [MENTION]
+
+
+def test_merged_mention_flag_survives_passive_priority(extract_calls):
+    # 被动任务合并进了一条 mention：payload 里的标记足以绕过预筛
+    job = _job(ai_jobs.PRIORITY_PASSIVE, {"text": MENTION, "mention": True})
+    asyncio.run(ai_jobs.run_planner(job))
+    assert extract_calls == [MENTION]
+
+
+def test_llm_failure_propagates_so_the_job_is_retried(monkeypatch):
+    async def broken_chat(**_kwargs):
+        raise ConnectionError("LLM unavailable")
+
+    monkeypatch.setattr(planner.llm_client, "chat", broken_chat)
+    # 以前这里被吞掉，当成 "不是在规划"，任务直接记成 done
+    with pytest.raises(ConnectionError):
+        asyncio.run(ai_jobs.run_planner(_job(ai_jobs.PRIORITY_MENTION, {"text": MENTION, "mention": True})))
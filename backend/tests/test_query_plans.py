@@ -0,0 +1,27 @@
+"""Every hot-path query in app/core/queries.py must be index-backed (needs a migrated Postgres)."""
+
+import pytest
+
+from app.core.queries import HOT_QUERIES
+
+
+def _db_available() -> bool:
+    try:
+        from app.core.database import fetch_one
+        return fetch_one("SELECT 1 AS ok") is not None
+    except Exception:
+        return False
+
+
+pytestmark = pytest.mark.skipif(not _db_available(), reason="PostgreSQL not reachable")
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_hot_query_uses_an_index(name):
+    from app.core.database import get_cursor
+    from app.script.check_query_plans import explain_seq_scans
+
+    query, params = HOT_QUERIES[name]
+    with get_cursor() as cur:
+        cur.execute("SET LOCAL enable_seqscan = off")
+        assert explain_seq_scans(cur, query, params) == []
@@ -0,0 +1,59 @@
+"""Slow-consumer coalescing and the in-memory replay buffer."""
+
+import asyncio
+import json
+
+from app.core.broadcast import MemoryBroadcast
+from app.services.realtime import Connection, GroupConnectionManager, ReplayBuffer
+
+
+async def _noop(*_args) -> None:
+    return None
+
+
+def _frame(i: int) -> str:
+    return json.dumps({"type": "message", "id": i})
+
+
+def test_coalesce_merges_backlog_into_one_batch_envelope():
+    manager = GroupConnectionManager(MemoryBroadcast(), queue_size=3, policy="coalesce")
+    conn = Connection(manager, "hikebot:group:1", 1, _noop, _noop)
+    for i in range(1, 8):
+        conn.enqueue(_frame(i), 0.0)
+
+    frames = [json.loads(data) for data, _ in conn._queue]
+    batches = [f for f in frames if f["type"] == "batch"]
+    assert len(batches) == 1
+    # 合并过的 batch 再次被合并时会展开，不会出现嵌套
+    assert all(m["type"] == "message" for m in batches[0]["messages"])
+    ids = [m["id"] for m in batches[0]["messages"]] + [f["id"] for f in frames if f["type"] == "message"]
+    assert ids == list(range(1, 8))
+
+
+def test_only_user_rooms_subscribe_to_the_broadcast_backend():
+    async def scenario():
+        backend = MemoryBroadcast()
+        manager = GroupConnectionManager(backend)
+        group_conn = await manager.attach("g1", 1, _noop, _noop)
+        user_conn = await manager.attach_user(1, _noop, _noop)
+        subscribed = set(backend.channels)
+        await manager.disconnect(group_conn)
+        await manager.disconnect(user_conn)
+        return subscribed, set(backend.channels)
+
+    subscribed, after = asyncio.run(scenario())
+    # 群消息由 outbox relay 投递，群房间不占用 pub/sub 订阅
+    assert subscribed == {"hikebot:user:1"}
+    assert after == set()
+
+
+def test_replay_buffer_boundary():
+    buf = ReplayBuffer(4)
+    for i in range(10, 14):
+        buf.append(i, _frame(i))
+    assert buf.since(9) == [_frame(i) for i in range(10, 14)]
+    assert buf.since(10) == [_frame(i) for i in range(11, 14)]
+    assert buf.since(13) == []
+    # 比缓冲更早的缺口只能去数据库补
+    assert buf.since(8) is None
+    assert ReplayBuffer(4).since(0) is None
@@ -0,0 +1,59 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlencode
+import streamlit as st
+import streamlit.components.v1 as components
+
+from app.core.api import PUBLIC_BACKEND_URL
+
+_live_events = components.declare_component(
+    "live_events", path=str(Path(__file__).parent / "live_events_frontend")
+)
+
+def _auth_query() -> Dict[str, str]:
+    """EventSource 不能带 header：token 和旧的 username + user_code 一起放进 query，token 失效时后端退回旧凭据"""
+    query = {"username": str(st.session_state.get("user") or ""), "user_code": str(st.session_state.get("user_code") or "")}
+    token = st.session_state.get("auth_token")
+    if token:
+        query["token"] = token
+    return query
+
+def _listen(path: str, key: str, debounce_ms: int) -> Optional[Dict[str, Any]]:
+    url = f"{PUBLIC_BACKEND_URL}{path}?{urlencode(_auth_query())}"
+    return _live_events(url=url, debounce_ms=debounce_ms, key=key, default=None)
+
+def listen_group_events(group_id: str, debounce_ms: int = 250) -> Optional[Dict[str, Any]]:
+    """
+    在页面里挂一个隐形组件订阅 /social/groups/{id}/events。
+    浏览器收到推送时组件值变化 -> Streamlit rerun；没有事件时什么都不发生。
+    返回最近一批事件 {"seq": n, "events": [...]}，第一次渲染时为 None。
+    """
+    return _listen(f"/social/groups/{group_id}/events", f"live_events_{group_id}", debounce_ms)
+
+def listen_user_events(debounce_ms: int = 250) -> Optional[Dict[str, Any]]:
+    """订阅当前用户的通知流 /social/me/events (好友请求、入群邀请、被踢等)"""
+    return _listen("/social/me/events", "live_events_me", debounce_ms)
+
+def new_events(batch: Optional[Dict[str, Any]], key: str) -> List[Dict[str, Any]]:
+    """组件值在之后的 rerun 里会一直保留，用 seq 去重，只返回这次 rerun 之前没处理过的事件"""
+    if not batch:
+        return []
+    seen_key = f"_events_seen_{key}"
+    if st.session_state.get(seen_key) == batch.get("seq"):
+        return []
+    st.session_state[seen_key] = batch.get("seq")
+    return _unpack(batch.get("events", []))
+
+
+def _unpack(events: List[Any]) -> List[Dict[str, Any]]:
+    """慢连接上后端会把积压的帧合成 {"type": "batch"} / {"type": "replay"} 信封，这里展开成单个事件"""
+    out: List[Dict[str, Any]] = []
+    for e in events:
+        if not isinstance(e, dict):
+            continue
+        if e.get("type") in ("batch", "replay"):
+            out.extend(_unpack(e.get("messages") or []))
+        else:
+            out.append(e)
+    return out
@@ -1,21 +1,56 @@
 import streamlit as st
 from datetime import datetime as _dt
-from streamlit_autorefresh import st_autorefresh
 
-from app.core.api import (
-    fetch_groups, fetch_friends, fetch_friend_requests, 
-    get_or_create_dm
-)
+from app.core.api import fetch_bootstrap, get_or_create_dm
+from app.components.live_events import listen_user_events, new_events
+
+# 通知类型 -> 需要重新拉取的侧边栏数据
+_EVENT_REFRESH = {
+    "friend_request.received": {"requests"},
+    "friend_request.accepted": {"friends"},
+    "friend.removed": {"friends", "groups"},
+    "group.invited": {"groups"},
+    "group.kicked": {"groups"},
+    "group.read": {"groups"},
+    # 群里有新消息 (outbox relay 发出)：刷新未读角标和最后一条预览
+    "group.activity": {"groups"},
+}
 
 # ==========================================
 # 🧩 Helper Components (拆分的子组件模块)
 # ==========================================
 
+def _load_sidebar_data(stale: set) -> dict:
+    """
+    侧边栏数据缓存在 session_state，收到通知 (或自己的操作让某部分失效) 时
+    用一次 /social/bootstrap 请求整体刷新；带上上次的 etag，内容没变时后端只回 304。
+    """
+    data = st.session_state.setdefault("sidebar_data", {})
+    missing = any(k not in data for k in ("groups", "friends", "requests"))
+    if not stale and not missing:
+        return data
+
+    try:
+        fresh = fetch_bootstrap(None if missing else data.get("etag"))
+    except Exception:
+        fresh = None
+        for k in ("groups", "friends", "requests"):
+            data.setdefault(k, [])
+    if fresh:
+        for k in ("groups", "friends", "requests", "etag"):
+            data[k] = fresh.get(k) or ([] if k != "etag" else None)
+        profile = fresh.get("profile") or {}
+        if profile.get("user_code"):
+            st.session_state.user_code = profile["user_code"]
+    return data
+
+
 def _render_user_profile(username: str):
     """渲染顶部：刷新按钮、同步时间与个人名片"""
     col_refresh, col_status = st.sidebar.columns([1, 3])
     with col_refresh:
         if st.sidebar.button("🔄", help="Force Refresh Data"): 
+            st.session_state.pop("sidebar_data", None)
             st.rerun()
     with col_status: 
         st.sidebar.caption(f"Last sync: {_dt.now().strftime('%H:%M:%S')}")
@@ -47,20 +82,21 @@ def _render_group_list(all_groups: list, active_group_id: str):
         st.session_state.show_ai_planning = True
         st.rerun()
 
-    # 过滤出非私聊(DM)的正常群组
-    display_groups = [
-        g for g in all_groups 
-        if (isinstance(g, dict) and not (g.get("name") or "").upper().startswith("DM:")) 
-        or (isinstance(g, str) and not g.upper().startswith("DM:"))
-    ]
+    # 过滤出非私聊(DM)的正常群组 (按后端的 kind 字段，不再匹配群名前缀)
+    display_groups = [g for g in all_groups if isinstance(g, dict) and g.get("kind", "group") != "dm"]
     
     for g in display_groups:
         gid = g.get("id") if isinstance(g, dict) else g
         name = (g.get("name") or "Unnamed Group") if isinstance(g, dict) else g
         is_active = (str(gid) == str(active_group_id))
         
+        unread = g.get("unread_count", 0) if isinstance(g, dict) else 0
         btn_label = f"📍 {name}" if is_active else f"# {name}"
-        if st.sidebar.button(btn_label, key=f"side_grp_{gid}", use_container_width=True, type="primary" if is_active else "secondary"):
+        if unread and not is_active:
+            btn_label += f"  🔴 {unread if unread < 100 else '99+'}"
+        last = g.get("last_message") if isinstance(g, dict) else None
+        preview = f"{last.get('sender') or 'AI'}: {last.get('content') or ''}" if last else None
+        if st.sidebar.button(btn_label, key=f"side_grp_{gid}", use_container_width=True, type="primary" if is_active else "secondary", help=preview):
             st.session_state.active_group = gid
             st.session_state.show_ai_planning = False
             st.session_state.view_mode = "chat"
@@ -98,25 +134,21 @@ def _render_friend_list(friends: list):
 def render_social_sidebar(username: str):
     """侧边栏主入口：集中获取数据，然后分配给各个子组件渲染"""
     
-    # 每 10 秒自动同步数据，监听新的好友请求
-    st_autorefresh(interval=10000, key="sidebar_auto_sync")
+    # 不再定时轮询：订阅用户通知流，收到事件才 rerun，并且只刷新事件涉及的数据
+    events = new_events(listen_user_events(), "me")
+    stale = set()
+    for ev in events:
+        stale |= _EVENT_REFRESH.get(ev.get("type"), set())
+        if ev.get("type") == "group.kicked" and str(ev.get("group_id")) == str(st.session_state.get("active_group")):
+            st.session_state.active_group = None
+            st.toast("You were removed from this group")
+        elif ev.get("type") == "friend_request.received":
+            st.toast(f"🔔 New friend request from {ev.get('from_username')}")
     active_group_id = st.session_state.get("active_group")
 
-    # --- 1. 集中获取全局数据 (自带防报错处理) ---
-    try:
-        raw_groups = fetch_groups()
-        all_groups = raw_groups if isinstance(raw_groups, list) else []
-    except: all_groups = []
-
-    try:
-        raw_friends = fetch_friends()
-        friends = raw_friends.get("friends", []) if isinstance(raw_friends, dict) else (raw_friends if isinstance(raw_friends, list) else [])
-    except: friends = []
-
-    try:
-        pending_reqs = fetch_friend_requests()
-        if isinstance(pending_reqs, dict): pending_reqs = pending_reqs.get("requests", [])
-    except: pending_reqs = []
+    # --- 1. 集中获取全局数据 (自带防报错处理，只重新拉取过期部分) ---
+    data = _load_sidebar_data(stale)
+    all_groups, friends, pending_reqs = data["groups"], data["friends"], data["requests"]
 
 
     # --- 2. 像搭积木一样调用子组件 ---
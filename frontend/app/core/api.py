@@ -7,18 +7,49 @@ import streamlit as st
 
 # 获取后端 URL
 BACKEND_URL = os.getenv("BACKEND_URL", "http://api:8000")
+# 浏览器直接连后端 (SSE 推送) 用的地址，容器内的 api:8000 浏览器访问不到
+PUBLIC_BACKEND_URL = os.getenv("PUBLIC_BACKEND_URL", "http://localhost:8000")
 
 def _auth_headers() -> Dict[str, str]:
-    """获取鉴权请求头"""
+    """
+    获取鉴权请求头：有 session token 时带 Bearer (后端不用查库)；
+    迁移期间旧的 X-Username / X-User-Code 也一起发，token 失效 (后端重启换了密钥等) 时后端会退回旧认证
+    """
+    headers: Dict[str, str] = {}
+    token = st.session_state.get("auth_token")
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
     u = st.session_state.get("user")
     c = st.session_state.get("user_code")
-    return {"X-Username": str(u), "X-User-Code": str(c)} if u and c else {}
+    if u and c:
+        headers.update({"X-Username": str(u), "X-User-Code": str(c)})
+    return headers
+
+def _checked(r: requests.Response) -> requests.Response:
+    """任何请求返回 401 说明保存的凭据已经失效：标记一下，main 在下一次渲染时清掉 cookie 并回到登录页"""
+    if r.status_code == 401 and st.session_state.get("authenticated"):
+        st.session_state.auth_expired = True
+        st.rerun()
+    return r
+
+def _get(url: str, **kwargs: Any) -> requests.Response:
+    return _checked(requests.get(url, **kwargs))
+
+def _post(url: str, **kwargs: Any) -> requests.Response:
+    return _checked(requests.post(url, **kwargs))
+
+def _invalidate_sidebar(*parts: str) -> None:
+    """自己的操作不会收到通知，改完数据后直接让侧边栏缓存的对应部分失效"""
+    data = st.session_state.get("sidebar_data")
+    if data:
+        for p in parts:
+            data.pop(p, None)
 
 def auth_request(path: str, username: str, password: str, user_code: str | None = None) -> str:
     """处理登录与注册"""
     payload = {"username": username, "password": password}
     if path == "/auth/signup": payload["user_code"] = user_code or ""
-    r = requests.post(f"{BACKEND_URL}{path}", json=payload, timeout=15)
+    r = _post(f"{BACKEND_URL}{path}", json=payload, timeout=15)
     if r.status_code != 200: 
         raise RuntimeError(r.json().get("detail", "认证失败"))
     data = r.json()
@@ -26,51 +57,90 @@ def auth_request(path: str, username: str, password: str, user_code: str | None
     st.session_state.user = user_data.get("username")
     st.session_state.user_code = user_data.get("user_code")
     st.session_state.current_user_id = user_data.get("id")
+    st.session_state.auth_token = data.get("token")
     st.session_state.authenticated = True
     return data.get("message", "OK")
 
 # --- 社交功能 ---
 def fetch_friends():
-    r = requests.get(f"{BACKEND_URL}/social/friends", headers=_auth_headers())
+    r = _get(f"{BACKEND_URL}/social/friends", headers=_auth_headers())
     return r.json().get("friends", [])
 
 def fetch_friend_requests():
-    return requests.get(f"{BACKEND_URL}/social/friends/requests", headers=_auth_headers()).json().get("requests", [])
+    return _get(f"{BACKEND_URL}/social/friends/requests", headers=_auth_headers()).json().get("requests", [])
 
 def send_friend_request(fc: str):
     # 🔴 唯一的修复在这里：手动检查状态码并抛出错误，以便 friends.py 能抓取到 404
-    r = requests.post(f"{BACKEND_URL}/social/friends/add", json={"friend_code": fc}, headers=_auth_headers())
+    r = _post(f"{BACKEND_URL}/social/friends/add", json={"friend_code": fc}, headers=_auth_headers())
     if r.status_code != 200:
         raise RuntimeError(r.json().get("detail", f"Error {r.status_code}"))
     return r.json()
 
 def accept_friend_request(rid: int):
-    return requests.post(f"{BACKEND_URL}/social/friends/accept", json={"request_id": rid}, headers=_auth_headers()).json()
+    _invalidate_sidebar("friends", "requests")
+    return _post(f"{BACKEND_URL}/social/friends/accept", json={"request_id": rid}, headers=_auth_headers()).json()
 
 def remove_friend(friend_id: int):
-    return requests.post(f"{BACKEND_URL}/social/friends/remove", json={"friend_id": friend_id}, headers=_auth_headers()).json()
+    _invalidate_sidebar("friends", "groups")
+    return _post(f"{BACKEND_URL}/social/friends/remove", json={"friend_id": friend_id}, headers=_auth_headers()).json()
 
 def get_or_create_dm(fid: int):
-    res = requests.post(f"{BACKEND_URL}/social/friends/dm", json={"friend_id": fid}, headers=_auth_headers()).json()
+    res = _post(f"{BACKEND_URL}/social/friends/dm", json={"friend_id": fid}, headers=_auth_headers()).json()
     return res.get("group_id")
 
+def fetch_bootstrap(etag: str | None = None) -> Dict[str, Any] | None:
+    """侧边栏需要的个人信息 / 群 / 好友 / 好友请求一次取回；带上 etag 且没有变化时返回 None (后端 304)"""
+    headers = _auth_headers()
+    if etag:
+        headers["If-None-Match"] = etag
+    r = _get(f"{BACKEND_URL}/social/bootstrap", headers=headers, timeout=15)
+    if r.status_code == 304:
+        return None
+    if r.status_code != 200:
+        raise RuntimeError(r.json().get("detail", f"Error {r.status_code}"))
+    data = r.json()
+    data["etag"] = r.headers.get("ETag")
+    return data
+
 # --- 群组与聊天 (修复导入错误) ---
 def fetch_groups():
-    r = requests.get(f"{BACKEND_URL}/social/groups", headers=_auth_headers())
+    r = _get(f"{BACKEND_URL}/social/groups", headers=_auth_headers())
     return r.json().get("groups", [])
 
 def create_group(name: str, member_codes: List[str]):
-    return requests.post(f"{BACKEND_URL}/social/groups", json={"name": name, "member_codes": member_codes}, headers=_auth_headers()).json()
+    _invalidate_sidebar("groups")
+    return _post(f"{BACKEND_URL}/social/groups", json={"name": name, "member_codes": member_codes}, headers=_auth_headers()).json()
 
 def fetch_group_messages(gid: str):
-    r = requests.get(f"{BACKEND_URL}/social/groups/{gid}/messages", headers=_auth_headers())
+    r = _get(f"{BACKEND_URL}/social/groups/{gid}/messages", headers=_auth_headers())
     return r.json().get("messages", [])
 
+def fetch_group_message_page(gid: str, before_id: int | None = None, after_id: int | None = None,
+                             limit: int | None = None, etag: str | None = None) -> Dict[str, Any] | None:
+    """按游标取一页消息；带上 etag 且群里没有新消息时返回 None (后端 304)"""
+    params = {k: v for k, v in {"before_id": before_id, "after_id": after_id, "limit": limit}.items() if v is not None}
+    headers = _auth_headers()
+    if etag:
+        headers["If-None-Match"] = etag
+    r = _get(f"{BACKEND_URL}/social/groups/{gid}/messages", params=params, headers=headers, timeout=15)
+    if r.status_code == 304:
+        return None
+    if r.status_code != 200:
+        raise RuntimeError(r.json().get("detail", f"Error {r.status_code}"))
+    data = r.json()
+    data["etag"] = r.headers.get("ETag")
+    return data
+
+def mark_group_read(gid: str, message_id: int | None = None):
+    """推进已读游标 (默认到最新)，返回 {"last_read_message_id", "unread_count"}"""
+    r = _post(f"{BACKEND_URL}/social/groups/{gid}/read", json={"message_id": message_id}, headers=_auth_headers(), timeout=15)
+    return r.json() if r.status_code == 200 else {}
+
 def send_group_message(gid: str, content: str):
-    return requests.post(f"{BACKEND_URL}/social/groups/{gid}/messages", json={"content": content}, headers=_auth_headers())
+    return _post(f"{BACKEND_URL}/social/groups/{gid}/messages", json={"content": content}, headers=_auth_headers())
 
 def fetch_group_members_detailed(group_id: str):
-    r = requests.get(f"{BACKEND_URL}/social/groups/{group_id}/members", headers=_auth_headers())
+    r = _get(f"{BACKEND_URL}/social/groups/{group_id}/members", headers=_auth_headers())
     return r.json().get("members", [])
 
 def fetch_group_members(group_id: str) -> List[str]:
@@ -78,34 +148,36 @@ def fetch_group_members(group_id: str) -> List[str]:
     return [m["username"] for m in members]
 
 def join_group(gid: str):
-    return requests.post(f"{BACKEND_URL}/social/groups/{gid}/join", headers=_auth_headers())
+    _invalidate_sidebar("groups")
+    return _post(f"{BACKEND_URL}/social/groups/{gid}/join", headers=_auth_headers())
 
 def leave_group(gid: str):
-    return requests.post(f"{BACKEND_URL}/social/groups/{gid}/leave", headers=_auth_headers())
+    _invalidate_sidebar("groups")
+    return _post(f"{BACKEND_URL}/social/groups/{gid}/leave", headers=_auth_headers())
 
 def invite_group_member(gid: str, c: str):
-    return requests.post(f"{BACKEND_URL}/social/groups/{gid}/invite", json={"friend_code": c}, headers=_auth_headers())
+    return _post(f"{BACKEND_URL}/social/groups/{gid}/invite", json={"friend_code": c}, headers=_auth_headers())
 
 def kick_group_member(gid: str, uid: int):
-    return requests.post(f"{BACKEND_URL}/social/groups/{gid}/kick", json={"user_id": uid}, headers=_auth_headers())
+    return _post(f"{BACKEND_URL}/social/groups/{gid}/kick", json={"user_id": uid}, headers=_auth_headers())
 
 # --- 首页搜索与 AI ---
 def search_trails(query: str):
-    r = requests.get(f"{BACKEND_URL}/trails/search", params={"q": query}, headers=_auth_headers())
+    r = _get(f"{BACKEND_URL}/trails/search", params={"q": query}, headers=_auth_headers())
     return r.json()
 
 def ask_ai_recommend(gid: str):
-    return requests.post(f"{BACKEND_URL}/social/groups/{gid}/ai/recommend_routes", headers=_auth_headers())
+    return _post(f"{BACKEND_URL}/social/groups/{gid}/ai/recommend_routes", headers=_auth_headers())
 
 def send_planning_message(message: str) -> str:
-    r = requests.post(f"{BACKEND_URL}/chat", json={"user_message": message}, timeout=15)
+    r = _post(f"{BACKEND_URL}/chat", json={"user_message": message}, timeout=15)
     r.raise_for_status()
     return r.json().get("reply", "")
 
 # --- 通用 API 调用 (加固错误捕获) ---
 def api_get(endpoint: str, params: dict = None):
     url = f"{BACKEND_URL}{endpoint}"
-    r = requests.get(url, params=params, headers=_auth_headers(), timeout=15)
+    r = _get(url, params=params, headers=_auth_headers(), timeout=15)
     if r.status_code != 200:
         try: detail = r.json().get("detail", "GET Error")
         except: detail = f"Status {r.status_code}"
@@ -114,7 +186,7 @@ def api_get(endpoint: str, params: dict = None):
 
 def api_post(endpoint: str, json_data: dict = None):
     url = f"{BACKEND_URL}{endpoint}"
-    r = requests.post(url, json=json_data, headers=_auth_headers(), timeout=15)
+    r = _post(url, json=json_data, headers=_auth_headers(), timeout=15)
     if r.status_code != 200:
         try: detail = r.json().get("detail", "POST Error")
         except: detail = f"Status {r.status_code}"
@@ -68,6 +68,8 @@ def render_auth_gate():
                     if st.session_state.get("authenticated"):
                         cookie_manager.set("saved_username", st.session_state.user, max_age=30*24*60*60, key="login_set_u")
                         cookie_manager.set("saved_usercode", st.session_state.user_code, max_age=30*24*60*60, key="login_set_c")
+                        if st.session_state.get("auth_token"):
+                            cookie_manager.set("saved_token", st.session_state.auth_token, max_age=7*24*60*60, key="login_set_t")
                         st.success("Welcome back!")
                         st.rerun()
                 except Exception as e:
@@ -88,19 +90,40 @@ def render_auth_gate():
                     st.error(f"Signup Failed: {str(e)}")
                     st.session_state.authenticated = False
 
+def _clear_saved_login(suffix: str) -> None:
+    cookie_manager.set("saved_username", "", max_age=0, key=f"{suffix}_clear_u")
+    cookie_manager.set("saved_usercode", "", max_age=0, key=f"{suffix}_clear_c")
+    cookie_manager.set("saved_token", "", max_age=0, key=f"{suffix}_clear_t")
+    for k in list(st.session_state.keys()):
+        del st.session_state[k]
+
 def main() -> None:
     inject_theme()
     init_state()
 
+    # 后端返回过 401 (token 过期 / 用户被删除或换了 user_code)：清掉保存的登录状态，重新登录
+    if st.session_state.get("auth_expired"):
+        rejected = (st.session_state.get("user"), st.session_state.get("user_code"), st.session_state.get("auth_token"))
+        _clear_saved_login("expired")
+        init_state()
+        # cookie 的删除要等组件回传才生效，这期间不要用同一份凭据再恢复一次登录
+        st.session_state.rejected_login = rejected
+        st.warning("Your session has expired. Please sign in again.")
+        render_auth_gate()
+        return
+
     cookies = cookie_manager.get_all()
 
     # 从 Cookie 恢复状态 (带严格的非空拦截)
     if not st.session_state.get("authenticated"):
         saved_user = cookies.get("saved_username")
         saved_code = cookies.get("saved_usercode")
-        if saved_user and saved_code and saved_user != "None" and saved_user.strip() != "":
+        saved = (saved_user, saved_code, cookies.get("saved_token") or None)
+        if (saved_user and saved_code and saved_user != "None" and saved_user.strip() != ""
+                and saved != st.session_state.get("rejected_login")):
             st.session_state.user = saved_user
             st.session_state.user_code = saved_code
+            st.session_state.auth_token = cookies.get("saved_token") or None
             st.session_state.authenticated = True
 
     user = st.session_state.get("user")
@@ -145,10 +168,7 @@ def main() -> None:
         
         # 终极登出逻辑
         if st.button("🚪 Logout", use_container_width=True, type="secondary"):
-            cookie_manager.set("saved_username", "", max_age=0, key="logout_clear_u")
-            cookie_manager.set("saved_usercode", "", max_age=0, key="logout_clear_c")
-            for k in list(st.session_state.keys()):
-                del st.session_state[k]
+            _clear_saved_login("logout")
             time.sleep(0.5)
             st.rerun()
             
@@ -1,6 +1,5 @@
 import streamlit as st
 from datetime import datetime as _dt
-from streamlit_autorefresh import st_autorefresh
 
 from app.views.chat import render_rich_message
 from app.components.common import render_message_bubble
@@ -10,8 +9,6 @@ def render_ai_interface(username: str):
     """渲染 AI 个人助手聊天界面"""
     st.title("🤖 Trail Assistant")
     st.caption("Plan your next summit with real-time AI guidance.")
-    
-    st_autorefresh(interval=5000, key="ai_home_refresh")
 
     if "messages" not in st.session_state:
         st.session_state.messages = []
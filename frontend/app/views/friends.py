@@ -75,22 +75,37 @@ def render_add_friend_page(username: str = ""):
         
         friend_code = st.text_input("Enter UserID / Username", placeholder="e.g. 1001 or Alice")
         
+        # 输入前缀时给出匹配的用户，点一下直接发送请求
+        prefix = friend_code.strip()
+        if prefix:
+            try:
+                matches = api_get("/social/users/search", {"q": prefix}).get("users", [])
+            except Exception:
+                matches = []
+            for m in matches:
+                if st.button(f"➕ {m['username']} (ID: {m['user_code']})", key=f"suggest_{m['id']}", use_container_width=True):
+                    _send_friend_request(m["user_code"])
+        
         if st.button("Send Request", type="primary"):
-            if not friend_code.strip():
+            if not prefix:
                 st.warning("Please enter a UserID or Username.")
             else:
-                try:
-                    res = api_post("/social/friends/add", {"friend_code": friend_code.strip()})
-                    if res.get("message") == "Exists":
-                        st.info("⏳ Request is pending. Waiting for them to accept.")
-                    else:
-                        st.success(f"✅ Request sent to {res.get('username', 'user')}! They need to accept it.")
-                
-                except Exception as e:
-                    err_msg = str(e).lower()
-                    if "404" in err_msg or "not found" in err_msg:
-                        st.error(f"❌ User '{friend_code.strip()}' does not exist.")
-                    elif "cannot add self" in err_msg:
-                        st.error("🚫 You cannot add yourself.")
-                    else:
-                        st.error(f"⚠️ Error: {str(e)}")
\ No newline at end of file
+                _send_friend_request(prefix)
+
+
+def _send_friend_request(friend_code: str):
+    try:
+        res = api_post("/social/friends/add", {"friend_code": friend_code})
+        if res.get("message") == "Exists":
+            st.info("⏳ Request is pending. Waiting for them to accept.")
+        else:
+            st.success(f"✅ Request sent to {res.get('username', 'user')}! They need to accept it.")
+    
+    except Exception as e:
+        err_msg = str(e).lower()
+        if "404" in err_msg or "not found" in err_msg:
+            st.error(f"❌ User '{friend_code}' does not exist.")
+        elif "cannot add self" in err_msg:
+            st.error("🚫 You cannot add yourself.")
+        else:
+            st.error(f"⚠️ Error: {str(e)}")
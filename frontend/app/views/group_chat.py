@@ -1,32 +1,83 @@
 import streamlit as st
-from streamlit_autorefresh import st_autorefresh
 
 from app.views.chat import render_rich_message, normalize_group_message 
+from app.components.live_events import listen_group_events
 from app.core.api import (
-    fetch_group_members_detailed, fetch_groups, leave_group, 
+    fetch_group_members_detailed, leave_group, 
     ask_ai_recommend, remove_friend, kick_group_member, 
-    invite_group_member, fetch_group_messages, send_group_message, join_group
+    invite_group_member, fetch_group_message_page, send_group_message, join_group,
+    mark_group_read
 )
 
+def _message_cache(group_id: str) -> dict:
+    """
+    每个群在 session_state 里保留一份本地消息列表。
+    第一次打开拉最新一页，之后只用 after_id 拉增量；没有新消息时后端直接 304。
+    """
+    key = f"chat_cache_{group_id}"
+    cache = st.session_state.get(key)
+    if cache is None:
+        page = fetch_group_message_page(group_id)
+        cache = {"messages": page.get("messages", []), "etag": page.get("etag"), "has_older": page.get("has_more", False)}
+        st.session_state[key] = cache
+        return cache
+
+    while True:
+        latest = cache["messages"][-1]["id"] if cache["messages"] else 0
+        page = fetch_group_message_page(group_id, after_id=latest, etag=cache["etag"])
+        if page is None:
+            break
+        cache["messages"].extend(page.get("messages", []))
+        cache["etag"] = page.get("etag")
+        if not page.get("has_more"):
+            break
+    return cache
+
+def _mark_read(group_id: str, cache: dict) -> None:
+    """正在看的群：最新一条消息变化时才推进已读游标，并把侧边栏的未读角标清零"""
+    if not cache["messages"]:
+        return
+    latest = cache["messages"][-1]["id"]
+    if cache.get("read_id") == latest:
+        return
+    try:
+        mark_group_read(group_id, latest)
+    except Exception:
+        return
+    cache["read_id"] = latest
+    for g in st.session_state.get("sidebar_data", {}).get("groups", []):
+        if isinstance(g, dict) and str(g.get("id")) == str(group_id):
+            g["unread_count"] = 0
+
+def _load_older(group_id: str) -> None:
+    cache = st.session_state.get(f"chat_cache_{group_id}")
+    if not cache or not cache["messages"]:
+        return
+    page = fetch_group_message_page(group_id, before_id=cache["messages"][0]["id"])
+    cache["messages"][:0] = page.get("messages", [])
+    cache["has_older"] = page.get("has_more", False)
+
 def render_group_interface(group_id: str, username: str):
     """渲染详细的群聊 / 私聊视图"""
     
-    st_autorefresh(interval=5000, key=f"chat_refresh_{group_id}")
+    # 不再定时刷新：后端推送新消息时才 rerun，rerun 时 _message_cache 只拉增量
+    listen_group_events(group_id)
 
     try:
         members = fetch_group_members_detailed(group_id)
-        all_grps = fetch_groups()
     except Exception:
-        members, all_grps = [], []
+        members = []
+    # 群名 / 是否私聊直接用侧边栏 bootstrap 缓存的数据，不再单独请求群列表
+    all_grps = st.session_state.get("sidebar_data", {}).get("groups", [])
 
     is_dm = False
     group_name = "Chat"
     for g in all_grps:
         if str(g.get("id")) == str(group_id):
             group_name = g.get("name")
-            if (group_name or "").startswith("DM:"):
+            if g.get("kind") == "dm":
                 is_dm = True
-                group_name = group_name.replace("DM: ", "💬 ")
+                group_name = (group_name or "").replace("DM: ", "💬 ")
             break
     
     head_left, head_right = st.columns([5, 1])
@@ -74,9 +125,17 @@ def render_group_interface(group_id: str, username: str):
 
     with chat_col:
         with st.container(border=True, height=550):
-            try: raw_messages = fetch_group_messages(group_id)
-            except: raw_messages = []
-            
+            try: cache = _message_cache(group_id)
+            except Exception: cache = {"messages": [], "has_older": False}
+            raw_messages = cache["messages"]
+            _mark_read(group_id, cache)
+
+            if cache["has_older"]:
+                if st.button("⬆️ Load earlier messages", key=f"older_{group_id}"):
+                    try: _load_older(group_id)
+                    except Exception: st.toast("Could not load earlier messages")
+                    st.rerun()
+
             if not raw_messages: 
                 st.caption("No messages yet. Say hi to the group!")
             
@@ -25,8 +25,8 @@ def render_groups_page(username: str) -> None:
         # 兼容处理：确保拿到的是列表
         all_groups = raw_groups.get("groups", []) if isinstance(raw_groups, dict) else raw_groups
         
-        # 🔴 核心修复：把 "DM:" 开头的私聊过滤掉，保持群组列表干净
-        display_groups = [g for g in all_groups if isinstance(g, dict) and not (g.get("name") or "").upper().startswith("DM:")]
+        # 🔴 核心修复：把私聊 (kind == "dm") 过滤掉，保持群组列表干净
+        display_groups = [g for g in all_groups if isinstance(g, dict) and g.get("kind", "group") != "dm"]
     except Exception as exc:
         display_groups = []
         st.error(f"Unable to load groups: {exc}")